@@ -1,5 +1,10 @@
 import streamlit as st
 
+from poscope.startup import diagnostics_enabled, start_watcher
+
+# Ingest the POS exports dropped into the watched folder in the background, if enabled
+start_watcher()
+
 pages = [
     st.Page(
         "1_home.py", 
@@ -25,3 +30,9 @@ pages = [
 
 page = st.navigation(pages)
 page.run()
+
+# Hidden diagnostics panel, shown after the page so that it includes the records of this run
+if diagnostics_enabled():
+    # The panel loads pandas, so it is imported only when shown
+    from poscope.widgets import diagnostics_panel
+    diagnostics_panel()
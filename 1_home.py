@@ -1,13 +1,14 @@
 import streamlit as st
-from PIL import Image
+
+from poscope.startup import load_image
 
 
 #-----------------------------------------Settings-----------------------------------------
 
-# Load an image
-favicon = Image.open("static/favicon.ico")
-logo = Image.open("static/logo.png")
-hamburger = Image.open("static/hamburger_on_island.png")
+# Load images (decoded once per process)
+favicon = load_image("favicon.ico")
+logo = load_image("logo.png")
+hamburger = load_image("hamburger_on_island.png")
 
 # Page configuration
 st.set_page_config(
@@ -2,15 +2,20 @@ import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 import pandas as pd
 from io import BytesIO
-import zipfile
-from PIL import Image
 import numpy as np
+import uuid
+
+from poscope import database, dataset, ingest, jobs, registry, synthetic
+from poscope.ingest import cleanup_pos, build_pos_tables, build_syllabus_cube
+from poscope.session import set_session_state_pos, sync_pos_dataset
+from poscope.startup import load_image
+from poscope.widgets import start_job, finished_job
 
 
 #-----------------------------------------Settings-----------------------------------------
 
-# Load an image
-favicon = Image.open("static/favicon.ico")
+# Load an image (decoded once per process)
+favicon = load_image("favicon.ico")
 
 # Page configuration
 st.set_page_config(
@@ -64,167 +69,78 @@ def when_zip_pos_changed() -> None:
     st.session_state["zip_pos_changed"] = True
 
 
-def load_uploaded_zip_pos() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def get_uploaded_zip_pos() -> list[BytesIO]:
     """
-    Load the uploaded zip files and return DataFrames of checkouts, items, and payments.\\
-    Each file of checktouts,csv, items.csv, and payments.csv is concatenated into a single DataFrame respectively.
+    Return the contents of the uploaded zip files.\\
+    They are copied since the uploaded files are released when the file uploader changes,
+    while the background job may still be reading them.
     """
     # load zip files from session state
     zip_files: list[UploadedFile] = st.session_state["uploaded_zip_pos"]
-    # Initialize empty DataFrames
-    df_checkouts = pd.DataFrame()
-    df_items = pd.DataFrame()
-    df_payments = pd.DataFrame()
-    # checkouts.csv, items.csv, payments.csv, and other trivial files in zip_file
-    for zip_file in zip_files:
-        # Streamlit's UploadedFile is a subclass of BytesIO, so it can be read directly
-        with zipfile.ZipFile(zip_file) as zf:
-            # Load the necessary files: checkouts.csv, items.csv, and payments.csv
-            for file in zf.namelist():
-                if file == "checkouts.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_checkouts = pd.concat([df_checkouts, tmp], axis="index")
-                elif file == "items.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_items = pd.concat([df_items, tmp], axis="index")
-                elif file == "payments.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_payments = pd.concat([df_payments, tmp], axis="index")
-    return df_checkouts, df_items, df_payments
-
-
-def cleanup_pos(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    return [BytesIO(zip_file.getvalue()) for zip_file in zip_files]
+
+
+def prepare_pos(df_cus: pd.DataFrame, df_itm: pd.DataFrame, progress=jobs.no_progress) -> dict:
     """
-    Return cleanuped POS data.
+    Precompute the tables derived from POS data and return them with the DataFrames of customers and items.\\
+    The data is also published to the Arrow dataset and the local database when they are enabled,
+    so that other sessions can read it.\\
+    This function runs as a background job, so it must not use session state.
     """
-    # Filter columns
-    df_checkouts = df_checkouts[
-        ["アカウント名", "会計ID", "開始日時", "会計日時", "削除日時", "金額", "客数"]
-    ]
-    df_items = df_items[
-        ["会計ID", "SKU", "バーコード",  "名前", "数量", "金額", "部門"]
-    ]
-    df_payments = df_payments[["会計ID", "支払い方法"]]
-
-    # Drop duplicates
-    df_checkouts = df_checkouts.drop_duplicates()
-    df_items = df_items.drop_duplicates()
-    df_payments = df_payments.drop_duplicates()
-
-    # Delete cancelled records
-    # Non-NA value in "削除日時" means that the record is cancelled
-    cancelled = df_checkouts[["会計ID", "削除日時"]]
-    df_checkouts = df_checkouts[df_checkouts["削除日時"].isna()].drop(columns=["削除日時"])
-    df_items = pd.merge(df_items, cancelled, on="会計ID", how="left")
-    df_items = df_items[df_items["削除日時"].isna()].drop(columns=["削除日時"])
-    df_payments = pd.merge(df_payments, cancelled, on="会計ID", how="left")
-    df_payments = df_payments[df_payments["削除日時"].isna()].drop(columns=["削除日時"])
-
-    # Empty entries in "支払い方法" are change of payment, so remove them
-    df_payments = df_payments[df_payments["支払い方法"].notna()]
-
-    # A negative value in "数量" seems to indicate that the transaction has been cancelled, so remove those records.
-    # While there seems no record with zero value in "数量", remove those records as well.
-    invalid_cnt = df_items.query('数量 <= 0')["会計ID"].to_list()
-    df_checkouts = df_checkouts[~df_checkouts["会計ID"].isin(invalid_cnt)]
-    df_items = df_items[~df_items["会計ID"].isin(invalid_cnt)]
-    df_payments = df_payments[~df_payments["会計ID"].isin(invalid_cnt)]
-
-    # Change the account names to more straightforward ones
-    df_checkouts = df_checkouts.replace({"アカウント名": {"ub396203": "西食堂", "ub396207": "東カフェテリア"}})
-
-    # One-hot encoding on "支払い方法" to cope with multiple payment methods in a single checkout.
-    df_payments = pd.get_dummies(df_payments, columns=["支払い方法"], 
-                                 prefix="", prefix_sep="", dtype="int")
-    df_payments = df_payments.groupby("会計ID").sum().reset_index()
-
-    # Modigy the data types
-    df_checkouts["開始日時"] = pd.to_datetime(df_checkouts["開始日時"]).map(lambda x: x.tz_localize(None))
-    df_checkouts["会計日時"] = pd.to_datetime(df_checkouts["会計日時"]).map(lambda x: x.tz_localize(None))
-    df_checkouts = df_checkouts.astype({"会計ID": "str", "金額": "int", "客数": "int"})
-    df_items = df_items.astype({"会計ID": "str", "SKU": "str", "バーコード": "str", 
-                                "名前": "str", "数量": "int", "金額": "int", "部門": "str"})
-    df_payments = df_payments.astype({"会計ID": "str"})
-
-    # Merge the DataFrames
-    df_customers = pd.merge(df_checkouts, df_payments, on="会計ID", how="inner")
-    df_items = pd.merge(df_customers[["アカウント名", "会計ID", "開始日時", "会計日時"]], df_items, on="会計ID", how="inner")
-
-    return df_customers, df_items
-
-
-def set_session_state_pos(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> None:
+    progress(0.0, "集計表を作成しています...")
+    tables = build_pos_tables(df_cus, df_itm)
+    if dataset.get_dataset_dir() is not None:
+        progress(0.5, "Arrowデータセットに書き込んでいます...")
+        # The session keeps this version, so it does not load the data it has just written again
+        tables["dataset_version"] = dataset.write_pos(dataset.get_dataset_dir(), df_cus, df_itm)
+    # Keep the history in the local database when it is enabled
+    if database.get_db_path() is not None:
+        progress(0.75, "ローカルデータベースに書き込んでいます...")
+        database.write_pos(database.get_db_path(), df_cus, df_itm)
+    return tables
+
+
+def load_pos_job(zip_files: list[BytesIO], progress=jobs.no_progress) -> dict | None:
     """
-    Set the session states related with POS data.
+    Background job to load, clean up, and prepare the uploaded POS data.\\
+    Return `None` if the zip files contain no checkout.
     """
-    # main DataFrames
-    st.session_state["df_customers"] = df_cus
-    st.session_state["df_items"] = df_itm
-
-    # These session states are used to show information about the uploaded POS data
-    st.session_state["west_date_min"] = df_cus.query('アカウント名 == "西食堂"')["開始日時"].min()
-    st.session_state["east_date_min"] = df_cus.query('アカウント名 == "東カフェテリア"')["開始日時"].min()
-    st.session_state["west_date_max"] = df_cus.query('アカウント名 == "西食堂"')["開始日時"].max()
-    st.session_state["east_date_max"] = df_cus.query('アカウント名 == "東カフェテリア"')["開始日時"].max()
-    
-    stores = df_cus["アカウント名"].unique().tolist()
-    if "西食堂" in stores:
-        if "東カフェテリア" in stores:
-            st.session_state["west_pos"] = True
-            st.session_state["east_pos"] = True
-            st.session_state["min_date"] = min(
-                st.session_state["west_date_min"], 
-                st.session_state["east_date_min"]
-            )
-            st.session_state["max_date"] = max(
-                st.session_state["west_date_max"], 
-                st.session_state["east_date_max"]
-            )
-        else:
-            st.session_state["west_pos"] = True
-            st.session_state["east_pos"] = False
-            st.session_state["min_date"] = st.session_state["west_date_min"]
-            st.session_state["max_date"] = st.session_state["west_date_max"]
-    else:
-        if "東カフェテリア" in stores:
-            st.session_state["west_pos"] = False
-            st.session_state["east_pos"] = True
-            st.session_state["min_date"] = st.session_state["east_date_min"]
-            st.session_state["max_date"] = st.session_state["east_date_max"]
+    df_checkouts, df_items, df_payments = ingest.read_pos_zips(zip_files, jobs.sub_progress(progress, 0.0, 0.5))
+    if df_checkouts.shape[0] == 0:
+        return None
+    progress(0.5, f"{len(df_checkouts):,}件の会計データをクリーニングしています...")
+    df_cus, df_itm = cleanup_pos(df_checkouts, df_items, df_payments)
+    progress(0.7, f"{len(df_cus):,}件の会計データをクリーニングしました。")
+    return prepare_pos(df_cus, df_itm, jobs.sub_progress(progress, 0.7, 1.0))
 
 
-def get_uploaded_pos_info() -> list[str]:
+# Period of the sample POS data, which is generated by `poscope.synthetic`
+SAMPLE_START = "2024-04-01"
+SAMPLE_DAYS = 365
+
+
+def load_sample_pos_job(progress=jobs.no_progress) -> dict | None:
     """
-    Return information about the uploaded POS data.
+    Background job to generate and prepare the sample POS data.\\
+    The sample is generated in memory in the format exported by Ubiregi, and loaded in the same way as uploaded zip files.
     """
-    messages = []
-    if "df_customers" in st.session_state and st.session_state["west_pos"]:
-        messages.append(
-            f"{st.session_state['west_date_min'].strftime('%Y/%m/%d')}～{st.session_state['west_date_max'].strftime('%Y/%m/%d')}"
-        )
-    else:
-        messages.append("データはありません。")
-    if "df_customers" in st.session_state and st.session_state["east_pos"]:
-        messages.append(
-            f"{st.session_state['east_date_min'].strftime('%Y/%m/%d')}～{st.session_state['east_date_max'].strftime('%Y/%m/%d')}"
-        )
-    else:
-        messages.append("データはありません。")
+    progress(0.0, "サンプルデータを生成しています...")
+    return load_pos_job(synthetic.generate_zips(SAMPLE_START, SAMPLE_DAYS), jobs.sub_progress(progress, 0.2, 1.0))
+
+
+def get_uploaded_pos_info() -> dict[str, str]:
+    """
+    Return information about the uploaded POS data of each store.
+    """
+    if "df_customers" not in st.session_state:
+        return {store: "データはありません。" for store in registry.store_names()}
+    messages = {}
+    for store in st.session_state["store_options"]:
+        if store in st.session_state["store_date_ranges"]:
+            lo, hi = st.session_state["store_date_ranges"][store]
+            messages[store] = f"{lo.strftime('%Y/%m/%d')}～{hi.strftime('%Y/%m/%d')}"
+        else:
+            messages[store] = "データはありません。"
     return messages
 
 
@@ -258,6 +174,10 @@ def set_session_state_syllabus(df_slb_west: pd.DataFrame, df_slb_east: pd.DataFr
     """
     st.session_state["df_syllabus_west"] = df_slb_west
     st.session_state["df_syllabus_east"] = df_slb_east
+    # Syllabus data as an array for the visualize page
+    st.session_state["syllabus_cube"], st.session_state["syllabus_terms"] = build_syllabus_cube(df_slb_west, df_slb_east)
+    # Identifies the uploaded syllabus data in the keys of the forecast page, so corrected data with the same terms is not missed
+    st.session_state["syllabus_version"] = uuid.uuid4().hex
 
     terms = ["SPR", "SMR", "AUT", "WTR"]
     west_cols = sorted([[int(col[:4]), terms.index(col[4:]), col] for col in df_slb_west.columns])
@@ -318,6 +238,10 @@ def set_session_state_calendar(df_cal: pd.DataFrame) -> None:
     Set the session states related with calendar data.
     """
     st.session_state["df_calendar"] = df_cal
+    # Dimension of the dates with the features and the hover text, looked up by the charts and the forecast page
+    st.session_state["calendar_dim"] = ingest.build_calendar_dim(df_cal)
+    # Identifies the uploaded calendar data in the keys of the forecast page, so corrected data with the same dates is not missed
+    st.session_state["calendar_version"] = uuid.uuid4().hex
     st.session_state["calendar_range"] = [
         df_cal["date"].min().strftime("%Y/%m/%d"), 
         df_cal["date"].max().strftime("%Y/%m/%d")
@@ -349,6 +273,9 @@ st.logo(favicon, size="large")
 
 st.header("データアップロード")
 
+# Load the POS data written into the shared Arrow dataset since the last run, ex. from the watched folder
+sync_pos_dataset()
+
 # Upload POS data
 with st.container(border=True):
     st.subheader(":material/point_of_sale: POSデータ")
@@ -360,44 +287,46 @@ with st.container(border=True):
         on_change=when_zip_pos_changed, 
         disabled=True
     )
+    # The data is loaded by a background job, which keeps running across reruns and reloads of the browser
     if st.button(label="使用するデータを決定する", key="button_pos", disabled=button_controller("uploaded_zip_pos")):
-        with st.spinner("データを読み込んでいます...", show_time=True):
-            try:
-                df_checkouts, df_items, df_payments = load_uploaded_zip_pos()
-                if df_checkouts.shape[0] > 0:
-                    df_cus, df_itm = cleanup_pos(df_checkouts, df_items, df_payments)
-                    set_session_state_pos(df_cus, df_itm)
-                    st.session_state["zip_pos_changed"] = False
-                else:
-                    st.error(
-                        """
-                        データの読み込みに失敗しました。\\
-                        アップロードされたファイルには有効なデータが含まれていません。
-                        """
-                    )
-                    st.session_state["zip_pos_changed"] = False
-            except:
-                st.error(
-                    """
-                    データの読み込みに失敗しました。\\
-                    データ形式が正しくない可能性があります。
-                    """
-                )
+        start_job("pos", "POSデータの読み込み", load_pos_job, get_uploaded_zip_pos())
     # Load sample POS data
     if st.button(label="サンプルデータを読み込む", key="button_pos_sample"):
-        with st.spinner("データを読み込んでいます...", show_time=True):
-            df_customers = pd.read_excel("static/demo-customers2024.xlsx")
-            df_items = pd.read_excel("static/demo-items2024.xlsx")
-            set_session_state_pos(df_customers, df_items)
+        start_job("pos", "サンプルデータの読み込み", load_sample_pos_job)
+    # Show the progress of the job, or its result when it has finished
+    job = finished_job("pos")
+    if job is not None:
+        if job["status"] == "failed":
+            st.error(
+                """
+                データの読み込みに失敗しました。\\
+                データ形式が正しくない可能性があります。
+                """
+            )
+        elif job["result"] is None:
+            st.error(
+                """
+                データの読み込みに失敗しました。\\
+                アップロードされたファイルには有効なデータが含まれていません。
+                """
+            )
+            st.session_state["zip_pos_changed"] = False
+        else:
+            set_session_state_pos(job["result"])
+            st.session_state["zip_pos_changed"] = False
     # Information about the uploaded POS data
     messages = get_uploaded_pos_info()
+    lines = "\n".join(f"         - {store}：{message}" for store, message in messages.items())
     st.info(
         f"""
         :material/check_circle: アップロードされているPOSデータ（サンプル）
-         - 西食堂：{messages[0]}
-         - 東カフェテリア：{messages[1]}
+{lines}
         """
     )
+    # History kept in the local database
+    if database.get_db_path() is not None:
+        for store, (lo, hi) in database.get_date_range(database.get_db_path()).items():
+            st.caption(f":material/database: ローカルデータベース（{store}）：{lo.strftime('%Y/%m/%d')}～{hi.strftime('%Y/%m/%d')}")
 
 # space
 st.write("")
@@ -1,17 +1,23 @@
 import streamlit as st
 import pandas as pd
 import datetime
-from PIL import Image
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from poscope import bands, database, dataset, registry, visualize
+from poscope.instrument import instrument
+from poscope.session import query_database, sync_pos_dataset
+from poscope.startup import load_image
+from poscope.visualize import filter_pos, process_basket_anchor
+from poscope.widgets import download_dataframe
+
 
 #-----------------------------------------Settings-----------------------------------------
 
 # Load images
-favicon = Image.open("static/favicon.ico")
-sleeping = Image.open("static/sleeping_hamburger.png")
-sleeping_no_syllabus = Image.open("static/sleeping_hamburger_no_syllabus_data.png")
+favicon = load_image("favicon.ico")
+sleeping = load_image("sleeping_hamburger.png")
+sleeping_no_syllabus = load_image("sleeping_hamburger_no_syllabus_data.png")
 
 # Page configuration
 st.set_page_config(
@@ -40,311 +46,284 @@ st.set_page_config(
 
 #------------Universal------------
 
-def convert_for_download(df: pd.DataFrame, index_flag: bool) -> bytes:
+def filter_items(df_itm: pd.DataFrame | None, date: tuple[datetime.date], business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Filter the DataFrame of items by date, business hours, and store.\\
+    When the Arrow dataset is enabled, `df_itm` is `None` and the items are read from the dataset instead,
+    where only the files of the store and the months in range are opened.
+    """
+    directory = dataset.get_dataset_dir()
+    if directory is not None:
+        df_itm = dataset.read_pos(directory, "items", date, store)
+        if df_itm.empty:
+            return df_itm
+    return filter_pos(df_itm, date, business_hours, store)
+
+
+def get_option(name: str, n: int):
     """
-    Convert the DataFrame to a CSV format encoded in Shift-JIS for download.\\
-    The `index` parameter determines whether to include the index in the CSV.\\
-    The option of `encoding` in `pd.DataFrame.to_csv()` is not supported when `path_or_buf` is `None`.
+    Return the option `name` ("date", "bsh", or "store") of the section `n`.\\
+    When the linked filters are enabled, the option shared by all sections is returned instead.
     """
-    return df.to_csv(index=index_flag).encode("shift-jis")
+    if st.session_state.get("linked", False):
+        return st.session_state[f"{name}0"]
+    return st.session_state[f"{name}{n}"]
+
+
+def get_single_store(n: int) -> str:
+    """
+    Return the store of the section `n`, which shows one store at a time and has no option of all stores.\\
+    When the linked store is all stores, the store of the section itself (or the first store) is returned instead.
+    """
+    store = get_option("store", n)
+    if store == registry.ALL_STORES:
+        return st.session_state.get(f"store{n}", st.session_state["store_options"][0])
+    return store
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def filter_view(_df: pd.DataFrame | None, kind: str, pos_version: str, date: tuple[datetime.date],
+                business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Filter the DataFrame of customers (`kind="customers"`) or items (`kind="items"`) by date, business hours, and store.\\
+    `_df` is not hashed by `@st.cache_data`; `pos_version` identifies the uploaded POS data instead,
+    so the sections with the same options (ex. all sections with the linked filters) share one filtered DataFrame,
+    which is neither filtered again on reruns nor kept in session state for each section.
+    """
+    if kind == "items":
+        return filter_items(_df, date, business_hours, store)
+    return filter_pos(_df, date, business_hours, store)
+
+
+def get_section_view(df: pd.DataFrame, n: int, kind: str) -> pd.DataFrame:
+    """
+    Return the DataFrame of customers (`kind="customers"`) or items (`kind="items"`) filtered for the section `n`.\\
+    When the linked filters are enabled, the options shared by all sections are used.
+    """
+    return filter_view(
+        df, kind, st.session_state["pos_version"], tuple(get_option("date", n)), get_option("bsh", n), get_option("store", n)
+    )
 
 
 #---Number of customers by time of day---
 
+@instrument
 def process_cus1(df_cus: pd.DataFrame):
     """
     Filter the DataFrame based on the selected options and return a DataFrame for visualization of number of customers by time of day.\\
     Return an empty DataFrame if no valid data is found.
     """
     # Load options from session state
-    date = st.session_state["date1"]
     span = st.session_state["span1"]
-    business_hours = st.session_state["bsh1"]
-    store = st.session_state["store1"]
-    # Date inputs
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    # Filter the DataFrame by date and store
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    # Resample the number of customers by span
-    df_cus = df_cus.resample(span, on="開始日時")["客数"].sum()
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
+    date = get_option("date", 1)
+    business_hours = get_option("bsh", 1)
+    store = get_single_store(1)
+    if database.get_db_path() is not None:
+        # The local database returns the bins of the span, so only the empty bins are filled here
+        df_cus = query_database("customers_per_span", tuple(date), store, int(pd.Timedelta(span).total_seconds()))
+        if df_cus.empty:
+            return pd.DataFrame()
+        counts = df_cus.set_index("開始日時")["客数"].asfreq(span, fill_value=0)
     else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    # If the sum of customers is zero, there is nothing to visualize, so return an empty DataFrame
-    if df_cus.sum() == 0:
-        return pd.DataFrame()
-    df_cus = df_cus.to_frame()
-    df_cus["日付"] = df_cus.index.date
-    df_cus["時間"] = df_cus.index.time
-    df_cus = df_cus.set_index(["日付", "時間"])
-    df_cus = df_cus.unstack(level=0)
-    df_cus.index = list(map(lambda x: x.strftime("%H:%M"), df_cus.index))
-    df_cus.columns = df_cus.columns.droplevel(0)
-    return df_cus
+        # Business hours are applied after resampling to keep the bins of the last span,
+        # so the view of the linked filters (already cut to business hours) is not used here
+        left_date = pd.Timestamp(date[0])
+        right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
+        df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
+        df_cus = df_cus[df_cus["アカウント名"] == store]
+        if df_cus.empty:
+            return pd.DataFrame()
+        counts = visualize.resample_customers(df_cus, span)
+    return visualize.customers_by_time(counts, business_hours)
 
 
 #----Total number of customers per day----
 
+@instrument
 def process_cus2(df_cus: pd.DataFrame):
     """
     Filter the DataFrame based on the selected options and return a DataFrame for visualization of total number of customers per day.\\
     Return an empty DataFrame if no valid data is found.
     """
-    # Load options from session state
-    date: tuple[datetime.date] = st.session_state["date2"]
-    business_hours = st.session_state["bsh2"]
-    store = st.session_state["store2"]
-    # Date inputs
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    # Filter the DataFrame by date and store
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    df_cus = df_cus.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
+    # Filter the DataFrame by date, business hours, and store
+    if database.get_db_path() is not None:
+        # Customers per store and day aggregated in the local database
+        df_cus = query_database("customers_per_day", tuple(get_option("date", 2)), get_option("bsh", 2), get_option("store", 2))
     else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    df_cus = df_cus.reset_index(drop=False)
+        df_cus = get_section_view(df_cus, 2, "customers")
     if df_cus.empty:
         return pd.DataFrame()
-    df_cus = df_cus.groupby("アカウント名").resample("1D", on="開始日時")["客数"].sum()
-    df_cus = df_cus.to_frame().unstack(level=0)
-    df_cus.columns = df_cus.columns.droplevel(0)
-    return df_cus
+    return visualize.sum_per_day(df_cus, "客数")
 
 
 #---------Ratio of payment methods---------
 
+@instrument
 def filter_pm(df_cus: pd.DataFrame) -> pd.DataFrame:
     """
     Filter the DataFrame and return a DataFrame for visualization of the ratio of payment methods.
     It does not exclude records with multiple payment methods, 
     so the sum of the total counts is not necessarily equal to the total number of customers.
     """
-    # Load options from session state
-    date = st.session_state["date3"]
-    business_hours = st.session_state["bsh3"]
-    store = st.session_state["store3"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    df_cus = df_cus.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
-    else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    df_cus = df_cus.reset_index(drop=False)
-    pms = list(set(df_cus.columns) - set(["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数"]))
-    df_pm = df_cus[pms] * df_cus["客数"].values.reshape(-1, 1)
-    df_pm = df_pm.sum(axis="index").to_frame(name="合計利用者数").reset_index(names=["支払い方法"])
-    return df_pm
+    if database.get_db_path() is not None:
+        return query_database("payment_methods", tuple(get_option("date", 3)), get_option("bsh", 3), get_option("store", 3))
+    # Filter the DataFrame by date, business hours, and store
+    return visualize.payment_methods(get_section_view(df_cus, 3, "customers"))
 
 #--------------Sales by item---------------
 
+@instrument
 def process_itm1(df_itm: pd.DataFrame):
     """
     Filter the DataFrame based on the selected options and return a DataFrame for visualization of sales by item.\\
     If no valid data is found, return an empty DataFrame.
     """
     # Load options from session state
-    date: tuple[datetime.date] = st.session_state["date4"]
-    business_hours = st.session_state["bsh4"]
-    store = st.session_state["store4"]
     aggregation = st.session_state["aggr4"]
     method = st.session_state["mthd4"]
     item = st.session_state["item4"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    if method == "名前":
-        df_itm = df_itm[df_itm["名前"] == item]
-    elif method == "バーコード":
-        df_itm = df_itm[df_itm["バーコード"] == item]
-    elif method == "SKU":
-        df_itm = df_itm[df_itm["SKU"] == item]
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
+    if database.get_db_path() is not None:
+        # Sales of the item per store and day aggregated in the local database
+        df_itm = query_database(
+            "items_per_day", tuple(get_option("date", 4)), get_option("bsh", 4), get_option("store", 4), method, item, aggregation
+        )
     else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
+        # Filter the DataFrame by date, business hours, and store
+        df_itm = visualize.select_items(get_section_view(df_itm, 4, "items"), method, item)
     if df_itm.empty:
         return pd.DataFrame()
-    df_itm = df_itm.groupby("アカウント名").resample("1D", on="開始日時")[aggregation].sum()
-    df_itm = df_itm.to_frame().unstack(level=0)
-    df_itm.columns = df_itm.columns.droplevel(0)
-    return df_itm
+    return visualize.sum_per_day(df_itm, aggregation)
 
 
+@instrument
 def candidates_itm1(df_itm: pd.DataFrame):
     """
     Return a list of possible candidates of items based on the selected options.
     """
     # Load options from session state
-    date: tuple[datetime.date] = st.session_state["date4"]
-    business_hours = st.session_state["bsh4"]
-    store = st.session_state["store4"]
     method = st.session_state["mthd4"]
-    if len(date) != 2:
+    if len(get_option("date", 4)) != 2:
         return []
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    if method == "名前":
-        candidates = df_itm["名前"].unique().tolist()
-    elif method == "バーコード":
-        candidates = df_itm["バーコード"].unique().tolist()
-    elif method == "SKU":
-        candidates = df_itm["SKU"].unique().tolist()
-    return candidates
+    if database.get_db_path() is not None:
+        return query_database("item_candidates", tuple(get_option("date", 4)), get_option("bsh", 4), get_option("store", 4), method)
+    # Filter the DataFrame by date, business hours, and store
+    return visualize.item_candidates(get_section_view(df_itm, 4, "items"), method)
 
 #------------Sales by department------------
 
+@instrument
 def process_itm2(df_itm: pd.DataFrame):
     """
     Filter the DataFrame based on the selected options and return a DataFrame for visualization of sales by department.\\
     If no valid data is found, return an empty DataFrame.
     """
     # Load options from session state
-    date: tuple[datetime.date] = st.session_state["date5"]
-    business_hours = st.session_state["bsh5"]
-    store = st.session_state["store5"]
     aggregation = st.session_state["aggr5"]
     department = st.session_state["dpmt5"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm[df_itm["部門"] == department]
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
+    if database.get_db_path() is not None:
+        # Sales of the department per store and day aggregated in the local database
+        df_itm = query_database(
+            "items_per_day", tuple(get_option("date", 5)), get_option("bsh", 5), get_option("store", 5), "部門", department, aggregation
+        )
     else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
+        # Filter the DataFrame by date, business hours, and store
+        df_itm = visualize.select_items(get_section_view(df_itm, 5, "items"), "部門", department)
     if df_itm.empty:
         return pd.DataFrame()
-    df_itm = df_itm.groupby("アカウント名").resample("1D", on="開始日時")[aggregation].sum()
-    df_itm = df_itm.to_frame().unstack(level=0)
-    df_itm.columns = df_itm.columns.droplevel(0)
-    return df_itm
+    return visualize.sum_per_day(df_itm, aggregation)
 
 
+@instrument
 def candidates_itm2(df_itm: pd.DataFrame):
     """
     Return a list of possible candidates of departments based on the selected options.
     """
-    # Load options from session state
-    date: tuple[datetime.date] = st.session_state["date5"]
-    business_hours = st.session_state["bsh5"]
-    store = st.session_state["store5"]
-    if len(date) != 2:
+    if len(get_option("date", 5)) != 2:
         return []
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    candidates = df_itm["部門"].unique().tolist()
-    return candidates
+    if database.get_db_path() is not None:
+        return query_database("item_candidates", tuple(get_option("date", 5)), get_option("bsh", 5), get_option("store", 5), "部門")
+    # Filter the DataFrame by date, business hours, and store
+    return visualize.item_candidates(get_section_view(df_itm, 5, "items"), "部門")
+
+#------------Co-purchase analysis------------
+
+@st.cache_data(show_spinner=False, max_entries=32)
+@instrument
+def process_basket(_df_itm: pd.DataFrame, pos_version: str, date: tuple[datetime.date],
+                   business_hours: str, store: str, method: str) -> tuple[pd.DataFrame, pd.Series, int]:
+    """
+    Filter the DataFrame based on the given options and return the co-purchase statistics of item pairs,
+    the number of checkouts containing each item, and the total number of checkouts.\\
+    `_df_itm` is not hashed by `@st.cache_data`; `pos_version` identifies the uploaded POS data instead,
+    so the results are cached per POS data, date range, business hours, store, and granularity.
+    """
+    return visualize.basket(filter_items(_df_itm, date, business_hours, store), method)
+
+#--------Checkout load and duration--------
+
+@instrument
+def process_queue() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Slice the checkout load and duration precomputed at upload based on the selected options.\\
+    Return a DataFrame of the average and maximum number of concurrent checkouts by time of day,
+    and a DataFrame of the ratio of checkout durations by 10-minute slot.
+    If no valid data is found, return empty DataFrames.
+    """
+    return visualize.checkout_queue(
+        st.session_state["df_queue_load"], st.session_state["df_queue_duration"],
+        get_option("date", 7), get_option("bsh", 7), get_single_store(7)
+    )
+
+#-------------Revenue analysis-------------
+
+@instrument
+def process_revenue() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return a DataFrame of daily sales, average sales per checkout, and sales per customer of each store,
+    and a DataFrame of sales by department, both from the sales cube.\\
+    If no valid data is found, return empty DataFrames.
+    """
+    df_cube = visualize.slice_sales_cube(
+        st.session_state["df_sales_cube"], get_option("date", 8), get_option("bsh", 8), get_option("store", 8)
+    )
+    return visualize.revenue(df_cube)
 
 #---------------Syllabus data---------------
 
+@instrument
 def candidates_syl() -> list[str]:
     """
     Get a list of possible candidates of academic years for the syllabus data.
     """
-    # Get syllabus data from session state
-    df_syl_west: pd.DataFrame = st.session_state["df_syllabus_west"]
-    df_syl_east: pd.DataFrame = st.session_state["df_syllabus_east"]
-    # Get years from the columns
-    west_years = df_syl_west.columns.str[:4].astype(int).tolist()
-    east_years = df_syl_east.columns.str[:4].astype(int).tolist()
-    years = sorted(set(west_years + east_years))
-    return [str(year) + "年度" for year in years]
+    # Terms are sorted in chronological order at upload
+    return visualize.syllabus_years(st.session_state["syllabus_terms"])
 
 
-def sort_term(terms: list[str]) -> list[str]:
+@instrument
+def process_syllabus():
     """
-    Sort terms in chronological order.
+    Slice the syllabus array (campus × weekday × period × term) based on the selected options
+    and return a list of west and east DataFrames for visualization of syllabus data.\\
+    If no valid data is found, return a list of empty DataFrames.
     """
-    seasons = ["SPR", "SMR", "AUT", "WTR"]
-    sorted_terms = sorted(terms, key=lambda x: (int(x[:4]), seasons.index(x[4:])))
-    return sorted_terms
+    return visualize.syllabus_by_weekday(
+        st.session_state["syllabus_cube"], st.session_state["syllabus_terms"],
+        st.session_state["class_period"], st.session_state["year"]
+    )
 
 
-def process_syllabus():
+@instrument
+def process_syllabus_traffic() -> dict[str, pd.DataFrame]:
     """
-    Filter west and east syllabus DataFrames based on the selected options and return a list of DataFrames for visualization of syllabus data.\\
-    If no valid data is found, return a list of empty DataFrames.
+    Join the syllabus data with the number of customers at lunch (11:00-14:00) for each term,
+    and return a DataFrame for each store with a campus.\\
+    If no valid data is found for a store, its DataFrame is empty.
     """
-    # Get syllabus data from session state
-    df_syl_west: pd.DataFrame = st.session_state["df_syllabus_west"].copy()
-    df_syl_east: pd.DataFrame = st.session_state["df_syllabus_east"].copy()
-    # Get options from session state
-    class_period = st.session_state["class_period"]
-    year = st.session_state["year"]
-    if class_period == [] or year == []:
-        return [pd.DataFrame()] * 2
-    else:
-        class_period_num = [int(cp[0]) for cp in class_period]
-        year_num = [y[:4] for y in year]
-        # Filter the DataFrame by class period
-        df_syl_west_filtered = df_syl_west.loc[(["月", "火", "水", "木", "金"], class_period_num), :]
-        df_syl_east_filtered = df_syl_east.loc[(["月", "火", "水", "木", "金"], class_period_num), :]
-        # Filter the DataFrame by year
-        df_syl_west_filtered = df_syl_west_filtered.loc[:, df_syl_west_filtered.columns.str[:4].isin(year_num)]
-        df_syl_east_filtered = df_syl_east_filtered.loc[:, df_syl_east_filtered.columns.str[:4].isin(year_num)]
-        # Group by day of the week and sum the values
-        df_syl_west_filtered = df_syl_west_filtered.groupby(by="曜日").sum()
-        df_syl_east_filtered = df_syl_east_filtered.groupby(by="曜日").sum()
-        # Sort indices
-        df_syl_west_filtered = df_syl_west_filtered.reindex(index=["月", "火", "水", "木", "金"])
-        df_syl_east_filtered = df_syl_east_filtered.reindex(index=["月", "火", "水", "木", "金"])
-        # Sort columns
-        west_cols = sort_term(df_syl_west_filtered.columns.tolist())
-        east_cols = sort_term(df_syl_east_filtered.columns.tolist())
-        df_syl_west_filtered = df_syl_west_filtered.reindex(columns=west_cols)
-        df_syl_east_filtered = df_syl_east_filtered.reindex(columns=east_cols)
-        return [df_syl_west_filtered, df_syl_east_filtered]
+    return visualize.syllabus_traffic(
+        st.session_state["syllabus_cube"], st.session_state["syllabus_terms"],
+        st.session_state["calendar_dim"], st.session_state["df_sales_cube"],
+        st.session_state["class_period"], st.session_state["year"]
+    )
 
 
 #-----------------------------------------Contents-----------------------------------------
@@ -354,185 +333,247 @@ st.logo(favicon, size="large")
 
 st.header("データの可視化")
 
+# Load the POS data written into the shared Arrow dataset since the last run, ex. from the watched folder
+sync_pos_dataset()
+
 # Check if the POS data has been uploaded
 if "df_customers" not in st.session_state:
     st.error(":material/error: POSデータがアップロードされていません。")
     st.stop() # Stop executing
 
 # Load data from session states
-df_cus = st.session_state["df_customers"].copy()
-df_itm = st.session_state["df_items"].copy()
+# They are not copied, since the sections only filter them into new DataFrames
+df_cus = st.session_state["df_customers"]
+# Items are not kept in session state when the Arrow dataset is enabled
+df_itm = st.session_state["df_items"]
 # be used to restric the range of date inputs
 min_date = st.session_state["min_date"]
 max_date = st.session_state["max_date"]
+# The local database may hold a longer history than the uploaded data
+if database.get_db_path() is not None:
+    for lo, hi in database.get_date_range(database.get_db_path()).values():
+        min_date = min(min_date, lo)
+        max_date = max(max_date, hi)
+# So may the Arrow dataset
+if dataset.get_dataset_dir() is not None:
+    for lo, hi in dataset.get_date_range(dataset.get_dataset_dir()).values():
+        min_date = min(min_date, lo)
+        max_date = max(max_date, hi)
 
-# 1. number of customers by time of day
-with st.container(border=True):
-    st.write("##### 1日の時間帯ごとの客数の推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, min_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date1"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/timer: 集計スパン", 
-                options=["5min", "10min", "30min"], 
-                index=0, 
-                accept_new_options=False, 
-                key="span1"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh1"
-            )
-        with col4:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store1"
-            )
-    # Data processing and visualization
-    with st.container(border=True):
-        if len(st.session_state["date1"]) == 2:
-            df_cus_time = process_cus1(df_cus)
-            if not df_cus_time.empty:
-                # Identify dates with no customers (ex. holidays)
-                df_cus_time_sum = df_cus_time.sum(axis="index")
-                exclude_dates = df_cus_time_sum[df_cus_time_sum == 0].index.tolist()
-                # Plotly
-                fig = go.Figure()
-                # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                for date in df_cus_time.columns:
-                    if date.weekday() in [5, 6] or date in exclude_dates:  # Saturday and Sunday
-                        continue
-                    fig.add_trace(go.Scatter(
-                        x=df_cus_time.index, 
-                        y=df_cus_time[date], 
-                        mode="lines+markers", 
-                        name=date.strftime("%Y-%m-%d"), 
-                        line=dict(color=colors[st.session_state["store1"]]), 
-                        marker=dict(size=5), 
-                        hovertemplate="日付: %{meta}<br>時刻: %{x}<br>客数: %{y}人<extra></extra>", 
-                        meta=date.strftime("%Y-%m-%d (%a)"), 
-                        hoverlabel=dict(font=dict(size=15))
-                    ))
-                # Plot average if there are multiple columns
-                if len(df_cus_time.columns) >= 2:
-                    # Calculate the average for only weekdays (excluding weekends)
-                    ave = df_cus_time[
-                        [col for col in df_cus_time.columns if col.weekday() not in [5, 6] and col not in exclude_dates]
-                    ].mean(axis="columns")
-                    fig.add_trace(go.Scatter(
-                        x=df_cus_time.index, 
-                        y=ave, 
-                        mode="lines+markers", 
-                        name="平均", 
-                        line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
-                        marker=dict(size=5), 
-                        hovertemplate="平均<br>時刻: %{x}<br>客数: %{y:.1f}人<extra></extra>", 
-                        hoverlabel=dict(font=dict(size=15))
-                    ))
-                st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date1"]) == 2:
-            st.dataframe(df_cus_time)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_cus_time, index_flag=True), 
-                file_name=f"customers_by_time_{st.session_state['date1'][0]}-{st.session_state['date1'][1]}.csv", 
-                mime="text/csv"
-            )
+# Titles of the sections
+sections = [
+    "1日の時間帯ごとの客数の推移", 
+    "1日の合計客数の推移", 
+    "支払い方法の割合", 
+    "各商品ごとの売上推移", 
+    "各部門ごとの売上推移", 
+    "併売分析", 
+    "レジの混雑状況", 
+    "売上の推移と部門構成", 
+    "曜日ごとの対面講義履修者数"
+]
 
-# space
-st.write("")
+# Linked filters and sections to show
+with st.sidebar:
+    st.toggle(
+        label=":material/link: フィルタを連動させる", 
+        value=False, 
+        key="linked", 
+        help="オンにすると、日付・営業時間・店舗を全てのグラフで共通にします。絞り込みは1回だけ実行され、各グラフで共有されます。"
+    )
+    if st.session_state["linked"]:
+        st.date_input(
+            label=":material/calendar_month: 日付", 
+            value=(min_date, max_date), 
+            min_value=min_date, 
+            max_value=max_date, 
+            key="date0"
+        )
+        st.selectbox(
+            label=":material/schedule: 営業時間", 
+            options=bands.business_hours_options(), 
+            index=0, 
+            accept_new_options=False, 
+            key="bsh0", 
+            help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+        )
+        st.selectbox(
+            label=":material/storefront: 店舗", 
+            options=st.session_state["store_options"] + [registry.ALL_STORES], 
+            accept_new_options=False, 
+            index=0, 
+            key="store0", 
+            help="「全店舗」を選択すると、全ての店舗のデータを対象にします。"
+        )
+    st.multiselect(
+        label=":material/visibility: 表示するグラフ", 
+        options=sections, 
+        default=sections, 
+        key="sections", 
+        help="表示しないグラフは集計されません。"
+    )
 
-# 2. total number of customers per day
-with st.container(border=True):
-    st.write("##### 1日の合計客数の推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date2"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh2", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store2", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
-            )
-    # Data processing and visualization
+# Each section is a fragment: changing its own options reruns only the section,
+# with the DataFrames passed at the last full run of the page.
+# Options outside the sections (the sidebar) rerun the whole page.
+
+# 1. number of customers by time of day
+@st.fragment
+def section_customers_by_time(df_cus: pd.DataFrame) -> None:
+    """
+    Number of customers by time of day.
+    """
     with st.container(border=True):
-        if len(st.session_state["date2"]) == 2:
-            df_cus_day = process_cus2(df_cus)
-            if not df_cus_day.empty:
-                stores = df_cus_day.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_cus_day = pd.merge(
-                        df_cus_day, 
-                        st.session_state["df_calendar"], 
-                        left_index=True, 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
+        st.write("##### 1日の時間帯ごとの客数の推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, min_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date1"
+                    )
+            with col2:
+                st.selectbox(
+                    label=":material/timer: 集計スパン", 
+                    options=["5min", "10min", "30min"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="span1"
+                )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh1"
+                    )
+            if not st.session_state["linked"]:
+                with col4:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store1"
+                    )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 1)) == 2:
+                df_cus_time = process_cus1(df_cus)
+                if not df_cus_time.empty:
+                    # Identify dates with no customers (ex. holidays)
+                    df_cus_time_sum = df_cus_time.sum(axis="index")
+                    exclude_dates = df_cus_time_sum[df_cus_time_sum == 0].index.tolist()
                     # Plotly
                     fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
+                    for date in df_cus_time.columns:
+                        if date.weekday() in [5, 6] or date in exclude_dates:  # Saturday and Sunday
+                            continue
                         fig.add_trace(go.Scatter(
-                            x=df_cus_day.index, 
-                            y=df_cus_day[store], 
+                            x=df_cus_time.index, 
+                            y=df_cus_time[date], 
                             mode="lines+markers", 
+                            name=date.strftime("%Y-%m-%d"), 
+                            line=dict(color=registry.store_color(get_single_store(1))), 
                             marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_cus_day[["academic_year", "term", "class", "info"]].values.tolist(), 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            hovertemplate="日付: %{meta}<br>時刻: %{x}<br>客数: %{y}人<extra></extra>", 
+                            meta=date.strftime("%Y-%m-%d (%a)"), 
+                            hoverlabel=dict(font=dict(size=15))
+                        ))
+                    # Plot average if there are multiple columns
+                    if len(df_cus_time.columns) >= 2:
+                        # Calculate the average for only weekdays (excluding weekends)
+                        ave = df_cus_time[
+                            [col for col in df_cus_time.columns if col.weekday() not in [5, 6] and col not in exclude_dates]
+                        ].mean(axis="columns")
+                        fig.add_trace(go.Scatter(
+                            x=df_cus_time.index, 
+                            y=ave, 
+                            mode="lines+markers", 
+                            name="平均", 
+                            line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
+                            marker=dict(size=5), 
+                            hovertemplate="平均<br>時刻: %{x}<br>客数: %{y:.1f}人<extra></extra>", 
+                            hoverlabel=dict(font=dict(size=15))
                         ))
                     st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
                 else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 1)) == 2:
+                st.dataframe(df_cus_time)
+                download_dataframe(
+                    df_cus_time, 
+                    index_flag=True, 
+                    file_name=f"customers_by_time_{get_option('date', 1)[0]}-{get_option('date', 1)[1]}", 
+                    key="download_customers_by_time"
+                )
+
+if sections[0] in st.session_state["sections"]:
+    section_customers_by_time(df_cus)
+
+# space
+st.write("")
+
+# 2. total number of customers per day
+@st.fragment
+def section_customers_per_day(df_cus: pd.DataFrame) -> None:
+    """
+    Total number of customers per day.
+    """
+    with st.container(border=True):
+        st.write("##### 1日の合計客数の推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date2"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh2", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store2", 
+                        help="「全店舗」を選択すると、各店舗のグラフを重ね合わせて可視化します。"
+                    )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 2)) == 2:
+                df_cus_day = process_cus2(df_cus)
+                if not df_cus_day.empty:
+                    stores = df_cus_day.columns
+                    # Calendar data of the days, looked up in the calendar dimension if available
+                    hover = visualize.calendar_hover(df_cus_day.index, st.session_state.get("calendar_dim"))
                     # Plotly
                     fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
                     for store in stores:
                         fig.add_trace(go.Scatter(
                             x=df_cus_day.index, 
@@ -540,166 +581,180 @@ with st.container(border=True):
                             mode="lines+markers", 
                             marker=dict(size=5), 
                             name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<extra></extra>", 
+                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人%{customdata}<extra></extra>", 
+                            customdata=hover, 
                             hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            line=dict(color=registry.store_color(store))
                         ))
                     st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date2"]) == 2:
-            st.dataframe(df_cus_day)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_cus_day, index_flag=True), 
-                file_name=f"customers_per_day_{st.session_state['date2'][0]}-{st.session_state['date2'][1]}.csv", 
-                mime="text/csv"
-            )
-        
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 2)) == 2:
+                st.dataframe(df_cus_day)
+                download_dataframe(
+                    df_cus_day, 
+                    index_flag=True, 
+                    file_name=f"customers_per_day_{get_option('date', 2)[0]}-{get_option('date', 2)[1]}", 
+                    key="download_customers_per_day"
+                )
+
+if sections[1] in st.session_state["sections"]:
+    section_customers_per_day(df_cus)
+
 # space
 st.write("")
 
 # 3. ratio of payment methods
-with st.container(border=True):
-    st.write("##### 支払い方法の割合")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date3"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh3", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算して割合を計算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store3", 
-                help="「両方」を選択すると、東西両店舗のデータを合算して割合を計算します。"
-            )
-    # Data processing and visualization
+@st.fragment
+def section_payment_methods(df_cus: pd.DataFrame) -> None:
+    """
+    Ratio of payment methods.
+    """
     with st.container(border=True):
-        if len(st.session_state["date3"]) == 2:
-            df_pm = filter_pm(df_cus)
-            if df_pm["合計利用者数"].sum() != 0:
-                fig = go.Figure()
-                fig.add_trace(go.Pie(
-                    values=df_pm["合計利用者数"], 
-                    labels=df_pm["支払い方法"], 
-                    hovertemplate="支払い方法: %{label}<br>合計利用者数: %{value:,}人<extra></extra>", 
-                    hoverlabel=dict(font=dict(size=15))
-                ))
-                st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date3"]) == 2:
-            st.dataframe(df_pm, hide_index=True)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_pm, index_flag=False), 
-                file_name=f"payments_{st.session_state['date3'][0]}-{st.session_state['date3'][1]}.csv", 
-                mime="text/csv"
-            )
+        st.write("##### 支払い方法の割合")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date3"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh3", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算して割合を計算します。"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store3", 
+                        help="「全店舗」を選択すると、全ての店舗のデータを合算して割合を計算します。"
+                    )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 3)) == 2:
+                df_pm = filter_pm(df_cus)
+                if df_pm["合計利用者数"].sum() != 0:
+                    fig = go.Figure()
+                    fig.add_trace(go.Pie(
+                        values=df_pm["合計利用者数"], 
+                        labels=df_pm["支払い方法"], 
+                        hovertemplate="支払い方法: %{label}<br>合計利用者数: %{value:,}人<extra></extra>", 
+                        hoverlabel=dict(font=dict(size=15))
+                    ))
+                    st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 3)) == 2:
+                st.dataframe(df_pm, hide_index=True)
+                download_dataframe(
+                    df_pm, 
+                    index_flag=False, 
+                    file_name=f"payments_{get_option('date', 3)[0]}-{get_option('date', 3)[1]}", 
+                    key="download_payments"
+                )
+
+if sections[2] in st.session_state["sections"]:
+    section_payment_methods(df_cus)
 
 # space
 st.write("")
 
 # 4. sales by item
-with st.container(border=True):
-    st.write("##### 各商品ごとの売上推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date4"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh4", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store4", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
-            )
-        with col4:
-            st.selectbox(
-                label=":material/calculate: 集計方法", 
-                options=["数量", "金額"], 
-                index=0, 
-                accept_new_options=False,
-                key="aggr4"
-            )
-        with col1:
-            st.selectbox(
-                label=":material/filter_alt: 商品の指定方法", 
-                options=["名前", "バーコード", "SKU"], 
-                index=0, 
-                accept_new_options=False,
-                key="mthd4"
-            )
-        with col2:
-            candidates = candidates_itm1(df_itm)
-            st.selectbox(
-                label=f":material/lunch_dining: {st.session_state['mthd4']}", 
-                options=candidates, 
-                index=0, 
-                accept_new_options=False,
-                key="item4"
-            )
-    # Data processing and visualization
+@st.fragment
+def section_sales_by_item(df_itm: pd.DataFrame | None) -> None:
+    """
+    Sales by item.
+    """
     with st.container(border=True):
-        if len(st.session_state["date4"]) == 2:
-            df_sales_itm = process_itm1(df_itm)
-            if not df_sales_itm.empty:
-                stores = df_sales_itm.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_sales_itm = pd.merge(
-                        df_sales_itm, 
-                        st.session_state["df_calendar"], 
-                        left_on = "開始日時", 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
+        st.write("##### 各商品ごとの売上推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date4"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh4", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store4", 
+                        help="「全店舗」を選択すると、各店舗のグラフを重ね合わせて可視化します。"
+                    )
+            with col4:
+                st.selectbox(
+                    label=":material/calculate: 集計方法", 
+                    options=["数量", "金額"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="aggr4"
+                )
+            with col1:
+                st.selectbox(
+                    label=":material/filter_alt: 商品の指定方法", 
+                    options=["名前", "バーコード", "SKU"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="mthd4"
+                )
+            with col2:
+                candidates = candidates_itm1(df_itm)
+                st.selectbox(
+                    label=f":material/lunch_dining: {st.session_state['mthd4']}", 
+                    options=candidates, 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="item4"
+                )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 4)) == 2:
+                df_sales_itm = process_itm1(df_itm)
+                if not df_sales_itm.empty:
+                    stores = df_sales_itm.columns
+                    # Calendar data of the days, looked up in the calendar dimension if available
+                    hover = visualize.calendar_hover(df_sales_itm.index, st.session_state.get("calendar_dim"))
                     # Plotly
                     fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
                     for store in stores:
                         fig.add_trace(go.Scatter(
                             x=df_sales_itm.index, 
@@ -709,264 +764,670 @@ with st.container(border=True):
                             name=store, 
                             hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
                                  + ("%{y}個" if st.session_state["aggr4"] == "数量" else "%{y:,}円")
-                                 + "<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_sales_itm[["academic_year", "term", "class", "info"]].values.tolist(), 
+                                 + "%{customdata}<extra></extra>", 
+                            customdata=hover, 
                             hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            line=dict(color=registry.store_color(store))
                         ))
-                    st.plotly_chart(fig)
+                    st.plotly_chart(fig, key="chart4")
+                # When nothing to show, display a sleeping hamburger
                 else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 4)) == 2:
+                tmp = df_sales_itm.rename(columns=lambda store: f"{st.session_state['item4']}_{store}")
+                st.dataframe(tmp)
+                download_dataframe(
+                    tmp, 
+                    index_flag=True, 
+                    file_name=f"sales_items_{get_option('date', 4)[0]}-{get_option('date', 4)[1]}", 
+                    key="download_sales_items"
+                )
+
+if sections[3] in st.session_state["sections"]:
+    section_sales_by_item(df_itm)
+
+# space
+st.write("")
+
+# 5. sales by department
+@st.fragment
+def section_sales_by_department(df_itm: pd.DataFrame | None) -> None:
+    """
+    Sales by department.
+    """
+    with st.container(border=True):
+        st.write("##### 各部門ごとの売上推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date5"
+                        )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh5", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                        )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store5", 
+                        help="「全店舗」を選択すると、各店舗のグラフを重ね合わせて可視化します。"
+                        )
+            with col4:
+                st.selectbox(
+                    label=":material/calculate: 集計方法", 
+                    options=["数量", "金額"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="aggr5"
+                    )
+            with col1:
+                candidates = candidates_itm2(df_itm)
+                st.selectbox(
+                    label=":material/category: 部門", 
+                    options=candidates, 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="dpmt5"
+                    )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 5)) == 2:
+                df_sales_dep = process_itm2(df_itm)
+                if not df_sales_dep.empty:
+                    stores = df_sales_dep.columns
+                    # Calendar data of the days, looked up in the calendar dimension if available
+                    hover = visualize.calendar_hover(df_sales_dep.index, st.session_state.get("calendar_dim"))
                     # Plotly
                     fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
                     for store in stores:
                         fig.add_trace(go.Scatter(
-                            x=df_sales_itm.index, 
-                            y=df_sales_itm[store], 
+                            x=df_sales_dep.index, 
+                            y=df_sales_dep[store], 
                             mode="lines+markers", 
                             marker=dict(size=5), 
                             name=store, 
                             hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr4"] == "数量" else "%{y:,}円")
-                                 + "<extra></extra>", 
+                                 + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
+                                 + "%{customdata}<extra></extra>", 
+                            customdata=hover, 
                             hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            line=dict(color=registry.store_color(store))
                         ))
-                    st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date4"]) == 2:
-            tmp = df_sales_itm.rename(columns={
-                    "西食堂": f"{st.session_state['item4']}_西食堂", 
-                    "東カフェテリア": f"{st.session_state['item4']}_東カフェテリア"
-            })
-            st.dataframe(tmp)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(tmp, index_flag=True), 
-                file_name=f"sales_items_{st.session_state['date4'][0]}-{st.session_state['date4'][1]}.csv", 
-                mime="text/csv"
-            )
+                    st.plotly_chart(fig, key="chart5")
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 5)) == 2:
+                tmp = df_sales_dep.rename(columns=lambda store: f"{st.session_state['dpmt5']}_{store}")
+                st.dataframe(tmp)
+                download_dataframe(
+                    df_sales_dep, 
+                    index_flag=False, 
+                    file_name=f"sales_department_{get_option('date', 5)[0]}-{get_option('date', 5)[1]}", 
+                    key="download_sales_department"
+                )
+
+if sections[4] in st.session_state["sections"]:
+    section_sales_by_department(df_itm)
 
 # space
 st.write("")
 
-# 5. sales by department
-with st.container(border=True):
-    st.write("##### 各部門ごとの売上推移")
-    # Options
+# 6. co-purchase analysis
+@st.fragment
+def section_basket(df_itm: pd.DataFrame | None) -> None:
+    """
+    Co-purchase analysis.
+    """
     with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date5"
+        st.write("##### 併売分析")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date6"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh6", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store6", 
+                        help="「全店舗」を選択すると、全ての店舗のデータを合算して集計します。"
+                    )
+            with col4:
+                st.selectbox(
+                    label=":material/filter_alt: 集計単位", 
+                    options=["名前", "部門"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="mthd6"
                 )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh5", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+            if len(get_option("date", 6)) == 2:
+                df_pairs, support, n_checkouts = process_basket(
+                    df_itm, 
+                    st.session_state["pos_version"], 
+                    get_option("date", 6), 
+                    get_option("bsh", 6), 
+                    get_option("store", 6), 
+                    st.session_state["mthd6"]
                 )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store5", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
+            else:
+                df_pairs, support, n_checkouts = pd.DataFrame(), pd.Series(dtype="int"), 0
+            with col1:
+                # Candidates are sorted by the number of checkouts, so the best seller is selected by default
+                st.selectbox(
+                    label=f":material/lunch_dining: 基準とする{st.session_state['mthd6']}", 
+                    options=support.index.tolist(), 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="anchor6"
                 )
-        with col4:
-            st.selectbox(
-                label=":material/calculate: 集計方法", 
-                options=["数量", "金額"], 
-                index=0, 
-                accept_new_options=False,
-                key="aggr5"
+            with col2:
+                st.number_input(
+                    label=":material/tune: 最小同時購入数", 
+                    min_value=1, 
+                    value=5, 
+                    step=1, 
+                    key="min_count6", 
+                    help="同時に購入された会計数がこの値より少ない組み合わせは除外します。"
                 )
-        with col1:
-            candidates = candidates_itm2(df_itm)
-            st.selectbox(
-                label=":material/category: 部門", 
-                options=candidates, 
-                index=0, 
-                accept_new_options=False,
-                key="dpmt5"
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 6)) == 2:
+                df_anchor = process_basket_anchor(df_pairs, st.session_state["anchor6"], st.session_state["min_count6"])
+                if not df_anchor.empty:
+                    df_top = df_anchor.head(15).iloc[::-1]
+                    fig = go.Figure()
+                    fig.add_trace(go.Bar(
+                        x=df_top["信頼度"], 
+                        y=df_top["商品"], 
+                        orientation="h", 
+                        marker=dict(color="rgba(187, 90, 56, 0.7)"), 
+                        hovertemplate="%{y}<br>信頼度: %{x:.1%}<br>同時購入数: %{meta[0]:,}件<br>リフト: %{meta[1]:.2f}<extra></extra>", 
+                        meta=df_top[["同時購入数", "リフト"]].values.tolist(), 
+                        hoverlabel=dict(font=dict(size=15))
+                    ))
+                    fig.update_layout(
+                        title=dict(text=f"「{st.session_state['anchor6']}」と一緒に購入された割合（全{n_checkouts:,}会計）"), 
+                        xaxis=dict(tickformat=".0%")
+                    )
+                    st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 6)) == 2:
+                tmp = df_pairs[df_pairs["同時購入数"] >= st.session_state["min_count6"]] if not df_pairs.empty else df_pairs
+                st.dataframe(tmp, hide_index=True)
+                download_dataframe(
+                    tmp, 
+                    index_flag=False, 
+                    file_name=f"co_purchase_{get_option('date', 6)[0]}-{get_option('date', 6)[1]}", 
+                    key="download_co_purchase"
                 )
-    # Data processing and visualization
+
+if sections[5] in st.session_state["sections"]:
+    section_basket(df_itm)
+
+# space
+st.write("")
+
+# 7. checkout load and duration
+@st.fragment
+def section_queue() -> None:
+    """
+    Checkout load and duration, sliced from the tables precomputed at upload.
+    """
     with st.container(border=True):
-        if len(st.session_state["date5"]) == 2:
-            df_sales_dep = process_itm2(df_itm)
-            if not df_sales_dep.empty:
-                stores = df_sales_dep.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_sales_dep = pd.merge(
-                        df_sales_dep, 
-                        st.session_state["df_calendar"], 
-                        left_on = "開始日時", 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
+        st.write("##### レジの混雑状況")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date7"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh7"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store7"
+                    )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(get_option("date", 7)) == 2:
+                df_queue_load, df_queue_dur = process_queue()
+                if not df_queue_load.empty:
+                    col1, col2 = st.columns(2)
+                    # Number of concurrent checkouts by time of day
+                    with col1:
+                        fig = go.Figure()
                         fig.add_trace(go.Scatter(
-                            x=df_sales_dep.index, 
-                            y=df_sales_dep[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
-                                 + "<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_sales_dep[["academic_year", "term", "class", "info"]].values.tolist(), 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            x=df_queue_load.index, 
+                            y=df_queue_load["平均"], 
+                            mode="lines", 
+                            name="平均", 
+                            line=dict(color=registry.store_color(get_single_store(7))), 
+                            hovertemplate="平均<br>時刻: %{x}<br>同時会計数: %{y:.2f}件<extra></extra>", 
+                            hoverlabel=dict(font=dict(size=15))
                         ))
-                    st.plotly_chart(fig)
-                else:
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
                         fig.add_trace(go.Scatter(
-                            x=df_sales_dep.index, 
-                            y=df_sales_dep[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
-                                 + "<extra></extra>", 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+                            x=df_queue_load.index, 
+                            y=df_queue_load["最大"], 
+                            mode="lines", 
+                            name="最大", 
+                            line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
+                            hovertemplate="最大<br>時刻: %{x}<br>同時会計数: %{y:.2f}件<extra></extra>", 
+                            hoverlabel=dict(font=dict(size=15))
                         ))
-                    st.plotly_chart(fig)
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date5"]) == 2:
-            tmp = df_sales_dep.rename(columns={
-                    "西食堂": f"{st.session_state['dpmt5']}_西食堂", 
-                    "東カフェテリア": f"{st.session_state['dpmt5']}_東カフェテリア"
-            })
-            st.dataframe(tmp)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_sales_dep, index_flag=False), 
-                file_name=f"sales_department_{st.session_state['date5'][0]}-{st.session_state['date5'][1]}.csv", 
-                mime="text/csv"
-            )
+                        fig.update_layout(title=dict(text="同時に進行中の会計数（1分ごとの平均）"))
+                        st.plotly_chart(fig)
+                    # Ratio of checkout durations by slot
+                    with col2:
+                        fig = go.Figure()
+                        for label in df_queue_dur.columns:
+                            fig.add_trace(go.Bar(
+                                x=df_queue_dur.index, 
+                                y=df_queue_dur[label], 
+                                name=label, 
+                                hovertemplate="時刻: %{x}～<br>所要時間: " + label + "<br>割合: %{y:.1%}<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ))
+                        fig.update_layout(
+                            barmode="stack", 
+                            title=dict(text="会計の所要時間の分布（10分ごと）"), 
+                            yaxis=dict(tickformat=".0%")
+                        )
+                        st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(get_option("date", 7)) == 2:
+                tab1, tab2 = st.tabs(["同時会計数", "所要時間"])
+                with tab1:
+                    st.dataframe(df_queue_load)
+                    download_dataframe(
+                        df_queue_load, 
+                        index_flag=True, 
+                        file_name=f"checkout_load_{get_option('date', 7)[0]}-{get_option('date', 7)[1]}", 
+                        key="download_checkout_load"
+                    )
+                with tab2:
+                    st.dataframe(df_queue_dur)
+                    download_dataframe(
+                        df_queue_dur, 
+                        index_flag=True, 
+                        file_name=f"checkout_duration_{get_option('date', 7)[0]}-{get_option('date', 7)[1]}", 
+                        key="download_checkout_duration"
+                    )
+
+if sections[6] in st.session_state["sections"]:
+    section_queue()
 
 # space
 st.write("")
 
-# 6. syllabus data
-with st.container(border=True):
-    st.write("##### 曜日ごとの対面講義履修者数")
-    # When syllabus data is not available
-    if "df_syllabus_west" not in st.session_state or "df_syllabus_east" not in st.session_state:
-        with st.container(border=True):
-            st.image(sleeping_no_syllabus)
-    # When syllabus data is available
-    else:
+# 8. revenue analysis
+@st.fragment
+def section_revenue() -> None:
+    """
+    Revenue analysis, sliced from the sales cube.
+    """
+    with st.container(border=True):
+        st.write("##### 売上の推移と部門構成")
         # Options
         with st.container(border=True):
-            st.multiselect(
-                label=":material/school: 時限", 
-                options=["1限", "2限", "3限", "4限", "5限"], 
-                default=["1限", "2限", "3限", "4限", "5限"], 
-                key="class_period"
-            )
-            year_candidates = candidates_syl()
-            st.multiselect(
-                label=":material/event: 年度", 
-                options=year_candidates, 
-                default=year_candidates[0], 
-                max_selections=3, 
-                key="year", 
-                help="最大3つまで選択できます。"
-            )
+            col1, col2, col3, col4 = st.columns(4)
+            if not st.session_state["linked"]:
+                with col1:
+                    st.date_input(
+                        label=":material/calendar_month: 日付", 
+                        value=(min_date, max_date), 
+                        min_value=min_date, 
+                        max_value=max_date, 
+                        key="date8"
+                    )
+            if not st.session_state["linked"]:
+                with col2:
+                    st.selectbox(
+                        label=":material/schedule: 営業時間", 
+                        options=bands.business_hours_options(), 
+                        index=0, 
+                        accept_new_options=False, 
+                        key="bsh8", 
+                        help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                    )
+            if not st.session_state["linked"]:
+                with col3:
+                    st.selectbox(
+                        label=":material/storefront: 店舗", 
+                        options=st.session_state["store_options"] + [registry.ALL_STORES], 
+                        accept_new_options=False, 
+                        index=0, 
+                        key="store8", 
+                        help="「全店舗」を選択すると、各店舗のグラフを重ね合わせて可視化し、部門構成は合算して計算します。"
+                    )
         # Data processing and visualization
         with st.container(border=True):
-            df_syl_west, df_syl_east = process_syllabus()
-            if not df_syl_west.empty or not df_syl_east.empty:
-                years = [y[:4] for y in st.session_state["year"]]
-                terms = ["SPR", "SMR", "AUT", "WTR"]
-                titles = ["春学期", "夏学期", "秋学期", "冬学期"]
-                colors = [
-                    [(255, 127, 14), (255, 172, 100), (255, 211, 172)], 
-                    [(0, 104, 201), (107, 176, 241), (181, 219, 255)]
-                ]
-                fig = make_subplots(
-                    rows=2, cols=4, 
-                    subplot_titles=["春学期", "夏学期", "秋学期", "冬学期", "", "", "", ""], 
-                    shared_yaxes=True
-                )
-                # Plotly
-                for n_row, syl in enumerate([df_syl_west, df_syl_east]):
-                    for j, year in enumerate(years):
-                        for i, term in enumerate(terms):
-                            try:
-                                week = syl.loc[:, year + term]
-                                fig.add_trace(go.Bar(
-                                    x=week.index, 
-                                    y=week.values, 
-                                    marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
-                                    hovertemplate="対面講義履修者数: %{y:,}人<extra></extra>", 
-                                    name=year + "年度", 
-                                    showlegend=True if i == 0 else False, 
-                                    hoverlabel=dict(font=dict(size=15))
-                                ), row=n_row+1, col=i+1)
-                            except KeyError:
-                                fig.add_trace(go.Bar(
-                                    x=["月", "火", "水", "木", "金"], 
-                                    y=[0, 0, 0, 0, 0], 
-                                    marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
-                                    hovertemplate="データなし<extra></extra>", 
-                                    name=year + "年度", 
-                                    showlegend=True if i == 0 else False, 
-                                    hoverlabel=dict(font=dict(size=15))
-                                ), row=n_row+1, col=i+1)
-                fig.update_layout(barmode="group")
-                fig.update_yaxes(title_text="西キャンパス", row=1, col=1)
-                fig.update_yaxes(title_text="東キャンパス", row=2, col=1)
-                st.plotly_chart(fig)
-            else:
-                st.image(sleeping)
+            if len(get_option("date", 8)) == 2:
+                df_rev, df_rev_dep = process_revenue()
+                if not df_rev.empty:
+                    stores = [col.split("_", 1)[1] for col in df_rev.columns if col.startswith("売上_")]
+                    # Summary over the selected period
+                    df_total = visualize.slice_sales_cube(
+                        st.session_state["df_sales_cube"], get_option("date", 8), get_option("bsh", 8), get_option("store", 8)
+                    )
+                    df_total = df_total[df_total["部門"] == "（全体）"][["金額", "会計数", "客数"]].sum()
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric(label="売上合計", value=f"{df_total['金額']:,}円")
+                    col2.metric(label="客単価", value=f"{df_total['金額'] / max(df_total['会計数'], 1):,.0f}円")
+                    col3.metric(label="客1人当たり売上", value=f"{df_total['金額'] / max(df_total['客数'], 1):,.0f}円")
+                    col1, col2 = st.columns(2)
+                    # Daily sales
+                    with col1:
+                        fig = go.Figure()
+                        for store in stores:
+                            fig.add_trace(go.Scatter(
+                                x=df_rev.index, 
+                                y=df_rev[f"売上_{store}"], 
+                                mode="lines+markers", 
+                                marker=dict(size=5), 
+                                name=store, 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: %{y:,}円<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=registry.store_color(store))
+                            ))
+                        fig.update_layout(title=dict(text="1日の売上"))
+                        st.plotly_chart(fig)
+                    # Average sales per checkout and per customer
+                    with col2:
+                        fig = go.Figure()
+                        for store in stores:
+                            fig.add_trace(go.Scatter(
+                                x=df_rev.index, 
+                                y=df_rev[f"客単価_{store}"], 
+                                mode="lines+markers", 
+                                marker=dict(size=5), 
+                                name=f"客単価（{store}）", 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客単価: %{y:,.0f}円<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=registry.store_color(store))
+                            ))
+                            fig.add_trace(go.Scatter(
+                                x=df_rev.index, 
+                                y=df_rev[f"客1人当たり売上_{store}"], 
+                                mode="lines", 
+                                name=f"客1人当たり売上（{store}）", 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客1人当たり売上: %{y:,.0f}円<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=registry.store_color(store), dash="dot")
+                            ))
+                        fig.update_layout(title=dict(text="客単価・客1人当たり売上"))
+                        st.plotly_chart(fig)
+                    # Sales by department
+                    if not df_rev_dep.empty:
+                        fig = go.Figure()
+                        fig.add_trace(go.Pie(
+                            values=df_rev_dep["金額"], 
+                            labels=df_rev_dep.index, 
+                            hovertemplate="部門: %{label}<br>売上: %{value:,}円<br>構成比: %{percent}<extra></extra>", 
+                            hoverlabel=dict(font=dict(size=15))
+                        ))
+                        fig.update_layout(title=dict(text="部門別の売上構成"))
+                        st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
         # Data
         with st.expander("データを見る", expanded=False):
-            tab1, tab2 = st.tabs(["西キャンパス", "東キャンパス"])
-            with tab1:
-                st.dataframe(df_syl_west)
-                st.download_button(
-                    label=":material/download: `.csv`でダウンロード", 
-                    data=convert_for_download(df_syl_west, index_flag=True), 
-                    file_name=f"syllabus_west.csv", 
-                    mime="text/csv"
+            if len(get_option("date", 8)) == 2:
+                tab1, tab2 = st.tabs(["日別", "部門別"])
+                with tab1:
+                    st.dataframe(df_rev)
+                    download_dataframe(
+                        df_rev, 
+                        index_flag=True, 
+                        file_name=f"revenue_{get_option('date', 8)[0]}-{get_option('date', 8)[1]}", 
+                        key="download_revenue"
+                    )
+                with tab2:
+                    st.dataframe(df_rev_dep)
+                    download_dataframe(
+                        df_rev_dep, 
+                        index_flag=True, 
+                        file_name=f"revenue_department_{get_option('date', 8)[0]}-{get_option('date', 8)[1]}", 
+                        key="download_revenue_department"
+                    )
+
+if sections[7] in st.session_state["sections"]:
+    section_revenue()
+
+# space
+st.write("")
+
+# 9. syllabus data
+@st.fragment
+def section_syllabus() -> None:
+    """
+    Number of students in face-to-face classes by weekday.
+    """
+    with st.container(border=True):
+        st.write("##### 曜日ごとの対面講義履修者数")
+        # When syllabus data is not available
+        if "df_syllabus_west" not in st.session_state or "df_syllabus_east" not in st.session_state:
+            with st.container(border=True):
+                st.image(sleeping_no_syllabus)
+        # When syllabus data is available
+        else:
+            # Options
+            with st.container(border=True):
+                st.multiselect(
+                    label=":material/school: 時限", 
+                    options=["1限", "2限", "3限", "4限", "5限"], 
+                    default=["1限", "2限", "3限", "4限", "5限"], 
+                    key="class_period"
                 )
-            with tab2:
-                st.dataframe(df_syl_east)
-                st.download_button(
-                    label=":material/download: `.csv`でダウンロード", 
-                    data=convert_for_download(df_syl_east, index_flag=True), 
-                    file_name=f"syllabus_east.csv", 
-                    mime="text/csv"
+                year_candidates = candidates_syl()
+                st.multiselect(
+                    label=":material/event: 年度", 
+                    options=year_candidates, 
+                    default=year_candidates[0], 
+                    max_selections=3, 
+                    key="year", 
+                    help="最大3つまで選択できます。"
                 )
+            # Data processing and visualization
+            with st.container(border=True):
+                df_syl_west, df_syl_east = process_syllabus()
+                if not df_syl_west.empty or not df_syl_east.empty:
+                    years = [y[:4] for y in st.session_state["year"]]
+                    terms = ["SPR", "SMR", "AUT", "WTR"]
+                    titles = ["春学期", "夏学期", "秋学期", "冬学期"]
+                    colors = [
+                        [(255, 127, 14), (255, 172, 100), (255, 211, 172)], 
+                        [(0, 104, 201), (107, 176, 241), (181, 219, 255)]
+                    ]
+                    fig = make_subplots(
+                        rows=2, cols=4, 
+                        subplot_titles=["春学期", "夏学期", "秋学期", "冬学期", "", "", "", ""], 
+                        shared_yaxes=True
+                    )
+                    # Plotly
+                    for n_row, syl in enumerate([df_syl_west, df_syl_east]):
+                        for j, year in enumerate(years):
+                            for i, term in enumerate(terms):
+                                try:
+                                    week = syl.loc[:, year + term]
+                                    fig.add_trace(go.Bar(
+                                        x=week.index, 
+                                        y=week.values, 
+                                        marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
+                                        hovertemplate="対面講義履修者数: %{y:,}人<extra></extra>", 
+                                        name=year + "年度", 
+                                        showlegend=True if i == 0 else False, 
+                                        hoverlabel=dict(font=dict(size=15))
+                                    ), row=n_row+1, col=i+1)
+                                except KeyError:
+                                    fig.add_trace(go.Bar(
+                                        x=["月", "火", "水", "木", "金"], 
+                                        y=[0, 0, 0, 0, 0], 
+                                        marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
+                                        hovertemplate="データなし<extra></extra>", 
+                                        name=year + "年度", 
+                                        showlegend=True if i == 0 else False, 
+                                        hoverlabel=dict(font=dict(size=15))
+                                    ), row=n_row+1, col=i+1)
+                    fig.update_layout(barmode="group")
+                    fig.update_yaxes(title_text="西キャンパス", row=1, col=1)
+                    fig.update_yaxes(title_text="東キャンパス", row=2, col=1)
+                    st.plotly_chart(fig)
+                else:
+                    st.image(sleeping)
+            # Data
+            with st.expander("データを見る", expanded=False):
+                tab1, tab2 = st.tabs(["西キャンパス", "東キャンパス"])
+                with tab1:
+                    st.dataframe(df_syl_west)
+                    download_dataframe(
+                        df_syl_west, 
+                        index_flag=True, 
+                        file_name=f"syllabus_west", 
+                        key="download_syllabus_west"
+                    )
+                with tab2:
+                    st.dataframe(df_syl_east)
+                    download_dataframe(
+                        df_syl_east, 
+                        index_flag=True, 
+                        file_name=f"syllabus_east", 
+                        key="download_syllabus_east"
+                    )
+
+            # Number of students and customers of each term
+            with st.container(border=True):
+                st.write("###### 履修者数と昼営業の客数の関係")
+                if "calendar_dim" not in st.session_state:
+                    st.info(":material/info: カレンダー形式データをアップロードすると、学期ごとの履修者数と客数の関係を表示します。")
+                    df_traffics = {}
+                else:
+                    df_traffics = process_syllabus_traffic()
+                    # A subplot for each store with data
+                    shown = {store: df for store, df in df_traffics.items() if not df.empty}
+                    if shown:
+                        fig = make_subplots(
+                            rows=1, cols=len(shown), 
+                            subplot_titles=[f"{registry.CAMPUSES[registry.store_campus(store)]}・{store}" for store in shown], 
+                            specs=[[{"secondary_y": True}] * len(shown)]
+                        )
+                        for n_col, (store, df_traffic) in enumerate(shown.items()):
+                            fig.add_trace(go.Bar(
+                                x=df_traffic.index, 
+                                y=df_traffic["1日平均履修者数"], 
+                                name=f"1日平均履修者数（{store}）", 
+                                marker=dict(color="rgba(211, 210, 202, 1)"), 
+                                hovertemplate="学期: %{x}<br>1日平均履修者数: %{y:,.0f}人<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ), row=1, col=n_col+1, secondary_y=False)
+                            fig.add_trace(go.Bar(
+                                x=df_traffic.index, 
+                                y=df_traffic["1日平均客数"], 
+                                name=f"1日平均客数（{store}）", 
+                                marker=dict(color=registry.store_color(store)), 
+                                hovertemplate="学期: %{x}<br>1日平均客数: %{y:,.0f}人<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ), row=1, col=n_col+1, secondary_y=False)
+                            fig.add_trace(go.Scatter(
+                                x=df_traffic.index, 
+                                y=df_traffic["履修者1人当たり客数"], 
+                                mode="lines+markers", 
+                                name=f"履修者1人当たり客数（{store}）", 
+                                line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
+                                marker=dict(size=5), 
+                                hovertemplate="学期: %{x}<br>履修者1人当たり客数: %{y:.3f}人<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ), row=1, col=n_col+1, secondary_y=True)
+                        fig.update_layout(barmode="group")
+                        fig.update_yaxes(title_text="人数", secondary_y=False)
+                        fig.update_yaxes(title_text="履修者1人当たり客数", secondary_y=True, rangemode="tozero")
+                        st.plotly_chart(fig)
+                    else:
+                        st.image(sleeping)
+            # Data
+            with st.expander("データを見る（履修者数と客数）", expanded=False):
+                # A tab for each store with a campus
+                campus_stores = [store for store in st.session_state["store_options"] if registry.store_campus(store) is not None]
+                if campus_stores:
+                    tabs = st.tabs([f"{registry.CAMPUSES[registry.store_campus(store)]}・{store}" for store in campus_stores])
+                    for tab, store in zip(tabs, campus_stores):
+                        with tab:
+                            df_traffic = df_traffics.get(store, pd.DataFrame())
+                            st.dataframe(df_traffic)
+                            download_dataframe(
+                                df_traffic, 
+                                index_flag=True, 
+                                file_name=f"syllabus_traffic_{store}", 
+                                key=f"download_syllabus_traffic_{store}"
+                            )
+
+if sections[8] in st.session_state["sections"]:
+    section_syllabus()
 
@@ -1,19 +1,22 @@
 import streamlit as st
-from PIL import Image
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import root_mean_squared_error, mean_absolute_percentage_error
-from sklearn.linear_model import LinearRegression
+
+from poscope import bands, database, dataset, forecast, hierarchy, registry
+from poscope.forecast import concatenate_data, split_data
+from poscope.instrument import instrument
+from poscope.session import query_database, sync_pos_dataset
+from poscope.startup import load_image
+from poscope.widgets import download_dataframe, start_job, finished_job
 
 
 #-----------------------------------------Settings-----------------------------------------
 
 # Load images
-favicon = Image.open("static/favicon.ico")
-sleeping = Image.open("static/sleeping_hamburger.png")
-sleeping_no_training_data = Image.open("static/sleeping_hamburger_no_training_data.png")
+favicon = load_image("favicon.ico")
+sleeping = load_image("sleeping_hamburger.png")
+sleeping_no_training_data = load_image("sleeping_hamburger_no_training_data.png")
 
 # Page configuration
 st.set_page_config(
@@ -52,18 +55,17 @@ def check_options(store: str):
     """
     Check if the data is available for the selected options.\\
     Return True if the data is available, otherwise False.
+    The model uses the syllabus data of the campus of the store, so a store without a campus cannot be forecast.
     """
-    if store == "西食堂":
-        if "df_syllabus_west" not in st.session_state:
-            return False
-    elif store == "東カフェテリア":
-        if "df_syllabus_east" not in st.session_state:
-            return False
-    return True
+    campus = registry.store_campus(store)
+    if campus is None:
+        return False
+    return f"df_syllabus_{campus}" in st.session_state
 
 
 #----------------Process POS data----------------
 
+@instrument
 def process_pos(df_cus: pd.DataFrame):
     """
     Filter the DataFrame based on the selected options.\\
@@ -71,195 +73,305 @@ def process_pos(df_cus: pd.DataFrame):
     """
     # Load option from session state
     store = st.session_state["forecast_store"]
-    # Filter by store
-    df_cus = df_cus[df_cus["アカウント名"] == store]
-    # Filter by business hours
-    df_cus = df_cus.set_index("開始日時")
-    df_cus = df_cus.between_time("11:00", "14:00")
-    df_cus = df_cus.reset_index(drop=False)
+    if database.get_db_path() is not None:
+        # Customers per day at lunch over the whole history in the local database
+        df_cus = query_database("customers_per_day", None, bands.lunch_hours(), store)
+    else:
+        df_cus = forecast.filter_lunch(df_cus, store)
     if df_cus.empty:
         return pd.DataFrame()
     # Resample the DataFrame by day
-    df_cus = df_cus.resample("1D", on="開始日時")["客数"].sum()
-    return df_cus
+    return forecast.customers_per_day(df_cus)
 
 
-#-------------Process calendar data-------------
+#--------------------Features--------------------
 
-def get_nweek(df_cal: pd.DataFrame) -> list:
+def prepare_data() -> tuple[pd.DataFrame, pd.DataFrame | None, pd.DataFrame | None]:
     """
-    Calculate the number of weeks since the first Monday of the term and return it as a list.
+    Return the DataFrame of all data, and the training and prediction sets with the lag features
+    (`None` if the DataFrame is empty).\\
+    They are kept in session state until the data or the store changes,
+    so the reruns by the options of the model and by the scenario do not build them again.
     """
-    r, _ = df_cal.shape
-    current_term = ""
-    first_mon_date = None
-    nweeks = []
-    daynames = ["MON", "TUE", "WED", "THU", "FRI"]
-    for i in range(r):
-        term = df_cal.loc[i, "term"]
-        class_info = df_cal.loc[i, "class"]
-        _date = df_cal.loc[i, "date"]
-        dayname = _date.day_name()[:3].upper()
-        if term in ["SPR", "SMR", "AUT", "WTR", "SMRINT", "WTRINT1to3", "WTRINT4"] and class_info != "NoClass":
-            if current_term != term:
-                # not change first_mon_date when SPR->SMR or AUT->WTR
-                if term == "SMR" or term == "WTR":
-                    current_term = term
-                else:
-                    current_term = term
-                    first_mon_date = _date - pd.Timedelta(days=daynames.index(dayname))
-            nweeks.append((_date - first_mon_date).days // 7 + 1)
-        else:
-            nweeks.append(float("nan"))
-    return nweeks
-
+    if st.session_state.get("forecast_data_key") == get_data_key():
+        return st.session_state["forecast_data"]
+    # When all data is ready, load them from session state
+    df_cus: pd.DataFrame = st.session_state["df_customers"].copy()
+    # The calendar dimension already has the features of the calendar data
+    df_cal: pd.DataFrame = st.session_state["calendar_dim"].reset_index()
+    # Syllabus data of the campus of the store
+    df_syl: pd.DataFrame = st.session_state[f"df_syllabus_{registry.store_campus(st.session_state['forecast_store'])}"].copy()
+    # Process POS data
+    df_cus = process_pos(df_cus)
+    # Gather all DataFrames
+    df_main = concatenate_data(df_cus, df_cal, df_syl)
+    if not df_main.empty:
+        # Split data into training and prediction sets, and add the lag features
+        yX_tr, X_for_pred = split_data(df_main)
+    else:
+        yX_tr, X_for_pred = None, None
+    st.session_state["forecast_data"] = (df_main, yX_tr, X_for_pred)
+    st.session_state["forecast_data_key"] = get_data_key()
+    return df_main, yX_tr, X_for_pred
 
-def get_holiday_dummy(df_cal: pd.DataFrame) -> list:
-    """
-    Get holiday dummy variable and return it as a list.
-    """
-    r, _ = df_cal.shape
-    holidays = []
-    for i in range(r):
-        info = df_cal.loc[i, "info"]
-        if pd.notna(info) and "Holiday" in info:
-            holidays.append(1)
-        else:
-            holidays.append(0)
-    return holidays
 
+#-------------------Scenario-------------------
 
-def get_replaced_dummy(df_cal: pd.DataFrame) -> list:
+# The scenario is a fragment: moving its sliders reruns only the scenario,
+# which predicts again from the coefficients of the trained model without training it.
+@st.fragment
+def scenario_analysis(X_pred: pd.DataFrame, yX_tr: pd.DataFrame, result: dict) -> None:
     """
-    Get replaced dummy variable and return it as a list.
+    Predictions of the prediction range under the conditions edited by the user.
     """
-    r, _ = df_cal.shape
-    replaced = []
-    for i in range(r):
-        info = df_cal.loc[i, "info"]
-        if pd.notna(info) and "Replaced" in info:
-            replaced.append(1)
-        else:
-            replaced.append(0)
-    return replaced
-
+    with st.container(border=True):
+        st.write("##### :material/tune: シナリオ分析")
+        # Options
+        with st.container(border=True):
+            syllabus_scale = {}
+            unique_terms = X_pred["学期"].unique().tolist()
+            cols = st.columns(max(len(unique_terms), 2))
+            for col, term in zip(cols, unique_terms):
+                with col:
+                    change = st.slider(
+                        label=f":material/group: {term[:4]}年度{term[4:]}の履修者数", 
+                        min_value=-50, 
+                        max_value=50, 
+                        value=0, 
+                        step=5, 
+                        format="%+d%%", 
+                        key=f"scenario_syllabus_{term}", 
+                        help="履修者数データを一律に増減させた場合の客数を予測します。"
+                    )
+                    syllabus_scale[term] = 1 + change / 100
+            holiday = X_pred["holiday"]
+            replaced = X_pred["replaced"]
+            col1, col2 = st.columns(2)
+            with col1:
+                holiday_dates = st.multiselect(
+                    label=":material/event_busy: 休日を切り替える日", 
+                    options=X_pred.index.tolist(), 
+                    format_func=lambda d: f"{d.strftime('%Y/%m/%d (%a)')}：{'休日→平日' if holiday[d] else '平日→休日'}", 
+                    key="scenario_holiday", 
+                    help="選択した日の休日・平日を入れ替えます。"
+                )
+            with col2:
+                replaced_dates = st.multiselect(
+                    label=":material/swap_horiz: 振替授業日を切り替える日", 
+                    options=X_pred.index.tolist(), 
+                    format_func=lambda d: f"{d.strftime('%Y/%m/%d (%a)')}：{'振替授業日→通常' if replaced[d] else '通常→振替授業日'}", 
+                    key="scenario_replaced", 
+                    help="選択した日の振替授業日の有無を入れ替えます。"
+                )
+        # Predict again with the edited prediction set, where the lag features follow the edited predictions
+        X = forecast.apply_scenario(X_pred, syllabus_scale, holiday_dates, replaced_dates)
+        y_base = np.asarray(result["y_pred_future"])
+        y_scenario = forecast.predict_recursive(result, X, yX_tr)
+        total_base, total_scenario = y_base.sum(), y_scenario.sum()
+        st.metric(
+            label="予測範囲の合計客数", 
+            value=f"{total_scenario:,.0f}人", 
+            delta=f"{total_scenario - total_base:+,.0f}人（{total_scenario / total_base - 1:+.1%}）"
+        )
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=X_pred.index, 
+            y=y_base, 
+            name="予測値", 
+            mode="lines+markers", 
+            marker=dict(size=5), 
+            line=dict(color="rgba(0, 0, 0, 0.3)"), 
+            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>予測値: %{y:,.1f}人<extra></extra>", 
+            hoverlabel=dict(font=dict(size=15))
+        ))
+        fig.add_trace(go.Scatter(
+            x=X_pred.index, 
+            y=y_scenario, 
+            name="シナリオの予測値", 
+            mode="lines+markers", 
+            marker=dict(size=5), 
+            line=dict(color=registry.store_color(st.session_state["forecast_store"])), 
+            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>シナリオの予測値: %{y:,.1f}人<extra></extra>", 
+            hoverlabel=dict(font=dict(size=15))
+        ))
+        st.plotly_chart(fig)
 
-def get_first_week_dummy(df_cal: pd.DataFrame) -> list:
-    """
-    Get first week dummy variable and return it as a list.
-    """
-    r, _ = df_cal.shape
-    first_week = []
-    for i in range(r):
-        nweek = df_cal.loc[i, "nweek"]
-        if nweek == 1:
-            first_week.append(1)
-        else:
-            first_week.append(0)
-    return first_week
 
+#-------------------Online model-------------------
 
-def get_last_week_dummy(df_cal: pd.DataFrame) -> list:
-    """
-    Get last week dummy variable and return it as a list.\\
-    Note that this function only works when the maximum number of week is 15.\\
-    To cope with exceptions, more complicated logic is needed (future implementation).
-    """
-    r, _ = df_cal.shape
-    last_week = []
-    for i in range(r):
-        nweek = df_cal.loc[i, "nweek"]
-        if nweek == 15:
-            last_week.append(1)
-        else:
-            last_week.append(0)
-    return last_week
+# Options of the weights of the past days in the online model, and their half-lives in days
+FORGETTING = {"すべて同じ": None, "1年で半分": 365.0, "半年で半分": 182.5}
 
 
-def process_calendar(df_cal: pd.DataFrame):
+def update_online_model(yX_tr: pd.DataFrame, X_pred: pd.DataFrame) -> dict:
     """
-    Process calendar data.
+    Fold the days added since the last run into the online model and return its result.\\
+    The sufficient statistics are kept in session state for each store, calendar and syllabus data, and forgetting,
+    so new days of the POS data (ex. from the watched folder) are folded in without revisiting the days before them.
     """
-    df_cal["nweek"] = get_nweek(df_cal)
-    df_cal["holiday"] = get_holiday_dummy(df_cal)
-    df_cal["replaced"] = get_replaced_dummy(df_cal)
-    df_cal["first_week"] = get_first_week_dummy(df_cal)
-    df_cal["last_week"] = get_last_week_dummy(df_cal)
-    return df_cal
+    half_life = FORGETTING[st.session_state["forecast_forgetting"]]
+    data_key = get_data_key()
+    # The version of the POS data is left out, since `forecast.fit_online()` starts from scratch by itself
+    # when the days already folded in or their features have changed.
+    # The versions of the calendar and syllabus data are kept, so the statistics of other data are not reused either
+    key = (data_key[0],) + data_key[2:] + (half_life,)
+    models = st.session_state.setdefault("online_models", {})
+    stats, result = forecast.fit_online(models.get(key), yX_tr, X_pred, half_life)
+    models[key] = stats
+    return result
 
 
-#-------------gather all dataframes-------------
+#-------------------Hierarchy-------------------
 
-def concatenate_data(df_cus: pd.DataFrame, df_cal: pd.DataFrame, df_syl: pd.DataFrame) -> pd.DataFrame:
+def load_item_sales() -> pd.DataFrame:
     """
-    Concatenate customer data, calendar data, and syllabus data into a single DataFrame.\\
-    If the customer data is empty, return an empty DataFrame.
+    Return the quantity of each item per store, department, and day at lunch, the bottom series of the hierarchical forecasts.\\
+    The items are aggregated in the local database, read from the Arrow dataset, or taken from session state.
     """
-    if df_cus.empty:
-        return pd.DataFrame()
-    # Assign syllabus data to the calendar data
-    r, _ = df_cal.shape
-    jp_daynames = ["月", "火", "水", "木", "金"]
-    en_daynames = ["MON", "TUE", "WED", "THU", "FRI"]
-    main_terms = ["SPR", "SMR", "AUT", "WTR"]
-    syllabus = []
-    for i in range(r):
-        academic_year = df_cal.loc[i, "academic_year"]
-        term = df_cal.loc[i, "term"]
-        class_dayname = df_cal.loc[i, "class"]
-        if term in main_terms and class_dayname in en_daynames:
-            jp_dayname = jp_daynames[en_daynames.index(class_dayname)]
-            try:
-                syl = df_syl.loc[(jp_dayname, [1, 2, 3]), str(academic_year)+term].sum()
-            except KeyError:
-                syl = float("nan")
-        else:
-            syl = float("nan")
-        syllabus.append(syl)
-    df_cal["syllabus"] = syllabus
-    # Gather all DataFrames
-    df_main = pd.merge(
-        df_cus, df_cal, how="outer", 
-        left_index=True, right_on="date"
-    ).set_index("date")
-    return df_main
+    if database.get_db_path() is not None:
+        df_itm = query_database("quantities_per_item", None, bands.lunch_hours(), registry.ALL_STORES)
+    elif st.session_state["df_items"] is None:
+        df_itm = dataset.read_pos(
+            dataset.get_dataset_dir(), "items", 
+            (st.session_state["min_date"], st.session_state["max_date"]), registry.ALL_STORES, 
+            columns=["アカウント名", "開始日時", "名前", "数量", "部門"]
+        )
+        df_itm = hierarchy.filter_lunch(df_itm) if not df_itm.empty else df_itm
+    else:
+        df_itm = hierarchy.filter_lunch(st.session_state["df_items"])
+    return hierarchy.items_per_day(df_itm)
 
 
-def split_data(df_main: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+def get_hierarchy_key() -> tuple:
     """
-    Split the DataFrame into training and prediction sets.
+    Return the key identifying the data of the hierarchical forecasts, which cover all stores.
     """
-    yX_tr = df_main[
-        (df_main["客数"].notna()) & 
-        (df_main["客数"] > 0) & 
-        (df_main["class"].isin(["MON", "TUE", "WED", "THU", "FRI"])) & 
-        (df_main["syllabus"].notna())
-    ]
-    X_pred = df_main[
-        (df_main.index > yX_tr.index.max()) & 
-        (df_main["class"].isin(["MON", "TUE", "WED", "THU", "FRI"])) & 
-        (df_main["syllabus"].notna())
-    ][["syllabus", "nweek", "holiday", "replaced", "first_week", "last_week"]]
-    return yX_tr, X_pred
-
-
-def get_train_data(yX: pd.DataFrame) -> tuple:
+    return get_data_key()[1:]
+
+
+def hierarchy_forecast() -> None:
     """
-    Split the training data into training and validation sets.
+    Forecasts of all stores, the stores, their departments, and their items, reconciled so that they add up.
     """
-    y = yX["客数"]
-    X = yX[["syllabus", "nweek", "holiday", "replaced", "first_week", "last_week"]]
-    X_tr, X_va, y_tr, y_va = train_test_split(X, y, test_size=0.2, shuffle=False)
-    return X_tr, X_va, y_tr, y_va
+    with st.container(border=True):
+        st.write("##### :material/account_tree: 階層予測（全店舗・店舗・部門・商品）")
+        # Options and a button
+        with st.container(border=True):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.selectbox(
+                    label=":material/layers: 階層", 
+                    options=hierarchy.LEVELS, 
+                    index=1, 
+                    key="hierarchy_level"
+                )
+            with col2:
+                st.selectbox(
+                    label=":material/balance: 調整方法", 
+                    options=list(hierarchy.METHODS), 
+                    index=0, 
+                    key="hierarchy_method", 
+                    help="""
+                    MinT：予測誤差の大きい系列ほど大きく動かして、すべての階層の合計を一致させます。\
+                    積み上げ：商品ごとの予測を足し上げます。\
+                    調整なし：系列ごとに個別に予測した値で、階層の間で合計が一致しません。
+                    """
+                )
+            with col1:
+                st.button(
+                    label="階層予測を実行する", 
+                    key="hierarchy_button", 
+                    help="昼の販売数量を全店舗・店舗・部門・商品ごとに予測し、上位の階層が下位の階層の合計と一致するように調整します。"
+                )
+        # Forecast all the series in a background job, which keeps running across reruns
+        if st.session_state.get("hierarchy_button", False):
+            st.session_state.pop("hierarchy_result", None)
+            st.session_state["hierarchy_job_key"] = get_hierarchy_key()
+            df_daily = load_item_sales()
+            if df_daily.empty:
+                st.warning(":material/warning: 昼の商品データがありません。")
+            else:
+                syllabi = {campus: st.session_state[f"df_syllabus_{campus}"] for campus in registry.CAMPUSES}
+                df_cal = st.session_state["calendar_dim"].reset_index()
+                start_job("hierarchy", "階層予測", hierarchy.forecast_hierarchy, df_daily, df_cal, syllabi)
+        job = finished_job("hierarchy")
+        if job is not None:
+            if job["status"] == "failed":
+                st.error("階層予測に失敗しました。")
+            elif st.session_state.get("hierarchy_job_key") == get_hierarchy_key():
+                st.session_state["hierarchy_result"] = job["result"]
+        # The result is kept until the data changes
+        result = st.session_state.get("hierarchy_result")
+        if result is None or st.session_state.get("hierarchy_job_key") != get_hierarchy_key():
+            st.info(":material/check_circle: まだ階層予測が実行されていません。")
+            return
+        if len(result["dates"]) == 0:
+            st.info(":material/check_circle: 予測可能な範囲がありません。")
+            return
+        method = st.session_state["hierarchy_method"]
+        nodes = result["nodes"]
+        forecasts = result[hierarchy.METHODS[method]]
+        st.info(
+            f"""
+            :material/check_circle: {len(nodes):,}系列（商品{(nodes["階層"] == "商品").sum():,}系列）の予測
+             - 調整なしの予測における上位と下位の階層の合計の差：最大{hierarchy.get_incoherence(result["base"], result["S"]):,.1f}個
+             - {method}の予測における上位と下位の階層の合計の差：最大{hierarchy.get_incoherence(forecasts, result["S"]):,.1f}個
+            """
+        )
+        # Series of the selected level
+        level = nodes.index[nodes["階層"] == st.session_state["hierarchy_level"]]
+        labels = nodes.loc[level, ["店舗", "部門", "商品"]].apply(lambda row: " / ".join(v for v in row if v), axis="columns")
+        node = st.selectbox(
+            label=":material/timeline: 系列", 
+            options=level.tolist(), 
+            format_func=lambda i: labels[i], 
+            key="hierarchy_node"
+        )
+        fig = go.Figure()
+        for label, values, color in [
+            ("調整なし", result["base"][:, node], "rgba(0, 0, 0, 0.3)"), 
+            (method, forecasts[:, node], registry.store_color(nodes.loc[node, "店舗"]))
+        ]:
+            fig.add_trace(go.Scatter(
+                x=result["dates"], 
+                y=values, 
+                name=label, 
+                mode="lines+markers", 
+                marker=dict(size=5), 
+                line=dict(color=color), 
+                hovertemplate=f"日付: %{{x|%Y-%m-%d (%a)}}<br>{label}: %{{y:,.1f}}個<extra></extra>", 
+                hoverlabel=dict(font=dict(size=15))
+            ))
+        st.plotly_chart(fig)
+        # Totals of the prediction range of the series of the selected level
+        with st.expander("データを見る", expanded=False):
+            df_total = nodes.loc[level, ["店舗", "部門", "商品"]].assign(**{
+                f"予測範囲の合計（{label}）": result[key][:, level].sum(axis=0) for label, key in hierarchy.METHODS.items()
+            })
+            st.dataframe(df_total, hide_index=True)
+            download_dataframe(
+                hierarchy.to_frame(result), 
+                index_flag=False, 
+                file_name=f"hierarchy_{result['dates'].min().strftime('%Y-%m-%d')}-{result['dates'].max().strftime('%Y-%m-%d')}", 
+                key="download_hierarchy"
+            )
+
 
+#-------------------Callbacks-------------------
 
-def train_model(y, X):
+def get_data_key() -> tuple:
     """
-    Train a linear regression model using the training data.
+    Return the key identifying the data and the options of the forecast,
+    so that a trained model is shown only while they are unchanged.\\
+    The uploaded data is identified by its version rather than by its range of dates or terms,
+    so corrected data of the same range is not missed.
     """
-    model = LinearRegression()
-    model.fit(X, y)
-    return model
+    return (
+        st.session_state["forecast_store"],
+        st.session_state.get("pos_version"),
+        st.session_state.get("calendar_version"),
+        st.session_state.get("syllabus_version")
+    )
 
 
 def callback_on_change():
@@ -267,15 +379,7 @@ def callback_on_change():
     Callback function.
     """
     st.session_state["model_trained"] = False
-
-
-def convert_for_download(df: pd.DataFrame, index_flag: bool) -> bytes:
-    """
-    Convert the DataFrame to a CSV format encoded in Shift-JIS for download.\\
-    The `index` parameter determines whether to include the index in the CSV.\\
-    The option of `encoding` in `pd.DataFrame.to_csv()` is not supported when `path_or_buf` is `None`.
-    """
-    return df.to_csv(index=index_flag).encode("shift-jis")
+    st.session_state.pop("forecast_result", None)
 
 
 #-----------------------------------------Contents-----------------------------------------
@@ -285,6 +389,9 @@ st.logo(favicon, size="large")
 
 st.header("1日当たりの客数予測")
 
+# Load the POS data written into the shared Arrow dataset since the last run, ex. from the watched folder
+sync_pos_dataset()
+
 # Check if the required files are uploaded
 not_uploaded_files = check_uploaded_files()
 if not_uploaded_files:
@@ -309,7 +416,7 @@ with st.container(border=True):
         with col1:
             st.selectbox(
                 label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア"], 
+                options=st.session_state["store_options"], 
                 index=0, 
                 key="forecast_store", 
                 on_change=callback_on_change
@@ -317,80 +424,85 @@ with st.container(border=True):
         with col2:
             st.selectbox(
                 label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）"], 
+                options=[bands.lunch_hours()], 
                 index=0, 
                 key="forecast_bsh", 
                 help="夜営業については、一部の会計データがPOSデータに記録されていないため予測できません。"
             )
-        with col1:
-            st.button(
-                label="学習・予測する", 
-                key="train_predict_button", 
-                help="予測可能な範囲がない場合、学習のみ実行されます。"
+        with col3:
+            st.selectbox(
+                label=":material/update: 学習方法", 
+                options=["一括学習", "逐次学習"], 
+                index=0, 
+                key="forecast_method", 
+                on_change=callback_on_change, 
+                help="逐次学習では、新しい日のPOSデータが追加されるたびに、過去のデータを読み直さずにモデルを更新します。"
+            )
+        with col4:
+            st.selectbox(
+                label=":material/history: 過去データの重み", 
+                options=list(FORGETTING), 
+                index=0, 
+                key="forecast_forgetting", 
+                on_change=callback_on_change, 
+                disabled=st.session_state["forecast_method"] == "一括学習", 
+                help="逐次学習において、古い日のデータの重みを小さくして学年暦や客層の変化に追従させます。"
             )
+        if st.session_state["forecast_method"] == "一括学習":
+            with col1:
+                st.button(
+                    label="学習・予測する", 
+                    key="train_predict_button", 
+                    help="予測可能な範囲がない場合、学習のみ実行されます。"
+                )
     # Data preparation
     with st.container(border=True):
         # Check if the data is available for the selected options
         if not check_options(st.session_state["forecast_store"]):
             st.image(sleeping)
             st.stop()
-        # When all data is ready, load them from session state
-        df_cus: pd.DataFrame = st.session_state["df_customers"].copy()
-        df_cal: pd.DataFrame = st.session_state["df_calendar"].copy()
-        if st.session_state["forecast_store"] == "西食堂":
-            df_syl: pd.DataFrame = st.session_state["df_syllabus_west"].copy()
-        else:
-            df_syl: pd.DataFrame = st.session_state["df_syllabus_east"].copy()     
-        # Process POS data
-        df_cus = process_pos(df_cus)
-        # Process calendar data
-        df_cal = process_calendar(df_cal)
-        # Gather all DataFrames
-        df_main = concatenate_data(df_cus, df_cal, df_syl)
-        if not df_main.empty:
-            # Split data into training and prediction sets
-            yX_tr, X_for_pred = split_data(df_main)
-            if yX_tr.empty:
-                st.image(sleeping_no_training_data)
-                st.stop() # Stop execution 
-        else:
+        df_main, yX_tr, X_for_pred = prepare_data()
+        if df_main.empty:
             st.image(sleeping)
-    # Train model
-    if st.session_state.get("train_predict_button", False):
-        with st.spinner("モデルを学習中...", show_time=True):
-            # Split data into training and validation sets
-            x_tr, x_va, y_tr, y_va = get_train_data(yX_tr)
-            # Train the model
-            model = train_model(np.log(y_tr), x_tr)
-            # Predict
-            y_tr_pred = np.exp(model.predict(x_tr))
-            y_va_pred = np.exp(model.predict(x_va))
-            y_pred = y_tr_pred.tolist() + y_va_pred.tolist()
-            if not X_for_pred.empty:
-                y_pred_future = np.exp(model.predict(X_for_pred)).tolist()
-            else:
-                y_pred_future = []
-            # Calculate evaluation metrics
-            tr_rmse = root_mean_squared_error(y_tr, y_tr_pred)
-            va_rmse = root_mean_squared_error(y_va, y_va_pred)
-            tr_mape = mean_absolute_percentage_error(y_tr, y_tr_pred)
-            va_mape = mean_absolute_percentage_error(y_va, y_va_pred)
-            # Set session state variable
-            st.session_state["model_trained"] = True
+            st.stop()
+        if yX_tr.empty:
+            st.image(sleeping_no_training_data)
+            st.stop() # Stop execution 
+    # The online model is updated at every run, which takes much less time than training from scratch
+    if st.session_state["forecast_method"] == "逐次学習":
+        st.session_state["forecast_result"] = update_online_model(yX_tr, X_for_pred)
+        st.session_state["forecast_job_key"] = get_data_key()
+    # Train model in a background job, which keeps running across reruns
+    elif st.session_state.get("train_predict_button", False):
+        st.session_state.pop("forecast_result", None)
+        st.session_state["forecast_job_key"] = get_data_key()
+        start_job("forecast", "モデルの学習・予測", forecast.fit_and_predict, yX_tr, X_for_pred)
+    # Show the progress of the job, or keep its result when it has finished
+    job = finished_job("forecast")
+    if job is not None and st.session_state["forecast_method"] == "一括学習":
+        if job["status"] == "failed":
+            st.error("モデルの学習に失敗しました。")
+        elif st.session_state.get("forecast_job_key") == get_data_key():
+            st.session_state["forecast_result"] = job["result"]
+    # The result is kept until the data or the store changes
+    result = st.session_state.get("forecast_result")
+    if result is not None and st.session_state.get("forecast_job_key") == get_data_key():
+        y_pred, y_pred_future = result["y_pred"], result["y_pred_future"]
+        tr_rmse, va_rmse, tr_mape, va_mape = result["tr_rmse"], result["va_rmse"], result["tr_mape"], result["va_mape"]
+        st.session_state["model_trained"] = True
     # Plot graph
     with st.container(border=True):
-        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
         fig = go.Figure()
         fig.add_trace(go.Scatter(
             x=yX_tr.index, 
             y=yX_tr["客数"], 
             name="実際の客数", 
             mode="lines+markers", 
-            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>",
+            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人%{customdata}<extra></extra>",
             hoverlabel=dict(font=dict(size=15)), 
-            meta=yX_tr[["academic_year", "term", "class", "info"]].values.tolist(), 
+            customdata=yX_tr["hover"].tolist(), 
             marker=dict(size=5), 
-            line=dict(color=colors[st.session_state["forecast_store"]])
+            line=dict(color=registry.store_color(st.session_state["forecast_store"]))
         ))
         # Add training range rectangle
         fig.add_shape(
@@ -440,7 +552,20 @@ with st.container(border=True):
             ))
         st.plotly_chart(fig)
     # Metrics
-    if st.session_state.get("model_trained", False):
+    if st.session_state.get("model_trained", False) and st.session_state["forecast_method"] == "逐次学習":
+        # The one-step-ahead errors of the days predicted before they were folded in
+        if va_mape is not None:
+            va_message = f"{va_mape:.1%}（{va_rmse:.1f}人）"
+        else:
+            va_message = "新しい日のデータが追加されると計算されます。"
+        st.info(
+            f"""
+            :material/check_circle: 逐次学習モデルの評価指標
+             - 学習データにおける平均的な予測誤差：{tr_mape:.1%}（{tr_rmse:.1f}人）
+             - 追加された日の事前の予測誤差：{va_message}
+            """
+        )
+    elif st.session_state.get("model_trained", False):
         st.info(
             f"""
             :material/check_circle: 学習済みモデルの評価指標
@@ -455,13 +580,13 @@ with st.container(border=True):
              - まだモデルが学習されていません。
             """
         )
+    # Scenario on the prediction range, using the coefficients of the trained model
+    if st.session_state.get("model_trained", False) and not X_for_pred.empty:
+        scenario_analysis(X_for_pred, yX_tr, result)
     # Data
     with st.expander("データを見る", expanded=False):
         if st.session_state.get("model_trained", False):
-            if st.session_state["forecast_store"] == "西食堂":
-                store_name = "west"
-            else:
-                store_name = "east"
+            store_name = st.session_state["forecast_store"]
             if not X_for_pred.empty:
                 df_pred = pd.DataFrame(
                     index=yX_tr.index.tolist() + X_for_pred.index.tolist(), 
@@ -471,12 +596,12 @@ with st.container(border=True):
                     }
                 ).rename_axis(index="日付")
                 st.dataframe(df_pred)
-                st.download_button(
-                        label=":material/download: `.csv`でダウンロード", 
-                        data=convert_for_download(df_pred, index_flag=True), 
-                        file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{X_for_pred.index.max().strftime("%Y-%m-%d")}.csv", 
-                        mime="text/csv"
-                    )
+                download_dataframe(
+                    df_pred, 
+                    index_flag=True, 
+                    file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{X_for_pred.index.max().strftime("%Y-%m-%d")}", 
+                    key="download_pred"
+                )
             else:
                 df_pred = pd.DataFrame(
                     index=yX_tr.index, 
@@ -486,10 +611,11 @@ with st.container(border=True):
                     }
                 ).rename_axis(index="日付")
                 st.dataframe(df_pred)
-                st.download_button(
-                        label=":material/download: `.csv`でダウンロード", 
-                        data=convert_for_download(df_pred, index_flag=True), 
-                        file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{yX_tr.index.max().strftime("%Y-%m-%d")}.csv", 
-                        mime="text/csv"
-                    )
-
+                download_dataframe(
+                    df_pred, 
+                    index_flag=True, 
+                    file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{yX_tr.index.max().strftime("%Y-%m-%d")}", 
+                    key="download_pred"
+                )
+    # Forecasts of the hierarchy of all stores, which add up across the levels
+    hierarchy_forecast()
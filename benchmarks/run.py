@@ -0,0 +1,214 @@
+"""
+Benchmarks of the hot paths of POScope, run outside Streamlit on synthetic data of several sizes.
+
+Usage (from the repository root):
+    python benchmarks/run.py --days 30 365 1826 --repeat 3
+    python benchmarks/run.py --days 365 --compare
+
+Each run appends one JSON line per benchmark and size to the results file (default: data/benchmarks/results.jsonl),
+with the commit, the host, and the minimum, median, and maximum of the wall times.
+With `--compare`, the medians are compared with the latest earlier run of the same size on the same host,
+and the exit code is 1 if any benchmark is slower than `--threshold` times the previous one
+by more than `--min-delta` seconds.
+"""
+import os
+import sys
+import io
+import json
+import time
+import socket
+import argparse
+import datetime
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from poscope import forecast, ingest, registry, synthetic, visualize
+
+
+#-----------------------------------------Benchmarks-----------------------------------------
+
+def measure(func, repeat: int, setup=None) -> list[float]:
+    """
+    Return the wall times of `repeat` calls of `func`.
+    `setup` is called before each call and not measured.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_size(days: int, repeat: int, workdir: str) -> list[dict]:
+    """
+    Run all benchmarks on synthetic data of two stores for `days` days and return the results.\\
+    All options of the visualize page cover the whole period, both stores, and "昼・夜".
+    """
+    out = os.path.join(workdir, f"days{days}")
+    paths = synthetic.generate(out, "2024-04-01", days, stores=2)
+    zips = []
+    for path in paths:
+        if path.endswith(".zip"):
+            with open(path, "rb") as f:
+                zips.append(f.read())
+    results = []
+
+    def bench(name: str, func, setup=None, rows: int | None = None):
+        times = measure(func, repeat, setup)
+        results.append({
+            "name": name, "days": days, "rows": rows,
+            "min": min(times), "median": statistics.median(times), "max": max(times), "repeat": repeat
+        })
+        print(f"{name:<40} {days:>6}日 {statistics.median(times):>10.4f}s", flush=True)
+
+    # Ingestion
+    df_checkouts, df_items, df_payments = ingest.read_pos_zips([io.BytesIO(b) for b in zips])
+    bench("ingest.read_pos_zips", lambda: ingest.read_pos_zips([io.BytesIO(b) for b in zips]), rows=len(df_checkouts))
+    df_cus, df_itm = ingest.cleanup_pos(df_checkouts, df_items, df_payments)
+    bench("ingest.cleanup_pos", lambda: ingest.cleanup_pos(df_checkouts, df_items, df_payments), rows=len(df_checkouts))
+    bench("ingest.compute_checkout_load", lambda: ingest.compute_checkout_load(df_cus), rows=len(df_cus))
+    bench("ingest.compute_checkout_duration", lambda: ingest.compute_checkout_duration(df_cus), rows=len(df_cus))
+    bench("ingest.build_sales_cube", lambda: ingest.build_sales_cube(df_cus, df_itm), rows=len(df_itm))
+    df_load = ingest.compute_checkout_load(df_cus)
+    df_dur = ingest.compute_checkout_duration(df_cus)
+    df_cube = ingest.build_sales_cube(df_cus, df_itm)
+    df_syl_west = pd.read_excel(os.path.join(out, "syllabus.xlsx"), sheet_name="west", index_col=[0, 1])
+    df_syl_east = pd.read_excel(os.path.join(out, "syllabus.xlsx"), sheet_name="east", index_col=[0, 1])
+    syl_cube, terms = ingest.build_syllabus_cube(df_syl_west, df_syl_east)
+    df_cal = pd.read_excel(os.path.join(out, "calendar.xlsx"))
+    df_dim = ingest.build_calendar_dim(df_cal.copy())
+
+    # Visualization
+    date = (df_cus["開始日時"].min().date(), df_cus["開始日時"].max().date())
+    bsh = "昼・夜"
+    item = df_itm["名前"].value_counts().index[0]
+    department = df_itm["部門"].value_counts().index[0]
+    df_cus_view = visualize.filter_pos(df_cus, date, bsh, registry.ALL_STORES)
+    df_itm_view = visualize.filter_pos(df_itm, date, bsh, registry.ALL_STORES)
+    df_west = df_cus[df_cus["アカウント名"] == registry.store_names()[0]]
+    bench("visualize.filter_pos", lambda: visualize.filter_pos(df_cus, date, bsh, registry.ALL_STORES), rows=len(df_cus))
+    bench("visualize.customers_by_time",
+          lambda: visualize.customers_by_time(visualize.resample_customers(df_west, "10min"), bsh), rows=len(df_west))
+    bench("visualize.customers_per_day", lambda: visualize.sum_per_day(df_cus_view, "客数"), rows=len(df_cus_view))
+    bench("visualize.payment_methods", lambda: visualize.payment_methods(df_cus_view), rows=len(df_cus_view))
+    bench("visualize.item_candidates", lambda: visualize.item_candidates(df_itm_view, "名前"), rows=len(df_itm_view))
+    bench("visualize.items_per_day",
+          lambda: visualize.sum_per_day(visualize.select_items(df_itm_view, "名前", item), "数量"), rows=len(df_itm_view))
+    bench("visualize.departments_per_day",
+          lambda: visualize.sum_per_day(visualize.select_items(df_itm_view, "部門", department), "数量"), rows=len(df_itm_view))
+    bench("visualize.basket", lambda: visualize.basket(df_itm_view, "名前"), rows=len(df_itm_view))
+    df_pairs, _, _ = visualize.basket(df_itm_view, "名前")
+    anchor = df_pairs["商品A"].iloc[0] if not df_pairs.empty else ""
+    bench("visualize.process_basket_anchor", lambda: visualize.process_basket_anchor(df_pairs, anchor, 1), rows=len(df_pairs))
+    bench("visualize.checkout_queue", lambda: visualize.checkout_queue(df_load, df_dur, date, bsh, registry.ALL_STORES), rows=len(df_load))
+    bench("visualize.revenue", lambda: visualize.revenue(visualize.slice_sales_cube(df_cube, date, bsh, registry.ALL_STORES)), rows=len(df_cube))
+    periods = ["1限", "2限", "3限", "4限", "5限"]
+    years = visualize.syllabus_years(terms)[:1]
+    bench("visualize.syllabus_by_weekday", lambda: visualize.syllabus_by_weekday(syl_cube, terms, periods, years))
+    bench("visualize.syllabus_traffic",
+          lambda: visualize.syllabus_traffic(syl_cube, terms, df_dim, df_cube, periods, years), rows=len(df_dim))
+
+    # Forecast
+    df_pos = forecast.customers_per_day(forecast.filter_lunch(df_cus, registry.store_names()[0]))
+    df_cal_processed = forecast.process_calendar(df_cal.copy())
+    df_main = forecast.concatenate_data(df_pos, df_cal_processed.copy(), df_syl_west)
+    bench("forecast.customers_per_day",
+          lambda: forecast.customers_per_day(forecast.filter_lunch(df_cus, registry.store_names()[0])), rows=len(df_cus))
+    bench("forecast.process_calendar", lambda: forecast.process_calendar(df_cal.copy()), rows=len(df_cal))
+    bench("ingest.build_calendar_dim", lambda: ingest.build_calendar_dim(df_cal.copy()), rows=len(df_cal))
+    bench("forecast.concatenate_data",
+          lambda: forecast.concatenate_data(df_pos, df_cal_processed.copy(), df_syl_west), rows=len(df_pos))
+    if not df_main.empty:
+        yX_tr, _ = forecast.split_data(df_main)
+        if not yX_tr.empty:
+            x_tr, _, y_tr, _ = forecast.get_train_data(yX_tr)
+            X_tr = forecast.design_matrix(x_tr)
+            bench("forecast.train_model", lambda: forecast.train_model(np.log(y_tr), X_tr), rows=len(x_tr))
+    return results
+
+
+#-----------------------------------------Results-----------------------------------------
+
+def get_commit() -> str:
+    """
+    Return the hash of the current commit, or an empty string outside a git repository.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def load_previous(path: str, host: str) -> dict:
+    """
+    Return the latest earlier result of each benchmark and size on the host.
+    """
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["host"] == host:
+                previous[(record["name"], record["days"])] = record
+    return previous
+
+
+def compare(results: list[dict], previous: dict, threshold: float, min_delta: float) -> bool:
+    """
+    Print the ratios of the medians to the previous ones and return whether any of them exceeds `threshold`.\\
+    Differences smaller than `min_delta` seconds are ignored, since the times of very fast functions are mostly noise.
+    """
+    regressed = False
+    for result in results:
+        before = previous.get((result["name"], result["days"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] > 0 else float("inf")
+        slower = ratio > threshold and result["median"] - before["median"] > min_delta
+        mark = "REGRESSION" if slower else ""
+        print(f"{result['name']:<40} {result['days']:>6}日 x{ratio:>6.2f} (前回 {before['commit']}) {mark}")
+        regressed |= slower
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the benchmarks of POScope.")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365], help="sizes of the synthetic data in days")
+    parser.add_argument("--repeat", type=int, default=3, help="number of calls of each benchmark")
+    parser.add_argument("--results", default=os.path.join("data", "benchmarks", "results.jsonl"), help="JSON-lines file of the results")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous results on this host")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio of the medians regarded as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="differences of the medians ignored in seconds")
+    args = parser.parse_args()
+    host = socket.gethostname()
+    commit = get_commit()
+    previous = load_previous(args.results, host)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for days in args.days:
+            results += run_size(days, args.repeat, workdir)
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps({"time": now, "commit": commit, "host": host, **result}, ensure_ascii=False) + "\n")
+    if args.compare and compare(results, previous, args.threshold, args.min_delta):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Time bands of the business hours.\\
+Each band has a name and its start and end ("HH:MM"), both included in the same way as `between_time()`.
+The bands are given by the JSON file of `POSCOPE_BANDS` (a list of such objects in the order of the day),
+or `DEFAULT_BANDS` otherwise. The forecasts are made for the band with `"forecast": true` (lunch), or the first band.\\
+The time of day of the checkouts and items is coded once at cleanup by `add_time_columns()`:
+"時間帯" is an ordered category of the bands, the gaps between them, and `OUTSIDE`,
+and "時刻" is the minute of the day. The options of business hours in the pages select a range of the codes of "時間帯",
+so filtering is an integer comparison instead of `between_time()` on a datetime index.
+"""
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+
+
+# The bands are read from this JSON file when the environment variable is set
+BANDS_FILE_ENV = "POSCOPE_BANDS"
+
+# Bands in the order of the day
+DEFAULT_BANDS = [
+    {"name": "昼", "start": "11:00", "end": "14:00", "forecast": True},
+    {"name": "夜", "start": "17:30", "end": "19:30"}
+]
+
+# Band of the times before the first band and after the last band
+OUTSIDE = "営業時間外"
+
+# Columns added to the customers and items by `add_time_columns()`
+TIME_COLUMNS = ["時間帯", "時刻"]
+
+
+def to_seconds(hhmm: str) -> int:
+    """
+    Return the seconds from midnight of "HH:MM".
+    """
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+@functools.cache
+def get_bands() -> tuple[dict, ...]:
+    """
+    Return the bands, read once per process.
+    """
+    path = os.environ.get(BANDS_FILE_ENV, "")
+    if not path:
+        return tuple(DEFAULT_BANDS)
+    with open(path, encoding="utf-8") as f:
+        bands = json.load(f)
+    if not bands:
+        raise ValueError(f"{path} has no band")
+    end = -1
+    for band in bands:
+        if "name" not in band or "start" not in band or "end" not in band:
+            raise ValueError(f"Each band in {path} needs \"name\", \"start\", and \"end\": {band}")
+        if not end < to_seconds(band["start"]) <= to_seconds(band["end"]):
+            raise ValueError(f"The bands in {path} must be in the order of the day without overlapping: {band}")
+        end = to_seconds(band["end"])
+    return tuple(bands)
+
+
+def band_labels() -> list[str]:
+    """
+    Return the categories of "時間帯" in the order of their codes: each band followed by the gap to the next band
+    (ex. "昼夜間" between "昼" and "夜"), and `OUTSIDE` last.
+    """
+    names = [band["name"] for band in get_bands()]
+    labels = []
+    for name, next_name in zip(names, names[1:]):
+        labels += [name, f"{name}{next_name}間"]
+    return labels + [names[-1], OUTSIDE]
+
+
+def business_hours_options() -> list[str]:
+    """
+    Return the options of business hours in the pages: each band such as "昼（11:00～14:00）",
+    and all bands at once such as "昼・夜", which includes the gaps between them.
+    """
+    bands = get_bands()
+    options = [f"{band['name']}（{band['start']}～{band['end']}）" for band in bands]
+    if len(bands) > 1:
+        options.append("・".join(band["name"] for band in bands))
+    return options
+
+
+def lunch_hours() -> str:
+    """
+    Return the option of business hours of the band for which the forecasts are made.
+    """
+    bands = get_bands()
+    i = next((i for i, band in enumerate(bands) if band.get("forecast")), 0)
+    return business_hours_options()[i]
+
+
+def get_band_range(business_hours: str) -> tuple[int, int]:
+    """
+    Return the first and last indices of the bands of the option of business hours.
+    """
+    options = business_hours_options()
+    if business_hours not in options:
+        raise ValueError(f"Unknown business hours: {business_hours}")
+    i = options.index(business_hours)
+    return (i, i) if i < len(get_bands()) else (0, len(get_bands()) - 1)
+
+
+def get_code_range(business_hours: str) -> tuple[int, int]:
+    """
+    Return the first and last codes of "時間帯" within the option of business hours.
+    """
+    first, last = get_band_range(business_hours)
+    return 2 * first, 2 * last
+
+
+def get_time_range(business_hours: str) -> tuple[str, str]:
+    """
+    Return the start and end ("HH:MM") of the option of business hours.
+    """
+    first, last = get_band_range(business_hours)
+    return get_bands()[first]["start"], get_bands()[last]["end"]
+
+
+def get_seconds_range(business_hours: str) -> tuple[int, int]:
+    """
+    Return the start and end of the option of business hours in seconds from midnight.
+    """
+    start, end = get_time_range(business_hours)
+    return to_seconds(start), to_seconds(end)
+
+
+def get_day_range() -> tuple[int, int]:
+    """
+    Return the start of the first band and the end of the last band in seconds from midnight.
+    """
+    bands = get_bands()
+    return to_seconds(bands[0]["start"]), to_seconds(bands[-1]["end"])
+
+
+def band_codes(seconds: np.ndarray) -> np.ndarray:
+    """
+    Return the codes of "時間帯" of the times given in seconds from midnight.
+    """
+    bands = get_bands()
+    starts = np.array([to_seconds(band["start"]) for band in bands])
+    ends = np.array([to_seconds(band["end"]) for band in bands])
+    # The last band starting at or before each time (-1 before the first band)
+    i = np.searchsorted(starts, seconds, side="right") - 1
+    inside = (i >= 0) & (seconds <= ends[np.maximum(i, 0)])
+    codes = np.where(inside, 2 * i, 2 * i + 1)
+    # Before the first band or after the last band
+    codes[(i < 0) | (~inside & (i == len(bands) - 1))] = 2 * len(bands) - 1
+    return codes.astype("int8")
+
+
+def add_time_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the DataFrame of customers or items with the columns of `TIME_COLUMNS` derived from "開始日時".
+    """
+    dt = df["開始日時"]
+    minutes = dt.dt.hour.to_numpy() * 60 + dt.dt.minute.to_numpy()
+    codes = band_codes(minutes * 60 + dt.dt.second.to_numpy())
+    return df.assign(
+        時間帯=pd.Categorical.from_codes(codes, categories=band_labels(), ordered=True),
+        時刻=minutes.astype("int16")
+    )
+
+
+def filter_business_hours(df: pd.DataFrame, business_hours: str) -> pd.DataFrame:
+    """
+    Keep the rows of the DataFrame with "時間帯" within the option of business hours.
+    """
+    first, last = get_code_range(business_hours)
+    codes = df["時間帯"].cat.codes.to_numpy()
+    return df[(first <= codes) & (codes <= last)]
@@ -0,0 +1,292 @@
+import os
+import sqlite3
+import uuid
+import datetime
+import numpy as np
+import pandas as pd
+
+from poscope import bands, registry
+
+
+# The local database is enabled only when this environment variable is set to the path of the SQLite file
+DB_PATH_ENV = "POSCOPE_DB_PATH"
+
+# Columns of the DataFrame of customers which are not payment methods
+CUSTOMER_COLUMNS = ["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数"] + bands.TIME_COLUMNS
+
+# Datetimes are stored as seconds from 1970-01-01 of the naive local time,
+# so the date is `開始日時 / 86400` and the time of day is `開始日時 % 86400`.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    会計ID TEXT PRIMARY KEY,
+    アカウント名 TEXT NOT NULL,
+    開始日時 INTEGER NOT NULL,
+    会計日時 INTEGER NOT NULL,
+    金額 INTEGER NOT NULL,
+    客数 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS customers_store_time ON customers (アカウント名, 開始日時);
+CREATE INDEX IF NOT EXISTS customers_time ON customers (開始日時);
+CREATE TABLE IF NOT EXISTS payments (
+    会計ID TEXT NOT NULL,
+    支払い方法 TEXT NOT NULL,
+    回数 INTEGER NOT NULL,
+    PRIMARY KEY (会計ID, 支払い方法)
+);
+CREATE TABLE IF NOT EXISTS items (
+    会計ID TEXT NOT NULL,
+    アカウント名 TEXT NOT NULL,
+    開始日時 INTEGER NOT NULL,
+    SKU TEXT,
+    バーコード TEXT,
+    名前 TEXT,
+    数量 INTEGER NOT NULL,
+    金額 INTEGER NOT NULL,
+    部門 TEXT
+);
+CREATE INDEX IF NOT EXISTS items_store_time ON items (アカウント名, 開始日時);
+CREATE INDEX IF NOT EXISTS items_time ON items (開始日時);
+CREATE INDEX IF NOT EXISTS items_checkout ON items (会計ID);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def get_db_path() -> str | None:
+    """
+    Return the path of the SQLite file, or `None` if the local database is disabled.
+    """
+    path = os.environ.get(DB_PATH_ENV, "")
+    return path if path else None
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open the SQLite file and create the tables if they do not exist.\\
+    A connection is opened for each call since the scripts of Streamlit run in different threads.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    return con
+
+
+def to_seconds(dt: pd.Series):
+    """
+    Convert naive datetimes to seconds from 1970-01-01.
+    """
+    return dt.to_numpy(dtype="datetime64[s]").astype("int64")
+
+
+def to_text(s: pd.Series) -> list:
+    """
+    Convert the values to strings, with `None` (NULL) for the missing values instead of "nan".\\
+    Missing strings of the items (see `ingest.TEXT_COLUMNS`) are NULL in the database and NaN in the results of the queries.
+    """
+    return s.astype(object).where(s.notna(), None).map(lambda x: x if x is None else str(x)).tolist()
+
+
+def write_pos(path: str, df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> None:
+    """
+    Write the output of `cleanup_pos()` into the database.\\
+    Checkouts already in the database are replaced, so the same data can be written more than once
+    and the history grows by uploading new periods.\\
+    One-hot columns of payment methods are stored as rows of (会計ID, 支払い方法, 回数).
+    """
+    cus_ids = df_cus["会計ID"].astype("str")
+    rows_cus = zip(
+        cus_ids, df_cus["アカウント名"], to_seconds(df_cus["開始日時"]).tolist(),
+        to_seconds(df_cus["会計日時"]).tolist(), df_cus["金額"].astype("int").tolist(), df_cus["客数"].astype("int").tolist()
+    )
+    pms = [c for c in df_cus.columns if c not in CUSTOMER_COLUMNS]
+    df_pm = df_cus[pms].set_axis(cus_ids, axis="index").rename_axis(index="会計ID")
+    df_pm = df_pm.stack().rename("回数").reset_index()
+    df_pm = df_pm[df_pm["回数"] > 0]
+    rows_pm = zip(df_pm["会計ID"], df_pm.iloc[:, 1], df_pm["回数"].astype("int").tolist())
+    rows_itm = zip(
+        df_itm["会計ID"].astype("str"), df_itm["アカウント名"], to_seconds(df_itm["開始日時"]).tolist(),
+        to_text(df_itm["SKU"]), to_text(df_itm["バーコード"]), to_text(df_itm["名前"]),
+        df_itm["数量"].astype("int").tolist(), df_itm["金額"].astype("int").tolist(), to_text(df_itm["部門"])
+    )
+    with connect(path) as con:
+        # Remove the checkouts to be replaced
+        con.execute("CREATE TEMP TABLE new_ids (会計ID TEXT PRIMARY KEY)")
+        con.executemany("INSERT OR IGNORE INTO new_ids VALUES (?)", ((x,) for x in cus_ids))
+        for table in ["customers", "payments", "items"]:
+            con.execute(f"DELETE FROM {table} WHERE 会計ID IN (SELECT 会計ID FROM new_ids)")
+        con.execute("DROP TABLE new_ids")
+        con.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?)", rows_cus)
+        con.executemany("INSERT INTO payments VALUES (?, ?, ?)", rows_pm)
+        con.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows_itm)
+        # The version identifies the contents of the database in the keys of `@st.cache_data`
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (uuid.uuid4().hex,))
+    con.close()
+
+
+def get_version(path: str) -> str:
+    """
+    Return the version of the contents of the database, which changes at every write.
+    """
+    with connect(path) as con:
+        row = con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    con.close()
+    return row[0] if row else ""
+
+
+def get_date_range(path: str) -> dict[str, tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Return the first and last "開始日時" of each store in the database.
+    """
+    with connect(path) as con:
+        rows = con.execute(
+            "SELECT アカウント名, MIN(開始日時), MAX(開始日時) FROM customers GROUP BY アカウント名"
+        ).fetchall()
+    con.close()
+    return {store: (pd.Timestamp(lo, unit="s"), pd.Timestamp(hi, unit="s")) for store, lo, hi in rows}
+
+
+def build_where(date: tuple[datetime.date] | None, business_hours: str | None, store: str, table: str) -> tuple[str, list]:
+    """
+    Return the WHERE clause and its parameters for the filters of the visualize and forecast pages.\\
+    `date=None` keeps all dates, `business_hours=None` keeps all times of day,
+    and `store=registry.ALL_STORES` keeps all stores.
+    """
+    clauses = []
+    params = []
+    if date is not None:
+        clauses.append(f"{table}.開始日時 >= ? AND {table}.開始日時 < ?")
+        params += [
+            int(pd.Timestamp(date[0]).timestamp()),
+            int((pd.Timestamp(date[1]) + pd.Timedelta("1D")).timestamp())
+        ]
+    if store != registry.ALL_STORES:
+        clauses.append(f"{table}.アカウント名 = ?")
+        params.append(store)
+    if business_hours is not None:
+        # Both ends are included in the same way as the codes of "時間帯" (see `poscope.bands`)
+        clauses.append(f"{table}.開始日時 % 86400 BETWEEN ? AND ?")
+        params += list(bands.get_seconds_range(business_hours))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def query(path: str, sql: str, params: list) -> pd.DataFrame:
+    """
+    Run the query and return the result as a DataFrame.
+    """
+    with connect(path) as con:
+        df = pd.read_sql_query(sql, con, params=params)
+    con.close()
+    # NULL is read as None, but missing values are NaN in the rest of the app
+    return df.fillna(np.nan)
+
+
+def customers_per_span(path: str, date: tuple[datetime.date], store: str, span: int) -> pd.DataFrame:
+    """
+    Return the number of customers in each bin of `span` seconds from midnight.\\
+    Business hours are not applied so that the caller can apply them to the bins in the same way as the pandas path.
+    """
+    where, params = build_where(date, None, store, "customers")
+    df = query(
+        path,
+        f"""
+        SELECT customers.開始日時 / ? * ? AS 開始日時, SUM(客数) AS 客数
+        FROM customers{where}
+        GROUP BY 1 ORDER BY 1
+        """,
+        [span, span] + params
+    )
+    df["開始日時"] = pd.to_datetime(df["開始日時"], unit="s")
+    return df
+
+
+def customers_per_day(path: str, date: tuple[datetime.date] | None, business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Return the number of customers per store and day.
+    """
+    where, params = build_where(date, business_hours, store, "customers")
+    df = query(
+        path,
+        f"""
+        SELECT アカウント名, 開始日時 / 86400 * 86400 AS 開始日時, SUM(客数) AS 客数
+        FROM customers{where}
+        GROUP BY 1, 2 ORDER BY 1, 2
+        """,
+        params
+    )
+    df["開始日時"] = pd.to_datetime(df["開始日時"], unit="s")
+    return df
+
+
+def payment_methods(path: str, date: tuple[datetime.date], business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Return the total number of customers per payment method.\\
+    A checkout with multiple payment methods is counted for each of them.
+    """
+    where, params = build_where(date, business_hours, store, "customers")
+    return query(
+        path,
+        f"""
+        SELECT payments.支払い方法 AS 支払い方法, SUM(payments.回数 * customers.客数) AS 合計利用者数
+        FROM customers JOIN payments ON customers.会計ID = payments.会計ID{where}
+        GROUP BY 1
+        """,
+        params
+    )
+
+
+def items_per_day(path: str, date: tuple[datetime.date], business_hours: str, store: str,
+                  column: str, value: str, aggregation: str) -> pd.DataFrame:
+    """
+    Return the sum of `aggregation` ("数量" or "金額") of the items whose `column` ("名前", "SKU", "バーコード", or "部門")
+    equals `value`, per store and day.
+    """
+    # Column names are checked since they cannot be passed as parameters
+    if column not in ["名前", "SKU", "バーコード", "部門"] or aggregation not in ["数量", "金額"]:
+        raise ValueError(f"Unsupported column: {column}, {aggregation}")
+    where, params = build_where(date, business_hours, store, "items")
+    # `IS` compares NULL as a value as well
+    where = (where + " AND " if where else " WHERE ") + f"items.{column} IS ?"
+    df = query(
+        path,
+        f"""
+        SELECT アカウント名, 開始日時 / 86400 * 86400 AS 開始日時, SUM({aggregation}) AS {aggregation}
+        FROM items{where}
+        GROUP BY 1, 2 ORDER BY 1, 2
+        """,
+        params + [value]
+    )
+    df["開始日時"] = pd.to_datetime(df["開始日時"], unit="s")
+    return df
+
+
+def item_candidates(path: str, date: tuple[datetime.date], business_hours: str, store: str, column: str) -> list:
+    """
+    Return the distinct values of `column` of the items sold, except the missing ones.
+    """
+    if column not in ["名前", "SKU", "バーコード", "部門"]:
+        raise ValueError(f"Unsupported column: {column}")
+    where, params = build_where(date, business_hours, store, "items")
+    where = (where + " AND " if where else " WHERE ") + f"{column} IS NOT NULL"
+    return query(path, f"SELECT DISTINCT {column} FROM items{where}", params)[column].tolist()
+
+
+def quantities_per_item(path: str, date: tuple[datetime.date] | None, business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Return the quantity sold of each item per store, department ("部門"), and day, the bottom series of the hierarchical forecasts.
+    """
+    where, params = build_where(date, business_hours, store, "items")
+    df = query(
+        path,
+        f"""
+        SELECT アカウント名, 部門, 名前, 開始日時 / 86400 * 86400 AS 開始日時, SUM(数量) AS 数量
+        FROM items{where}
+        GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        """,
+        params
+    )
+    df["開始日時"] = pd.to_datetime(df["開始日時"], unit="s")
+    return df
@@ -0,0 +1,259 @@
+import os
+import uuid
+import hashlib
+import urllib.parse
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+from poscope import bands, registry
+
+
+# The dataset is enabled only when this environment variable is set to the directory of the dataset
+DATASET_DIR_ENV = "POSCOPE_DATASET_DIR"
+
+# Directories such as `items/アカウント名=西食堂/年月=2024-05/`
+PARTITIONING = ds.partitioning(
+    pa.schema([("アカウント名", pa.string()), ("年月", pa.string())]),
+    flavor="hive"
+)
+
+# Data types fixed on writing, so that the files of different uploads have the same schema.
+# The nullable "string" keeps missing values (ex. items without "部門") missing instead of writing "nan"
+DTYPES = {
+    "customers": {"会計ID": "string", "金額": "int64", "客数": "int64"},
+    "items": {"会計ID": "string", "SKU": "string", "バーコード": "string", "名前": "string", "数量": "int64", "金額": "int64", "部門": "string"}
+}
+
+# Columns of the DataFrame of customers which are not payment methods
+CUSTOMER_COLUMNS = ["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数", "年月"] + bands.TIME_COLUMNS
+
+# Memory mapping lets the uncompressed Arrow IPC files be read without copying them into memory
+FILESYSTEM = pafs.LocalFileSystem(use_mmap=True)
+
+# File in the directory of the dataset holding its version, which changes at every write
+VERSION_FILE = "version"
+
+# Uploads and the watched folder may write at the same time, and `write_pos()` reads and rewrites whole partitions
+_write_lock = threading.Lock()
+
+
+def get_dataset_dir() -> str | None:
+    """
+    Return the directory of the dataset, or `None` if the dataset is disabled.
+    """
+    directory = os.environ.get(DATASET_DIR_ENV, "")
+    return directory if directory else None
+
+
+def open_dataset(directory: str, kind: str) -> ds.Dataset | None:
+    """
+    Open the dataset of customers (`kind="customers"`) or items (`kind="items"`), or return `None` if it does not exist.\\
+    The schemas of the files are unified since the columns of payment methods may differ between uploads.
+    """
+    path = os.path.join(directory, kind)
+    if not os.path.isdir(path):
+        return None
+    dataset = ds.dataset(path, format="ipc", partitioning=PARTITIONING, filesystem=FILESYSTEM)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if len(schemas) > 1:
+        schema = pa.unify_schemas(schemas + [dataset.schema])
+        dataset = ds.dataset(path, schema=schema, format="ipc", partitioning=PARTITIONING, filesystem=FILESYSTEM)
+    return dataset
+
+
+def get_months(date: tuple[datetime.date]) -> list[str]:
+    """
+    Return the year-months ("年月") from `date[0]` to `date[1]`.
+    """
+    return pd.period_range(date[0], date[1], freq="M").strftime("%Y-%m").tolist()
+
+
+def build_filter(date: tuple[datetime.date], store: str) -> ds.Expression:
+    """
+    Return the filter of the date range and the store.\\
+    Conditions on the partition keys prune the directories of other stores and months before any file is opened.
+    """
+    left_date = pd.Timestamp(date[0])
+    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
+    expr = ds.field("年月").isin(get_months(date))
+    if store != registry.ALL_STORES:
+        expr = expr & (ds.field("アカウント名") == store)
+    return expr & (ds.field("開始日時") >= pa.scalar(left_date)) & (ds.field("開始日時") < pa.scalar(right_date))
+
+
+def read_pos(directory: str, kind: str, date: tuple[datetime.date], store: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read the customers or items of the date range and the store.\\
+    `store=registry.ALL_STORES` reads all stores.
+    The partition column "年月" is dropped so that the DataFrame has the same columns as the output of `cleanup_pos()`.
+    `columns` may include those of `bands.TIME_COLUMNS` as long as it includes "開始日時".
+    """
+    # A write replaces the files of the partitions, so it is waited for in the same way as `read_all()`
+    with _write_lock:
+        dataset = open_dataset(directory, kind)
+        if dataset is None:
+            return pd.DataFrame()
+        if columns is None:
+            columns = [c for c in dataset.schema.names if c != "年月"]
+        table = dataset.to_table(columns=[c for c in columns if c not in bands.TIME_COLUMNS], filter=build_filter(date, store))
+    return to_pos(table, kind)
+
+
+def to_pos(table: pa.Table, kind: str) -> pd.DataFrame:
+    """
+    Convert the table read from the dataset into the DataFrame of customers or items.\\
+    The columns of `bands.TIME_COLUMNS` are not stored, so that the files do not depend on the bands,
+    and are derived again here in the same way as `cleanup_pos()`.
+    """
+    # The pandas metadata of the files is ignored, so the strings are read as objects whichever dtype they were written with.
+    # Missing strings are None in pyarrow, but NaN in the rest of the app (see `ingest.TEXT_COLUMNS`)
+    df = table.to_pandas(ignore_metadata=True).fillna(np.nan)
+    if kind == "customers":
+        fill_payments(df)
+    if "開始日時" in df.columns:
+        df = bands.add_time_columns(df)
+    return df
+
+
+def fill_payments(df: pd.DataFrame) -> None:
+    """
+    Fill the columns of payment methods missing in the files of some uploads with zero, in place.
+    """
+    pms = df.columns.difference(CUSTOMER_COLUMNS)
+    df[pms] = df[pms].fillna(0).astype("int64")
+
+
+def write_pos(directory: str, df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> str:
+    """
+    Write the output of `cleanup_pos()` into the datasets partitioned by "アカウント名" and "年月".\\
+    The rows already stored in the partitions to be written are read and merged,
+    and checkouts with the same "会計ID" are replaced by the new ones,
+    so an upload covering a part of a month does not remove the rest of the month.\\
+    Files are written in the uncompressed Arrow IPC format so that they can be memory-mapped on reading.
+    Writes are serialized within the process, and the new version of the dataset is returned.
+    """
+    with _write_lock:
+        write_partitions(directory, df_cus, df_itm)
+        return bump_version(directory)
+
+
+def write_partitions(directory: str, df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> None:
+    """
+    Merge the DataFrames into the partitions of the datasets. Must be called with the write lock held.
+    """
+    for kind, df in [("customers", df_cus), ("items", df_itm)]:
+        df = df.drop(columns=bands.TIME_COLUMNS, errors="ignore").astype(DTYPES[kind])
+        df["年月"] = df["開始日時"].dt.strftime("%Y-%m")
+        dataset = open_dataset(directory, kind)
+        if dataset is not None:
+            keys = df[["アカウント名", "年月"]].drop_duplicates()
+            expr = None
+            for store, month in keys.itertuples(index=False):
+                cond = (ds.field("アカウント名") == store) & (ds.field("年月") == month)
+                expr = cond if expr is None else expr | cond
+            df_old = dataset.to_table(filter=expr).to_pandas()
+            df_old = df_old[~df_old["会計ID"].isin(df["会計ID"])]
+            if not df_old.empty:
+                df = pd.concat([df_old, df], axis="index", ignore_index=True)
+        if kind == "customers":
+            fill_payments(df)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table,
+            os.path.join(directory, kind),
+            format="ipc",
+            partitioning=PARTITIONING,
+            existing_data_behavior="delete_matching",
+            basename_template="part-{i}.arrow",
+            filesystem=FILESYSTEM
+        )
+
+
+def get_date_range(directory: str) -> dict[str, tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Return the first and last "開始日時" of each store in the dataset of customers.\\
+    The column is scanned batch by batch, so the memory used does not grow with the history.
+    """
+    dataset = open_dataset(directory, "customers")
+    if dataset is None:
+        return {}
+    ranges = {}
+    for batch in dataset.to_batches(columns=["アカウント名", "開始日時"]):
+        df = batch.to_pandas().groupby("アカウント名")["開始日時"].agg(["min", "max"])
+        for store, (lo, hi) in df.iterrows():
+            if store in ranges:
+                lo, hi = min(lo, ranges[store][0]), max(hi, ranges[store][1])
+            ranges[store] = (lo, hi)
+    return ranges
+
+
+def read_all(directory: str, kind: str, store: str | None = None, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read all the customers or items in the dataset, or those of the store only,
+    in the same columns as the output of `cleanup_pos()`, or in `columns` only.\\
+    A write in progress is waited for, since it replaces the files of the partitions.
+    """
+    with _write_lock:
+        dataset = open_dataset(directory, kind)
+        if dataset is None:
+            return pd.DataFrame()
+        if columns is None:
+            columns = [c for c in dataset.schema.names if c != "年月"]
+        expr = None if store is None else ds.field("アカウント名") == store
+        table = dataset.to_table(columns=[c for c in columns if c not in bands.TIME_COLUMNS], filter=expr)
+    return to_pos(table, kind)
+
+
+def get_store_stamps(directory: str) -> dict[str, str]:
+    """
+    Return the stamp of the partitions of each store in the dataset, which changes only when the files of the store are written.\\
+    The stamp is the hash of the paths, sizes, and modification times of the files, so the directories are listed without opening any file.
+    """
+    stamps = {}
+    for kind in ["customers", "items"]:
+        path = os.path.join(directory, kind)
+        if not os.path.isdir(path):
+            continue
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if not entry.is_dir() or not entry.name.startswith("アカウント名="):
+                continue
+            # Partition values are URI-encoded in the names of the directories
+            store = urllib.parse.unquote(entry.name.split("=", 1)[1])
+            h = hashlib.sha1(stamps.get(store, "").encode("utf-8"))
+            for root, dirs, files in os.walk(entry.path):
+                dirs.sort()
+                for name in sorted(files):
+                    stat = os.stat(os.path.join(root, name))
+                    h.update(f"{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+            stamps[store] = h.hexdigest()
+    return stamps
+
+
+def get_version(directory: str) -> str:
+    """
+    Return the version of the contents of the dataset, or "" if it has never been written.
+    """
+    try:
+        with open(os.path.join(directory, VERSION_FILE), encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_version(directory: str) -> str:
+    """
+    Change the version of the dataset and return it, so that the sessions reading it load the new contents.\\
+    The file is replaced atomically, so a reader never sees a partially written version.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, VERSION_FILE)
+    version = uuid.uuid4().hex
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(path + ".tmp", path)
+    return version
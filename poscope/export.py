@@ -0,0 +1,58 @@
+import io
+import pandas as pd
+
+
+# Label, file extension, and MIME type of each format
+FORMATS = {
+    "csv": ("CSV", ".csv", "text/csv"),
+    "parquet": ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+    "xlsx": ("Excel", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+}
+
+
+def to_csv_shift_jis(df: pd.DataFrame, index_flag: bool, chunksize: int = 50_000) -> bytes:
+    """
+    Convert the DataFrame to a CSV format encoded in Shift-JIS.\\
+    Rows are written `chunksize` at a time through a text wrapper that encodes them into the buffer,
+    so the whole CSV is never held as a Python string in addition to the encoded bytes.\\
+    Raise `UnicodeEncodeError` if the DataFrame contains a character which Shift-JIS cannot encode.
+    """
+    buffer = io.BytesIO()
+    wrapper = io.TextIOWrapper(buffer, encoding="shift-jis", newline="")
+    df.to_csv(wrapper, index=index_flag, chunksize=chunksize)
+    wrapper.flush()
+    # Detach the wrapper so that closing it does not close the buffer
+    wrapper.detach()
+    return buffer.getvalue()
+
+
+def to_parquet(df: pd.DataFrame, index_flag: bool) -> bytes:
+    """
+    Convert the DataFrame to a Parquet file.\\
+    Column names are converted to strings since Parquet does not support other types (ex. dates).
+    """
+    buffer = io.BytesIO()
+    df.rename(columns=str).to_parquet(buffer, index=index_flag, engine="pyarrow")
+    return buffer.getvalue()
+
+
+def to_excel(df: pd.DataFrame, index_flag: bool) -> bytes:
+    """
+    Convert the DataFrame to an Excel file.
+    """
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=index_flag, engine="openpyxl")
+    return buffer.getvalue()
+
+
+def export_dataframe(df: pd.DataFrame, fmt: str, index_flag: bool) -> bytes:
+    """
+    Convert the DataFrame to `fmt` ("csv", "parquet", or "xlsx").
+    """
+    if fmt == "csv":
+        return to_csv_shift_jis(df, index_flag)
+    elif fmt == "parquet":
+        return to_parquet(df, index_flag)
+    elif fmt == "xlsx":
+        return to_excel(df, index_flag)
+    raise ValueError(f"Unsupported format: {fmt}")
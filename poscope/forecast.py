@@ -0,0 +1,524 @@
+"""
+Data processing of the forecast page: the daily number of customers at lunch, the features from the calendar
+and syllabus data, and the linear regression model.\\
+This module does not depend on Streamlit, so it can be imported quickly and driven from batch jobs.
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+
+from poscope import bands
+from poscope.instrument import instrument
+from poscope.jobs import no_progress
+
+
+#-----------------------------------------POS data-----------------------------------------
+
+def filter_lunch(df_cus: pd.DataFrame, store: str) -> pd.DataFrame:
+    """
+    Return the customers of the store at lunch (`bands.lunch_hours()`, 11:00-14:00 by default).
+    """
+    # Filter by store
+    df_cus = df_cus[df_cus["アカウント名"] == store]
+    # Filter by business hours
+    return bands.filter_business_hours(df_cus, bands.lunch_hours()).reset_index(drop=True)
+
+
+def customers_per_day(df_cus: pd.DataFrame) -> pd.Series:
+    """
+    Return the number of customers per day.\\
+    `df_cus` may be the filtered customers or the totals per day aggregated in the local database.
+    """
+    return df_cus.resample("1D", on="開始日時")["客数"].sum()
+
+
+#-----------------------------------------Calendar data-----------------------------------------
+
+def get_nweek(df_cal: pd.DataFrame) -> list:
+    """
+    Calculate the number of weeks since the first Monday of the term and return it as a list.
+    """
+    r, _ = df_cal.shape
+    current_term = ""
+    first_mon_date = None
+    nweeks = []
+    daynames = ["MON", "TUE", "WED", "THU", "FRI"]
+    for i in range(r):
+        term = df_cal.loc[i, "term"]
+        class_info = df_cal.loc[i, "class"]
+        _date = df_cal.loc[i, "date"]
+        dayname = _date.day_name()[:3].upper()
+        if term in ["SPR", "SMR", "AUT", "WTR", "SMRINT", "WTRINT1to3", "WTRINT4"] and class_info != "NoClass":
+            if current_term != term:
+                # not change first_mon_date when SPR->SMR or AUT->WTR
+                if term == "SMR" or term == "WTR":
+                    current_term = term
+                else:
+                    current_term = term
+                    first_mon_date = _date - pd.Timedelta(days=daynames.index(dayname))
+            nweeks.append((_date - first_mon_date).days // 7 + 1)
+        else:
+            nweeks.append(float("nan"))
+    return nweeks
+
+
+def get_first_week_dummy(df_cal: pd.DataFrame) -> list:
+    """
+    Get first week dummy variable and return it as a list.
+    """
+    r, _ = df_cal.shape
+    first_week = []
+    for i in range(r):
+        nweek = df_cal.loc[i, "nweek"]
+        if nweek == 1:
+            first_week.append(1)
+        else:
+            first_week.append(0)
+    return first_week
+
+
+def get_last_week_dummy(df_cal: pd.DataFrame) -> list:
+    """
+    Get last week dummy variable and return it as a list.\\
+    Note that this function only works when the maximum number of week is 15.\\
+    To cope with exceptions, more complicated logic is needed (future implementation).
+    """
+    r, _ = df_cal.shape
+    last_week = []
+    for i in range(r):
+        nweek = df_cal.loc[i, "nweek"]
+        if nweek == 15:
+            last_week.append(1)
+        else:
+            last_week.append(0)
+    return last_week
+
+
+# Columns of the calendar data whose tokens become the events of the model
+EVENT_SOURCES = ["info", "term", "class"]
+
+
+def tokenize_calendar(df_cal: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the multi-hot block of the tokens of "info" (comma-separated, ex. "OnlineExam,TOEFL"), "term", and "class"
+    as sparse columns named like "info=IkkyoFes", "term=WTRINT1to3", and "class=MON", in the index of `df_cal`.\\
+    All the tokens are collected and numbered in one pass, and the block is built directly as a sparse matrix,
+    so its size grows with the number of tokens rather than with the vocabulary.
+    """
+    from scipy import sparse
+    tokens = pd.concat([
+        # The columns are all NaN (float) when a calendar has no value in them
+        df_cal["info"].astype("string").str.split(",").explode().str.strip().radd("info="),
+        df_cal["term"].astype("string").radd("term="),
+        df_cal["class"].astype("string").radd("class=")
+    ]).dropna()
+    tokens = tokens[~tokens.str.endswith("=")]
+    rows = df_cal.index.get_indexer(tokens.index)
+    codes, vocabulary = pd.factorize(tokens, sort=True)
+    matrix = sparse.csr_matrix((np.ones(len(codes)), (rows, codes)), shape=(len(df_cal), len(vocabulary)))
+    # A token repeated in the same cell counts once
+    matrix.data = np.minimum(matrix.data, 1.0)
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=df_cal.index, columns=vocabulary.tolist())
+
+
+def get_event_columns(df: pd.DataFrame) -> list[str]:
+    """
+    Return the columns of the multi-hot block of the events in the DataFrame.
+    """
+    return [c for c in df.columns if isinstance(c, str) and "=" in c and c.split("=")[0] in EVENT_SOURCES]
+
+
+@instrument
+def process_calendar(df_cal: pd.DataFrame):
+    """
+    Process calendar data.\\
+    The tokens of the calendar are added as the multi-hot block of the events,
+    except for holidays and replaced class days, which are the dummies "holiday" and "replaced" edited by the scenarios.
+    """
+    df_cal["nweek"] = get_nweek(df_cal)
+    events = tokenize_calendar(df_cal)
+    for column, token in [("holiday", "info=Holiday"), ("replaced", "info=Replaced")]:
+        df_cal[column] = events.pop(token).sparse.to_dense().astype("int") if token in events else 0
+    df_cal["first_week"] = get_first_week_dummy(df_cal)
+    df_cal["last_week"] = get_last_week_dummy(df_cal)
+    return pd.concat([df_cal, events], axis="columns")
+
+
+#-----------------------------------------Lag features-----------------------------------------
+
+# Features from the calendar and syllabus data, known in advance for every day
+CALENDAR_FEATURES = ["syllabus", "nweek", "holiday", "replaced", "first_week", "last_week"]
+# Features from the number of customers of the previous class days, predicted recursively over the prediction range
+LAG_FEATURES = ["lag_week", "term_mean"]
+# Features of the model, followed by the multi-hot block of the events in the design matrix
+FEATURES = CALENDAR_FEATURES + LAG_FEATURES
+
+
+def get_term_labels(df: pd.DataFrame) -> pd.Series:
+    """
+    Return the term of each day, such as "2025AUT", which is also the column of the syllabus data.
+    """
+    return df["academic_year"].astype("int").astype("str") + df["term"]
+
+
+def add_lag_features(yX: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return a copy of the class days of `yX` (in date order, with "学期") with the lag features.\\
+    "lag_week" is the logarithm of the number of customers of the previous class day of the same class weekday ("class"),
+    so a replaced class day follows the weekday of its classes, and the weeks of vacations are skipped.
+    "term_mean" is the logarithm of the mean number of customers of the previous class days of the term.
+    Only class days are shifted over, so the days of NoClass and vacations never appear in the lags.\\
+    A missing lag is filled with the other one, and both are missing only on the first class day of the data.
+    The features are computed for all days at once by shifting and cumulative sums within the groups.
+    """
+    y = yX["客数"].astype("float64")
+    lag_week = np.log(y).groupby(yX["class"]).shift(1)
+    by_term = y.groupby(yX["学期"])
+    n_prev = by_term.cumcount()
+    term_mean = np.log((by_term.cumsum() - y) / n_prev.where(n_prev > 0))
+    return yX.assign(lag_week=lag_week.fillna(term_mean), term_mean=term_mean.fillna(lag_week))
+
+
+def predict_recursive(result: dict, X_pred: pd.DataFrame, yX_tr: pd.DataFrame) -> np.ndarray:
+    """
+    Predict the class days of `X_pred` one after another with the coefficients of `result`,
+    using the predictions as the number of customers of the days before in the lag features (multi-step recursive forecast).\\
+    The lag features start from the class days of `yX_tr`, and are filled in the same way as `add_lag_features()`,
+    or with the last day when there is no previous day of the weekday nor of the term.
+    The calendar features and the events are multiplied with their coefficients for all days at once,
+    and only the lag features are updated day by day.
+    """
+    if X_pred.empty:
+        return np.array([])
+    coef = np.asarray(result["coef"])
+    # Everything but the lag features, whose columns are zeroed in the design matrix
+    base = predict_linear(result, design_matrix(X_pred.assign(**{column: 0.0 for column in LAG_FEATURES})), log=True)
+    coef_week, coef_term = coef[[FEATURES.index(column) for column in LAG_FEATURES]]
+    log_y = np.log(yX_tr["客数"].astype("float64"))
+    # The last day of each weekday, and the sum and count of the days of each term
+    last_by_class = log_y.groupby(yX_tr["class"]).last().to_dict()
+    term_sums = {term: [total, count] for term, (total, count) in yX_tr.groupby("学期")["客数"].agg(["sum", "count"]).iterrows()}
+    last = log_y.iloc[-1]
+    log_pred = np.empty(len(X_pred))
+    for i, (cls, term) in enumerate(zip(X_pred["class"], X_pred["学期"])):
+        lag_week = last_by_class.get(cls, np.nan)
+        total, count = term_sums.get(term, [0.0, 0])
+        term_mean = np.log(total / count) if count > 0 else np.nan
+        if np.isnan(lag_week):
+            lag_week = term_mean if not np.isnan(term_mean) else last
+        if np.isnan(term_mean):
+            term_mean = lag_week
+        log_pred[i] = base[i] + coef_week * lag_week + coef_term * term_mean
+        last_by_class[cls] = last = log_pred[i]
+        term_sums[term] = [total + np.exp(log_pred[i]), count + 1]
+    return np.exp(log_pred)
+
+
+#-----------------------------------------Model-----------------------------------------
+
+
+@instrument
+def get_syllabus(df_cal: pd.DataFrame, df_syl: pd.DataFrame) -> list:
+    """
+    Return the number of students taking the classes of periods 1 to 3 on each day of the calendar,
+    or NaN for the days without classes of the main terms or without syllabus data.
+    """
+    r, _ = df_cal.shape
+    jp_daynames = ["月", "火", "水", "木", "金"]
+    en_daynames = ["MON", "TUE", "WED", "THU", "FRI"]
+    main_terms = ["SPR", "SMR", "AUT", "WTR"]
+    syllabus = []
+    for i in range(r):
+        academic_year = df_cal.loc[i, "academic_year"]
+        term = df_cal.loc[i, "term"]
+        class_dayname = df_cal.loc[i, "class"]
+        if term in main_terms and class_dayname in en_daynames:
+            jp_dayname = jp_daynames[en_daynames.index(class_dayname)]
+            try:
+                syl = df_syl.loc[(jp_dayname, [1, 2, 3]), str(academic_year)+term].sum()
+            except KeyError:
+                syl = float("nan")
+        else:
+            syl = float("nan")
+        syllabus.append(syl)
+    return syllabus
+
+
+def concatenate_data(df_cus: pd.DataFrame, df_cal: pd.DataFrame, df_syl: pd.DataFrame) -> pd.DataFrame:
+    """
+    Concatenate customer data, calendar data, and syllabus data into a single DataFrame.\\
+    If the customer data is empty, return an empty DataFrame.
+    """
+    if df_cus.empty:
+        return pd.DataFrame()
+    # Assign syllabus data to the calendar data
+    df_cal["syllabus"] = get_syllabus(df_cal, df_syl)
+    # Gather all DataFrames
+    df_main = pd.merge(
+        df_cus, df_cal, how="outer", 
+        left_index=True, right_on="date"
+    ).set_index("date")
+    return df_main
+
+
+def split_data(df_main: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split the DataFrame into training and prediction sets.\\
+    The lag features are added to the training set, and left empty in the prediction set,
+    where they depend on the predictions of the days before (see `predict_recursive()`).
+    Both sets have the columns of the events, and "class" and "学期" (ex. "2025AUT") as the keys of the lag features.
+    """
+    yX_tr = df_main[
+        (df_main["客数"].notna()) & 
+        (df_main["客数"] > 0) & 
+        (df_main["class"].isin(["MON", "TUE", "WED", "THU", "FRI"])) & 
+        (df_main["syllabus"].notna())
+    ]
+    X_pred = df_main[
+        (df_main.index > yX_tr.index.max()) & 
+        (df_main["class"].isin(["MON", "TUE", "WED", "THU", "FRI"])) & 
+        (df_main["syllabus"].notna())
+    ]
+    yX_tr = add_lag_features(yX_tr.assign(学期=get_term_labels(yX_tr)))
+    events = get_event_columns(df_main)
+    X_pred = X_pred[CALENDAR_FEATURES + events + ["class"]].assign(**{column: np.nan for column in LAG_FEATURES}, 学期=get_term_labels(X_pred))
+    return yX_tr, X_pred[FEATURES + events + ["class", "学期"]]
+
+
+def get_train_data(yX: pd.DataFrame) -> tuple:
+    """
+    Split the training data into training and validation sets.
+    """
+    # sklearn takes long to import, so it is imported only when a model is trained
+    from sklearn.model_selection import train_test_split
+    # The first class days have no previous days for the lag features
+    yX = yX.dropna(subset=FEATURES)
+    y = yX["客数"]
+    X = yX[FEATURES + get_event_columns(yX)]
+    X_tr, X_va, y_tr, y_va = train_test_split(X, y, test_size=0.2, shuffle=False)
+    return X_tr, X_va, y_tr, y_va
+
+
+def design_matrix(X: pd.DataFrame):
+    """
+    Return the design matrix of the days of `X` in CSR format: `FEATURES` followed by the multi-hot block of the events.\\
+    The block stays sparse, so the cost of fitting and predicting grows with the events on the days rather than with the vocabulary.
+    """
+    from scipy import sparse
+    blocks = [sparse.csr_matrix(X[FEATURES].to_numpy(dtype="float64"))]
+    events = get_event_columns(X)
+    if events:
+        blocks.append(X[events].sparse.to_coo().tocsr())
+    return sparse.hstack(blocks, format="csr")
+
+
+# Penalty of the ridge regression on the coefficients except the intercept, shared by the batch and online models.
+# Events always seen together (ex. with a holiday) or on a single day would make the least squares ill-posed,
+# and the penalty shares the effect between them instead of splitting it arbitrarily.
+# The features are not standardized, so that the online model can keep its statistics without the scales of the features:
+# the penalty hardly moves the features with large values (ex. "syllabus") and mainly acts on the 0/1 columns of the events
+RIDGE = 1.0
+
+
+@instrument
+def train_model(y, X):
+    """
+    Train a ridge regression model using the training data.\\
+    `X` may be a sparse matrix, which is solved without being densified.
+    """
+    from sklearn.linear_model import Ridge
+    # The sparse matrix is solved iteratively, and the tolerance is tight enough to give the solution of `solve_ridge()`
+    model = Ridge(alpha=RIDGE, tol=1e-10)
+    model.fit(X, y)
+    return model
+
+
+def fit_and_predict(yX_tr: pd.DataFrame, X_pred: pd.DataFrame, progress=no_progress) -> dict:
+    """
+    Train the model on the logarithm of the number of customers and return the predictions and the evaluation metrics.\\
+    "y_pred" holds the predictions of the training and validation sets in the order of `yX_tr` (NaN for the days without the lag features),
+    and "y_pred_future" the recursive predictions of `X_pred`.
+    "coef" and "intercept" are kept for the scenarios, which predict again without the model.\\
+    This function runs as a background job of the forecast page.
+    """
+    # sklearn takes long to import, so it is imported only when a model is trained
+    from sklearn.metrics import root_mean_squared_error, mean_absolute_percentage_error
+    progress(0.0, "学習データと検証データに分割しています...")
+    # Split data into training and validation sets
+    x_tr, x_va, y_tr, y_va = get_train_data(yX_tr)
+    progress(0.2, "モデルを学習しています...")
+    model = train_model(np.log(y_tr), design_matrix(x_tr))
+    progress(0.7, "予測しています...")
+    y_tr_pred = np.exp(model.predict(design_matrix(x_tr)))
+    y_va_pred = np.exp(model.predict(design_matrix(x_va)))
+    # Days without the lag features are not predicted
+    y_pred = pd.Series(np.nan, index=yX_tr.index)
+    y_pred[x_tr.index] = y_tr_pred
+    y_pred[x_va.index] = y_va_pred
+    result = {"coef": model.coef_.tolist(), "intercept": float(model.intercept_)}
+    progress(0.9, "評価指標を計算しています...")
+    result.update({
+        "y_pred": y_pred.tolist(),
+        "y_pred_future": predict_recursive(result, X_pred, yX_tr).tolist(),
+        "tr_rmse": root_mean_squared_error(y_tr, y_tr_pred),
+        "va_rmse": root_mean_squared_error(y_va, y_va_pred),
+        "tr_mape": mean_absolute_percentage_error(y_tr, y_tr_pred),
+        "va_mape": mean_absolute_percentage_error(y_va, y_va_pred)
+    })
+    return result
+
+
+#-----------------------------------------Scenario-----------------------------------------
+
+def apply_scenario(X_pred: pd.DataFrame, syllabus_scale: dict[str, float], holiday_dates: list, replaced_dates: list) -> pd.DataFrame:
+    """
+    Return a copy of the prediction set `X_pred` edited by a scenario.\\
+    The syllabus feature of each term ("学期") is multiplied by `syllabus_scale[term]` (terms not in it are kept),
+    and the holiday and replaced dummies of the dates in `holiday_dates` and `replaced_dates` are switched.
+    The edits are made on whole columns at once, and the lag features follow them through `predict_recursive()`.
+    """
+    X_pred = X_pred.copy()
+    X_pred["syllabus"] *= X_pred["学期"].map(syllabus_scale).fillna(1.0)
+    for column, toggled in [("holiday", holiday_dates), ("replaced", replaced_dates)]:
+        mask = X_pred.index.isin(pd.DatetimeIndex(toggled))
+        X_pred.loc[mask, column] = 1 - X_pred.loc[mask, column]
+    return X_pred
+
+
+def predict_linear(result: dict, X, log: bool = False) -> np.ndarray:
+    """
+    Predict the number of customers (or its logarithm with `log=True`) from the design matrix (dense or sparse)
+    with the coefficients of the model trained by `fit_and_predict()`.\\
+    The model is linear in the logarithm of the number of customers, so a prediction is a matrix-vector product.
+    """
+    log_y = X @ np.asarray(result["coef"]) + result["intercept"]
+    return log_y if log else np.exp(log_y)
+
+
+#-----------------------------------------Online model-----------------------------------------
+
+# Days folded into the online model before its one-step-ahead errors are counted
+MIN_ONLINE_DAYS = 20
+
+
+def init_stats(columns: list[str]) -> dict:
+    """
+    Return the empty sufficient statistics of the online model with the columns of the design matrix (`FEATURES` and the events).\\
+    "xtx" and "xty" are XᵀWX and XᵀWy of the design matrix X with a column of ones for the intercept in front,
+    the logarithm of the number of customers y, and the weights W of the days.
+    "se_new" and "ape_new" accumulate the errors of the days predicted before they were folded in,
+    and "digest" identifies the days folded in (see `get_digest()`).
+    """
+    k = len(columns) + 1
+    return {
+        "columns": columns, "xtx": np.zeros((k, k)), "xty": np.zeros(k), "n_days": 0, "last_date": None,
+        "n_new": 0, "se_new": 0.0, "ape_new": 0.0, "digest": None
+    }
+
+
+def get_digest(yX: pd.DataFrame) -> str:
+    """
+    Return the hash of the days, the numbers of customers, and the design matrix of `yX`,
+    which tells whether the days folded into the statistics are still those of the POS, calendar, and syllabus data.
+    """
+    yX = yX.sort_index()
+    X = design_matrix(yX)
+    h = hashlib.sha1(pd.util.hash_pandas_object(yX["客数"], index=True).to_numpy().tobytes())
+    for array in [X.data, X.indices, X.indptr]:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+def solve_stats(stats: dict) -> dict:
+    """
+    Return the coefficients and the intercept of the ridge regression of the statistics,
+    in the same form as the result of `fit_and_predict()`.
+    """
+    beta = solve_ridge(stats)
+    return {"coef": beta[1:].tolist(), "intercept": float(beta[0])}
+
+
+def solve_ridge(stats: dict) -> np.ndarray:
+    """
+    Return the intercept followed by the coefficients minimizing the weighted squared errors plus `RIDGE` times the squared coefficients,
+    the same problem as `train_model()` solves for the batch model.\\
+    The penalty keeps XᵀWX + `RIDGE` I regular even when features are constant over the days folded in (ex. no holiday yet).
+    """
+    penalty = np.full(len(stats["xty"]), RIDGE)
+    # The intercept is not penalized
+    penalty[0] = 0.0
+    return np.linalg.lstsq(stats["xtx"] + np.diag(penalty), stats["xty"], rcond=None)[0]
+
+
+def update_stats(stats: dict, yX: pd.DataFrame, half_life: float | None = None) -> dict:
+    """
+    Return a copy of the statistics with the days of `yX` after the last day already folded in.\\
+    The cost is O(k p²) for k new days and p columns, and the days folded in before are never revisited.
+    With `half_life` (days), the weight of each day halves every `half_life` days of the calendar (exponential forgetting),
+    which is applied to the statistics as a whole by the time elapsed since the last day folded in.\\
+    Once `MIN_ONLINE_DAYS` days have been folded in, the new days are predicted before they are folded in,
+    and their errors are accumulated as the one-step-ahead errors of the model.
+    """
+    # The first class days have no previous days for the lag features
+    yX = yX.sort_index().dropna(subset=FEATURES)
+    if stats["last_date"] is not None:
+        yX = yX[yX.index > stats["last_date"]]
+    if yX.empty:
+        return stats
+    from scipy import sparse
+    stats = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in stats.items()}
+    X = sparse.hstack([np.ones((len(yX), 1)), design_matrix(yX)], format="csr")
+    y = yX["客数"].to_numpy(dtype="float64")
+    if stats["n_days"] >= MIN_ONLINE_DAYS:
+        y_hat = np.exp(X @ solve_ridge(stats))
+        stats["n_new"] += len(y)
+        stats["se_new"] += float(np.sum((y - y_hat) ** 2))
+        stats["ape_new"] += float(np.sum(np.abs(y - y_hat) / y))
+    last_date = yX.index.max()
+    if half_life is None:
+        weights, decay = np.ones(len(yX)), 1.0
+    else:
+        weights = 0.5 ** ((last_date - yX.index).days.to_numpy() / half_life)
+        decay = 0.5 ** ((last_date - stats["last_date"]).days / half_life) if stats["last_date"] is not None else 1.0
+    stats["xtx"] = decay * stats["xtx"] + (X.T @ sparse.diags(weights) @ X).toarray()
+    stats["xty"] = decay * stats["xty"] + X.T @ (weights * np.log(y))
+    stats["n_days"] += len(yX)
+    stats["last_date"] = last_date
+    return stats
+
+
+def fit_online(stats: dict | None, yX_tr: pd.DataFrame, X_pred: pd.DataFrame, half_life: float | None = None) -> tuple[dict, dict]:
+    """
+    Fold the new days of `yX_tr` into the statistics of the online model,
+    and return the updated statistics and the result in the same form as `fit_and_predict()`.\\
+    The statistics start from scratch when they are `None`, have other columns (ex. new events in the calendar data),
+    or the days folded in differ from those of `yX_tr` or their features (ex. corrected POS, calendar, or syllabus data, or an earlier period uploaded),
+    since only the days after the last day folded in are added.
+    "tr_rmse" and "tr_mape" are the errors on `yX_tr` with the current coefficients,
+    and "va_rmse" and "va_mape" the one-step-ahead errors of the days added since the first fit (`None` until there are any).
+    """
+    columns = FEATURES + get_event_columns(yX_tr)
+    # The days which can be folded in, as in `update_stats()`
+    yX_folded = yX_tr.dropna(subset=FEATURES)
+    if (
+        stats is None or stats["columns"] != columns
+        or stats["last_date"] is not None and get_digest(yX_folded[yX_folded.index <= stats["last_date"]]) != stats["digest"]
+    ):
+        stats = init_stats(columns)
+    stats = update_stats(stats, yX_tr, half_life)
+    if stats["last_date"] is not None:
+        stats = {**stats, "digest": get_digest(yX_folded[yX_folded.index <= stats["last_date"]])}
+    result = solve_stats(stats)
+    y_tr = yX_tr["客数"].to_numpy(dtype="float64")
+    # NaN for the days without the lag features, which are left out of the errors
+    y_tr_pred = predict_linear(result, design_matrix(yX_tr))
+    n_new = stats["n_new"]
+    result.update({
+        "y_pred": y_tr_pred.tolist(),
+        "y_pred_future": predict_recursive(result, X_pred, yX_tr).tolist(),
+        "tr_rmse": float(np.sqrt(np.nanmean((y_tr - y_tr_pred) ** 2))),
+        "va_rmse": float(np.sqrt(stats["se_new"] / n_new)) if n_new > 0 else None,
+        "tr_mape": float(np.nanmean(np.abs(y_tr - y_tr_pred) / y_tr)),
+        "va_mape": stats["ape_new"] / n_new if n_new > 0 else None
+    })
+    return stats, result
@@ -0,0 +1,247 @@
+"""
+Hierarchical forecasts of the quantities of the items sold at lunch:
+all stores → store ("アカウント名") → department ("部門") → item ("名前").\\
+Every series of the hierarchy is forecast in one batch by linear models sharing the features of the calendar,
+and the forecasts are reconciled with the sparse summing matrix so that each series adds up to the sum of its children.
+The reconciliation solves a system of the size of the upper levels only, so hundreds of items stay tractable.\\
+This module does not depend on Streamlit, so it can be imported quickly and driven from batch jobs.
+"""
+import numpy as np
+import pandas as pd
+
+from poscope import bands, forecast, registry
+from poscope.instrument import instrument
+from poscope.jobs import no_progress
+
+
+#-----------------------------------------POS data-----------------------------------------
+
+# Levels of the hierarchy, from the top
+LEVELS = ["全店舗", "店舗", "部門", "商品"]
+
+# Columns of the keys of the bottom series
+KEYS = ["アカウント名", "部門", "名前"]
+
+# Items sold on fewer days are gathered into one item of their department,
+# which keeps the number of series and the noise of the bottom level down without changing the upper levels
+MIN_ITEM_DAYS = 5
+
+# Item gathering the items sold on fewer days than `MIN_ITEM_DAYS` (and those without a name), and the department of the items without one
+OTHER_ITEMS = "（その他）"
+NO_DEPARTMENT = "（部門なし）"
+
+
+def filter_lunch(df_itm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the items of all stores sold at lunch (`bands.lunch_hours()`).
+    """
+    return bands.filter_business_hours(df_itm, bands.lunch_hours())
+
+
+def items_per_day(df_itm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the quantity of each item per store, department, and day in the columns of `KEYS`, "日付", and "数量".\\
+    `df_itm` may be the filtered items or the totals per day aggregated in the local database.
+    """
+    if df_itm.empty:
+        return pd.DataFrame(columns=KEYS + ["日付", "数量"])
+    df = pd.DataFrame({
+        "アカウント名": df_itm["アカウント名"].astype("str"),
+        "部門": df_itm["部門"].fillna(NO_DEPARTMENT).astype("str"),
+        "名前": df_itm["名前"].fillna(OTHER_ITEMS).astype("str"),
+        "日付": df_itm["開始日時"].dt.normalize(),
+        "数量": df_itm["数量"]
+    })
+    return df.groupby(KEYS + ["日付"], as_index=False)["数量"].sum()
+
+
+def gather_rare_items(df_daily: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the output of `items_per_day()` with the items sold on fewer days than `MIN_ITEM_DAYS` gathered into `OTHER_ITEMS`.
+    """
+    days = df_daily.groupby(KEYS)["日付"].transform("size")
+    df_daily = df_daily.assign(名前=df_daily["名前"].where(days >= MIN_ITEM_DAYS, OTHER_ITEMS))
+    return df_daily.groupby(KEYS + ["日付"], as_index=False)["数量"].sum()
+
+
+#-----------------------------------------Hierarchy-----------------------------------------
+
+@instrument
+def build_hierarchy(df_daily: pd.DataFrame) -> tuple:
+    """
+    Return the bottom series (days × items), the nodes of the hierarchy, and its summing matrix.\\
+    The nodes are listed from the top, all stores first and the items last, in the columns "階層", "店舗", "部門", and "商品".
+    The summing matrix `S` (nodes × items, CSR) has one nonzero per level in each column,
+    and `S @ y` adds the quantities `y` of the items up to all the nodes.
+    """
+    from scipy import sparse
+    Y = gather_rare_items(df_daily).pivot_table(index="日付", columns=KEYS, values="数量", aggfunc="sum", fill_value=0)
+    # Stores in the order of the registry
+    order = {store: i for i, store in enumerate(registry.sort_stores(Y.columns.get_level_values(0)))}
+    Y = Y[sorted(Y.columns, key=lambda key: (order[key[0]], key[1], key[2]))]
+    bottom = Y.columns.to_frame(index=False)
+    n = len(bottom)
+    store_codes, stores = pd.factorize(bottom["アカウント名"])
+    department_codes, departments = pd.factorize(pd.MultiIndex.from_frame(bottom[["アカウント名", "部門"]]))
+    nodes = pd.concat([
+        pd.DataFrame({"階層": LEVELS[0], "店舗": [registry.ALL_STORES], "部門": "", "商品": ""}),
+        pd.DataFrame({"階層": LEVELS[1], "店舗": stores, "部門": "", "商品": ""}),
+        pd.DataFrame({"階層": LEVELS[2], "店舗": departments.get_level_values(0), "部門": departments.get_level_values(1), "商品": ""}),
+        pd.DataFrame({"階層": LEVELS[3], "店舗": bottom["アカウント名"], "部門": bottom["部門"], "商品": bottom["名前"]})
+    ], axis="index", ignore_index=True)
+    m = 1 + len(stores) + len(departments)
+    rows = np.concatenate([np.zeros(n, dtype="int64"), 1 + store_codes, 1 + len(stores) + department_codes, m + np.arange(n)])
+    S = sparse.csr_matrix((np.ones(4 * n), (rows, np.tile(np.arange(n), 4))), shape=(m + n, n))
+    return Y, nodes, S
+
+
+#-----------------------------------------Base forecasts-----------------------------------------
+
+def build_features(df_cal: pd.DataFrame, syllabi: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Return the features of the class days shared by all the series, indexed by date:
+    the calendar features, the syllabus data of each campus (ex. "syllabus_west"), and the multi-hot block of the events.\\
+    `df_cal` is the output of `forecast.process_calendar()`, such as the calendar dimension of `ingest.build_calendar_dim()` with its index reset.
+    The days without the syllabus data of a campus are left out, since the series of all stores are forecast together.
+    """
+    calendar = [c for c in forecast.CALENDAR_FEATURES if c != "syllabus"]
+    X = df_cal[["date"] + calendar].copy()
+    for campus, df_syl in syllabi.items():
+        X[f"syllabus_{campus}"] = forecast.get_syllabus(df_cal, df_syl)
+    X = pd.concat([X, df_cal[forecast.get_event_columns(df_cal)]], axis="columns")
+    X = X[df_cal["class"].isin(["MON", "TUE", "WED", "THU", "FRI"])].dropna(subset=[f"syllabus_{c}" for c in syllabi])
+    return X.set_index("date")
+
+
+def design_matrix(X: pd.DataFrame):
+    """
+    Return the design matrix of the days of `X` in CSR format: the intercept, the dense features, and the multi-hot block of the events.
+    """
+    from scipy import sparse
+    events = forecast.get_event_columns(X)
+    dense = X.drop(columns=events).to_numpy(dtype="float64")
+    blocks = [sparse.csr_matrix(np.hstack([np.ones((len(X), 1)), dense]))]
+    if events:
+        blocks.append(X[events].sparse.to_coo().tocsr())
+    return sparse.hstack(blocks, format="csr")
+
+
+# Penalty of the ridge regression of the base forecasts on the coefficients except the intercept.
+# An event seen on a single day gets about half of the residual of that day, and events always seen together share it
+RIDGE = 1.0
+
+
+@instrument
+def fit_base(D, Y: np.ndarray) -> np.ndarray:
+    """
+    Fit the ridge regressions of the logarithms of the quantities `Y` (days × nodes) on the design matrix `D`
+    and return their coefficients (features × nodes).\\
+    All the series share the design matrix, which has one row per day and a few dozen columns,
+    so `DᵀD + RIDGE I` is factorized once in sparse form and every series is solved with the same factors.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import splu
+    penalty = np.full(D.shape[1], RIDGE)
+    # The intercept is not penalized
+    penalty[0] = 0.0
+    lu = splu((D.T @ D + sparse.diags(penalty)).tocsc())
+    return lu.solve(np.asarray(D.T @ np.log1p(Y)))
+
+
+#-----------------------------------------Reconciliation-----------------------------------------
+
+# Methods of reconciliation shown in the forecast page, and the keys of their forecasts in the result
+METHODS = {"MinT": "mint", "積み上げ": "bottom_up", "調整なし": "base"}
+
+# Added to the variances of the errors, so that the series never sold still have a weight
+VARIANCE_FLOOR = 1e-6
+
+
+def reconcile_bottom_up(base: np.ndarray, S) -> np.ndarray:
+    """
+    Return the forecasts (days × nodes) whose upper levels are the sums of the forecasts of the items.
+    """
+    n = S.shape[1]
+    return np.asarray((S @ base[:, -n:].T).T)
+
+
+def reconcile_mint(base: np.ndarray, S, variances: np.ndarray) -> np.ndarray:
+    """
+    Return the forecasts (days × nodes) reconciled by MinT with the diagonal of the variances of the errors (WLS).\\
+    The forecasts are moved to the closest coherent ones, where the series with larger errors are moved more:
+    `base - W C' (C W C')^-1 C base` with the constraints `C = [I, -A]` of the upper levels `A = S[:m]`.
+    `C W C'` is a sparse system of the size of the upper levels, so its cost does not grow with the square of the items.\\
+    The adjustment may turn small forecasts of the items negative, so the items are clipped at zero
+    and the upper levels are added up again, which keeps the forecasts coherent.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import splu
+    if base.shape[0] == 0:
+        return base.copy()
+    N, n = S.shape
+    m = N - n
+    C = sparse.hstack([sparse.identity(m, format="csr"), -S[:m]], format="csr")
+    CW = C @ sparse.diags(variances + VARIANCE_FLOOR)
+    lu = splu((CW @ C.T).tocsc())
+    mint = base - np.asarray(CW.T @ lu.solve(np.asarray(C @ base.T))).T
+    return reconcile_bottom_up(np.clip(mint, 0, None), S)
+
+
+def get_incoherence(forecasts: np.ndarray, S) -> float:
+    """
+    Return the largest gap between a node and the sum of the items under it in the forecasts (days × nodes).
+    """
+    if forecasts.shape[0] == 0:
+        return 0.0
+    return float(np.abs(reconcile_bottom_up(forecasts, S) - forecasts).max())
+
+
+def forecast_hierarchy(df_daily: pd.DataFrame, df_cal: pd.DataFrame, syllabi: dict[str, pd.DataFrame], progress=no_progress) -> dict:
+    """
+    Forecast all the series of the hierarchy on the class days after the POS data, and reconcile the forecasts.\\
+    `df_daily` is the output of `items_per_day()`, `df_cal` that of `forecast.process_calendar()`,
+    and `syllabi` the syllabus data of each campus.
+    Return the "nodes", the "dates" of the forecasts, the forecasts (days × nodes) for each value of `METHODS`,
+    the in-sample RMSE of each node ("rmse"), and the summing matrix ("S").\\
+    This function runs as a background job of the forecast page.
+    """
+    progress(0.0, "店舗・部門・商品の階層を構築しています...")
+    Y, nodes, S = build_hierarchy(df_daily)
+    X = build_features(df_cal, syllabi)
+    last_date = Y.index.max()
+    Y = Y.reindex(X.index[X.index <= last_date], fill_value=0)
+    # All the nodes of each day (days × nodes), added up by the summing matrix
+    Y_all = np.asarray((S @ Y.to_numpy(dtype="float64").T).T)
+    # Days when no store sold anything are closed days
+    is_open = Y_all[:, 0] > 0
+    progress(0.2, f"{S.shape[0]:,}系列のモデルを学習しています...")
+    D = design_matrix(X[X.index <= last_date][is_open])
+    coef = fit_base(D, Y_all[is_open])
+    fitted = np.expm1(D @ coef)
+    variances = ((Y_all[is_open] - fitted) ** 2).mean(axis=0)
+    progress(0.6, "予測しています...")
+    X_pred = X[X.index > last_date]
+    base = np.clip(np.expm1(design_matrix(X_pred) @ coef), 0, None)
+    progress(0.8, "階層間の合計が一致するように調整しています...")
+    return {
+        "nodes": nodes,
+        "dates": X_pred.index,
+        "base": base,
+        "bottom_up": reconcile_bottom_up(base, S),
+        "mint": reconcile_mint(base, S, variances),
+        "rmse": np.sqrt(variances),
+        "S": S
+    }
+
+
+def to_frame(result: dict) -> pd.DataFrame:
+    """
+    Return the forecasts of the result of `forecast_hierarchy()` in long format:
+    one row per day and node, with the columns of the nodes and one column per method of `METHODS`.
+    """
+    dates, nodes = result["dates"], result["nodes"]
+    df = pd.concat([nodes] * len(dates), axis="index", ignore_index=True)
+    df.insert(0, "日付", np.repeat(dates, len(nodes)))
+    for label, key in METHODS.items():
+        df[label] = result[key].ravel()
+    return df
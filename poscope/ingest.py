@@ -0,0 +1,357 @@
+"""
+Ingestion of the files exported from Ubiregi and the syllabus data: parsing, cleanup, and the precomputed tables.\\
+This module does not depend on Streamlit, so it can be imported quickly and driven from batch jobs.
+"""
+from typing import BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+import zipfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from poscope import bands, forecast, registry
+from poscope.instrument import instrument
+from poscope.jobs import no_progress
+
+
+#-----------------------------------------POS-----------------------------------------
+
+# Columns of each file kept by `cleanup_pos()` and their types.
+# IDs and codes are read as strings as they are, and datetimes are parsed with their UTC offsets in `cleanup_pos()`.
+POS_COLUMNS = {
+    "checkouts.csv": {
+        "アカウント名": pa.string(), "会計ID": pa.string(), "開始日時": pa.string(), "会計日時": pa.string(),
+        "削除日時": pa.string(), "金額": pa.int64(), "客数": pa.int64()
+    },
+    "items.csv": {
+        "会計ID": pa.string(), "SKU": pa.string(), "バーコード": pa.string(), "名前": pa.string(),
+        "数量": pa.int64(), "金額": pa.int64(), "部門": pa.string()
+    },
+    "payments.csv": {"会計ID": pa.string(), "支払い方法": pa.string()}
+}
+# Columns of the items which may be missing; they are NaN in memory, NULL in the local database, and null in the Arrow dataset
+TEXT_COLUMNS = ["SKU", "バーコード", "名前", "部門"]
+# Bytes of a CSV file decoded and parsed at a time, which bounds the memory used for parsing
+BLOCK_SIZE = 1 << 20
+
+
+def read_pos_csv(f: BinaryIO, columns: dict[str, pa.DataType]) -> pd.DataFrame:
+    """
+    Read a CSV file encoded in Shift-JIS from the stream, keeping only `columns` with the given types.\\
+    The streaming reader of pyarrow decodes and parses the file in blocks of `BLOCK_SIZE` bytes,
+    so neither the whole file nor its decoded text is held in memory, and no type is inferred.
+    Empty fields are read as missing values in the same way as `pd.read_csv()`.
+    """
+    reader = pacsv.open_csv(
+        f,
+        read_options=pacsv.ReadOptions(encoding="shift_jis", block_size=BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(column_types=columns, include_columns=list(columns), strings_can_be_null=True)
+    )
+    # Convert each block as soon as it is parsed, so that only one block is held by pyarrow at a time
+    frames = [batch.to_pandas() for batch in reader]
+    if not frames:
+        return reader.schema.empty_table().to_pandas()
+    df = pd.concat(frames, axis="index", ignore_index=True)
+    # Missing strings are None in pyarrow, but NaN in the rest of the app
+    return df.fillna(np.nan)
+
+
+@instrument
+def read_pos_zips(zip_files: list[BinaryIO], progress=no_progress) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Load the zip files exported from Ubiregi and return DataFrames of checkouts, items, and payments.\\
+    Each file of checktouts,csv, items.csv, and payments.csv is concatenated into a single DataFrame respectively.
+    Only the columns used by `cleanup_pos()` are read (see `POS_COLUMNS`).
+    `progress(fraction, message)` is called after each zip file.
+    """
+    frames = {name: [] for name in POS_COLUMNS}
+    # checkouts.csv, items.csv, payments.csv, and other trivial files in zip_file
+    for n, zip_file in enumerate(zip_files, start=1):
+        # Streamlit's UploadedFile is a subclass of BytesIO, so it can be read directly as well as files
+        with zipfile.ZipFile(zip_file) as zf:
+            # Load the necessary files: checkouts.csv, items.csv, and payments.csv
+            for file in zf.namelist():
+                if file not in POS_COLUMNS:
+                    continue
+                # The member is decompressed while it is parsed
+                with zf.open(file) as f:
+                    tmp = read_pos_csv(f, POS_COLUMNS[file])
+                # Concatenate with empty or all-NA DataFrame will be deprecated, 
+                # so if the loaded DataFrame is empty or all-NA, skip it.
+                if tmp.empty or tmp.isna().all().all():
+                    continue
+                frames[file].append(tmp)
+        progress(n / len(zip_files), f"ZIPファイルを読み込みました（{n}/{len(zip_files)}）")
+    # Concatenate once at the end instead of once per file
+    return tuple(
+        pd.concat(frames[name], axis="index") if frames[name] else pd.DataFrame()
+        for name in ["checkouts.csv", "items.csv", "payments.csv"]
+    )
+
+
+@instrument
+def cleanup_pos(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return cleanuped POS data.
+    """
+    # Filter columns
+    df_checkouts = df_checkouts[
+        ["アカウント名", "会計ID", "開始日時", "会計日時", "削除日時", "金額", "客数"]
+    ]
+    df_items = df_items[
+        ["会計ID", "SKU", "バーコード",  "名前", "数量", "金額", "部門"]
+    ]
+    df_payments = df_payments[["会計ID", "支払い方法"]]
+
+    # Drop duplicates
+    df_checkouts = df_checkouts.drop_duplicates()
+    df_items = df_items.drop_duplicates()
+    df_payments = df_payments.drop_duplicates()
+
+    # Delete cancelled records
+    # Non-NA value in "削除日時" means that the record is cancelled
+    cancelled = df_checkouts[["会計ID", "削除日時"]]
+    df_checkouts = df_checkouts[df_checkouts["削除日時"].isna()].drop(columns=["削除日時"])
+    df_items = pd.merge(df_items, cancelled, on="会計ID", how="left")
+    df_items = df_items[df_items["削除日時"].isna()].drop(columns=["削除日時"])
+    df_payments = pd.merge(df_payments, cancelled, on="会計ID", how="left")
+    df_payments = df_payments[df_payments["削除日時"].isna()].drop(columns=["削除日時"])
+
+    # Empty entries in "支払い方法" are change of payment, so remove them
+    df_payments = df_payments[df_payments["支払い方法"].notna()]
+
+    # A negative value in "数量" seems to indicate that the transaction has been cancelled, so remove those records.
+    # While there seems no record with zero value in "数量", remove those records as well.
+    invalid_cnt = df_items.query('数量 <= 0')["会計ID"].to_list()
+    df_checkouts = df_checkouts[~df_checkouts["会計ID"].isin(invalid_cnt)]
+    df_items = df_items[~df_items["会計ID"].isin(invalid_cnt)]
+    df_payments = df_payments[~df_payments["会計ID"].isin(invalid_cnt)]
+
+    # Change the account names to the names of the stores in the registry
+    df_checkouts = df_checkouts.replace({"アカウント名": registry.account_names()})
+
+    # One-hot encoding on "支払い方法" to cope with multiple payment methods in a single checkout.
+    df_payments = pd.get_dummies(df_payments, columns=["支払い方法"], 
+                                 prefix="", prefix_sep="", dtype="int")
+    df_payments = df_payments.groupby("会計ID").sum().reset_index()
+
+    # Modigy the data types
+    df_checkouts["開始日時"] = pd.to_datetime(df_checkouts["開始日時"]).map(lambda x: x.tz_localize(None))
+    df_checkouts["会計日時"] = pd.to_datetime(df_checkouts["会計日時"]).map(lambda x: x.tz_localize(None))
+    df_checkouts = df_checkouts.astype({"会計ID": "str", "金額": "int", "客数": "int"})
+    df_items = df_items.astype({"会計ID": "str", "数量": "int", "金額": "int"})
+    # Missing strings (ex. items without "部門") stay NaN instead of becoming "nan"
+    df_items[TEXT_COLUMNS] = df_items[TEXT_COLUMNS].astype("str").where(df_items[TEXT_COLUMNS].notna(), np.nan)
+    df_payments = df_payments.astype({"会計ID": "str"})
+
+    # Merge the DataFrames
+    df_customers = pd.merge(df_checkouts, df_payments, on="会計ID", how="inner")
+    # Time band and minute of the day, derived once here so that the pages filter by business hours without `between_time()`
+    df_customers = bands.add_time_columns(df_customers)
+    df_items = pd.merge(
+        df_customers[["アカウント名", "会計ID", "開始日時", "会計日時"] + bands.TIME_COLUMNS], df_items, 
+        on="会計ID", how="inner"
+    )
+
+    return df_customers, df_items
+
+
+def compute_checkout_load(df_cus: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the number of arrivals and the estimated number of concurrent checkouts per minute, for each store and day.\\
+    A checkout is in progress from "開始日時" to "会計日時", so the load at time t is
+    (the number of checkouts started before t) - (the number of checkouts completed before t).\\
+    Both counts are obtained for all minutes at once by `np.searchsorted()` on the sorted start and end times (interval sweep).
+    The time-weighted average load within each minute is the difference of the integral of the load at both ends of the minute,
+    where the integral up to t is sum(max(0, t - start)) - sum(max(0, t - end)) and is computed from prefix sums.\\
+    Checkouts taking longer than 30 minutes are regarded as left open and truncated to 30 minutes.
+    """
+    # Minutes from the start of the first band to the end of the last band (ex. 11:00 to 19:30),
+    # and one more point to close the last minute
+    first, last = (seconds // 60 for seconds in bands.get_day_range())
+    offsets = np.arange(first, last + 2) * 60
+    frames = []
+    for store, df in df_cus.groupby("アカウント名"):
+        start = df["開始日時"].to_numpy(dtype="datetime64[s]").astype("int64")
+        end = df["会計日時"].to_numpy(dtype="datetime64[s]").astype("int64")
+        end = np.clip(end, start, start + 30 * 60)
+        # Seconds from the first day to keep the prefix sums small
+        origin = start.min() - start.min() % 86400
+        start = np.sort(start - origin)
+        end = np.sort(end - origin)
+        days = np.unique(start // 86400)
+        grid = days[:, None] * 86400 + offsets[None, :]
+        # The number of checkouts started/completed before each point of the grid
+        n_started = np.searchsorted(start, grid, side="left")
+        n_completed = np.searchsorted(end, grid, side="left")
+        # Integral of the load from the origin to each point of the grid
+        cum_start = np.concatenate([[0], np.cumsum(start)])
+        cum_end = np.concatenate([[0], np.cumsum(end)])
+        integral = (n_started * grid - cum_start[n_started]) - (n_completed * grid - cum_end[n_completed])
+        frames.append(pd.DataFrame({
+            "アカウント名": store,
+            "日付": np.repeat(pd.to_datetime((days * 86400 + origin), unit="s"), len(offsets) - 1),
+            "時刻": np.tile(offsets[:-1] // 60, len(days)).astype("int16"),
+            "到着数": np.diff(n_started, axis=1).ravel().astype("int32"),
+            "同時会計数": (n_started - n_completed)[:, :-1].ravel().astype("int32"),
+            "平均同時会計数": (np.diff(integral, axis=1) / 60).ravel().astype("float32")
+        }))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis="index", ignore_index=True)
+
+
+def compute_checkout_duration(df_cus: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the histogram of checkout durations ("会計日時" - "開始日時") for each store, day, and 10-minute slot.\\
+    The histograms of different days can simply be added up,
+    so the distribution over any range of dates is obtained without revisiting the checkouts.
+    """
+    edges = [10, 20, 30, 45, 60, 90, 120, 180, 300, 600]
+    # "～" (U+FF5E) cannot be encoded in Shift-JIS, so "-" is used for the labels exported to CSV
+    labels = ["10秒未満", "10-20秒", "20-30秒", "30-45秒", "45-60秒", "1-1.5分",
+              "1.5-2分", "2-3分", "3-5分", "5-10分", "10分以上"]
+    duration = (df_cus["会計日時"] - df_cus["開始日時"]).dt.total_seconds().clip(lower=0).to_numpy()
+    minutes = df_cus["時刻"].to_numpy()
+    df_dur = pd.DataFrame({
+        "アカウント名": df_cus["アカウント名"].to_numpy(),
+        "日付": df_cus["開始日時"].dt.normalize().to_numpy(),
+        "スロット": (minutes // 10 * 10).astype("int16"),
+        "所要時間": pd.Categorical.from_codes(np.digitize(duration, edges), categories=labels, ordered=True)
+    })
+    df_dur = df_dur.groupby(["アカウント名", "日付", "スロット", "所要時間"], observed=True).size()
+    return df_dur.rename("会計数").reset_index()
+
+
+# Columns of the items used by `build_sales_cube()`
+SALES_CUBE_ITEM_COLUMNS = ["会計ID", "部門", "数量", "金額"]
+
+
+def build_sales_cube(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate POS data into a cube of store × date × time band × department ("部門").\\
+    Each cell has the sales ("金額"), quantity ("数量"), number of checkouts ("会計数"), and number of customers ("客数").
+    For a department, "会計数" and "客数" count the checkouts including the department.\\
+    Cells of "部門" == "（全体）" hold the totals of checkouts,
+    where "金額" is the amount of the checkouts rather than the sum of the items.
+    """
+    df_cus = df_cus[["アカウント名", "会計ID", "開始日時", "時間帯", "金額", "客数"]].copy()
+    df_cus["日付"] = df_cus["開始日時"].dt.normalize()
+    # Totals of checkouts
+    quantity = df_itm.groupby("会計ID")["数量"].sum()
+    df_cus["数量"] = df_cus["会計ID"].map(quantity).fillna(0).astype("int")
+    df_all = df_cus.groupby(["アカウント名", "日付", "時間帯"], observed=True).agg(
+        金額=("金額", "sum"), 数量=("数量", "sum"), 会計数=("会計ID", "size"), 客数=("客数", "sum")
+    ).reset_index()
+    df_all["部門"] = "（全体）"
+    # Each department in each checkout, then totals of departments
+    df_dep = df_itm.groupby(["会計ID", "部門"], as_index=False)[["金額", "数量"]].sum()
+    df_dep = pd.merge(df_cus[["アカウント名", "会計ID", "日付", "時間帯", "客数"]], df_dep, on="会計ID", how="inner")
+    df_dep = df_dep.groupby(["アカウント名", "日付", "時間帯", "部門"], observed=True).agg(
+        金額=("金額", "sum"), 数量=("数量", "sum"), 会計数=("会計ID", "size"), 客数=("客数", "sum")
+    ).reset_index()
+    df_cube = pd.concat([df_all, df_dep], axis="index", ignore_index=True)
+    return df_cube.astype({
+        "アカウント名": "category", "時間帯": "category", "部門": "category",
+        "金額": "int64", "数量": "int32", "会計数": "int32", "客数": "int32"
+    })
+
+
+# Number of stores whose tables are built at the same time by `build_pos_tables()`
+MAX_STORE_WORKERS = 4
+
+
+def split_stores(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Split the customers and items into the stores, in the order of the store names.\\
+    Items are assigned to the store of their checkouts.
+    """
+    codes, stores = pd.factorize(df_cus["アカウント名"], sort=True)
+    # Store of the checkout of each item, looked up once instead of once per store
+    first = ~df_cus["会計ID"].duplicated().to_numpy()
+    positions = pd.Index(df_cus["会計ID"].to_numpy()[first]).get_indexer(df_itm["会計ID"])
+    item_codes = np.where(positions >= 0, codes[first][positions], -1)
+    return {store: (df_cus[codes == k], df_itm[item_codes == k]) for k, store in enumerate(stores)}
+
+
+def build_store_tables(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Return the tables derived from the customers and items of a single store.
+    """
+    return {
+        # Checkout load and duration per day, precomputed for the queue analysis
+        "df_queue_load": compute_checkout_load(df_cus),
+        "df_queue_duration": compute_checkout_duration(df_cus),
+        # Sales cube for the revenue analysis
+        "df_sales_cube": build_sales_cube(df_cus, df_itm)
+    }
+
+
+def concat_store_tables(tables: list[dict[str, pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+    """
+    Concatenate the tables of the stores built by `build_store_tables()`.\\
+    The categorical columns of the sales cube are cast again, since their categories differ between the stores.
+    """
+    merged = {key: pd.concat([t[key] for t in tables], axis="index", ignore_index=True) for key in tables[0]}
+    merged["df_sales_cube"] = merged["df_sales_cube"].astype({"アカウント名": "category", "時間帯": "category", "部門": "category"})
+    return merged
+
+
+def build_pos_tables(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Return the DataFrames of customers and items with the tables derived from them,
+    under the keys of session state used by the pages.\\
+    All the derived tables are aggregated within a store, so they are built for each store separately and concatenated.
+    The stores are processed in threads, which overlap in the sorting and searching by numpy releasing the GIL.
+    """
+    parts = split_stores(df_cus, df_itm)
+    if len(parts) <= 1:
+        return {"df_customers": df_cus, "df_items": df_itm, **build_store_tables(df_cus, df_itm)}
+    with ThreadPoolExecutor(max_workers=min(MAX_STORE_WORKERS, len(parts))) as executor:
+        tables = list(executor.map(lambda part: build_store_tables(*part), parts.values()))
+    return {"df_customers": df_cus, "df_items": df_itm, **concat_store_tables(tables)}
+
+
+#-----------------------------------------Syllabus-----------------------------------------
+
+def build_syllabus_cube(df_slb_west: pd.DataFrame, df_slb_east: pd.DataFrame) -> tuple[np.ndarray, list[str]]:
+    """
+    Convert the syllabus data into a dense array of campus (west, east) × weekday (月～金) × period (1～5) × term,
+    and return it with the list of terms in chronological order.\\
+    Terms missing on a campus are filled with NaN.
+    """
+    seasons = ["SPR", "SMR", "AUT", "WTR"]
+    terms = sorted(
+        set(df_slb_west.columns) | set(df_slb_east.columns),
+        key=lambda x: (int(x[:4]), seasons.index(x[4:]))
+    )
+    index = pd.MultiIndex.from_product([["月", "火", "水", "木", "金"], [1, 2, 3, 4, 5]])
+    cube = np.stack([
+        df.reindex(index=index, columns=terms).to_numpy(dtype="float64").reshape(5, 5, len(terms))
+        for df in [df_slb_west, df_slb_east]
+    ])
+    return cube, terms
+
+
+#-----------------------------------------Calendar-----------------------------------------
+
+# Columns of the calendar data
+CALENDAR_COLUMNS = ["date", "academic_year", "term", "class", "info"]
+
+
+@instrument
+def build_calendar_dim(df_cal: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the calendar dimension: the calendar data indexed by date with the features of `forecast.process_calendar()`
+    and the text shown on hovering a day in the charts ("hover"), such as "<br>学期: 2025年度AUT<br>講義情報: MON<br>その他情報: ".\\
+    It is built once per upload of the calendar data,
+    so the charts look up the days by reindexing it instead of merging the calendar data at every rerun.
+    """
+    df_dim = forecast.process_calendar(df_cal[CALENDAR_COLUMNS].copy())
+    text = {c: df_dim[c].astype("string").fillna("") for c in CALENDAR_COLUMNS[1:]}
+    df_dim["hover"] = (
+        "<br>学期: " + text["academic_year"] + "年度" + text["term"]
+        + "<br>講義情報: " + text["class"] + "<br>その他情報: " + text["info"]
+    ).astype("object")
+    return df_dim.set_index("date").sort_index()
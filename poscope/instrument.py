@@ -0,0 +1,130 @@
+"""
+Measurements of the wall time, the rows, and the allocated memory of the processing steps.\\
+The functions decorated with `@instrument` (and the blocks of `measure()`) add a record at each call,
+which is kept in memory for the diagnostics panel and appended to the JSON-lines log of `POSCOPE_INSTRUMENT_LOG` when it is set.
+The memory is measured only when `POSCOPE_TRACEMALLOC` is "1".
+"""
+import os
+import json
+import time
+import datetime
+import functools
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+
+
+# Path of the JSON-lines log; records are only kept in memory when it is not set
+LOG_PATH_ENV = "POSCOPE_INSTRUMENT_LOG"
+# Allocated memory is measured by `tracemalloc` only when this is set to "1", since tracing slows down allocations
+TRACEMALLOC_ENV = "POSCOPE_TRACEMALLOC"
+
+# Recent records of the process, shown in the diagnostics panel
+RECORDS = deque(maxlen=500)
+
+_lock = threading.Lock()
+# Peaks of the enclosing measurements, since `tracemalloc.reset_peak()` also resets them
+_peaks = threading.local()
+
+
+def count_rows(obj) -> int | None:
+    """
+    Return the number of rows of a DataFrame or Series,
+    the sum of them for a tuple or list containing DataFrames or Series, or `None` otherwise.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, (tuple, list)):
+        counts = [count_rows(x) for x in obj if isinstance(x, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+
+def write_record(record: dict) -> None:
+    """
+    Keep the record in memory and append it to the JSON-lines log if enabled.
+    """
+    with _lock:
+        RECORDS.append(record)
+        path = os.environ.get(LOG_PATH_ENV, "")
+        if path:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+@contextmanager
+def measure(name: str, rows_in: int | None = None):
+    """
+    Measure the wall time and the allocated memory of the block and record them under `name`.\\
+    The yielded dict can be given "rows_out" inside the block.\\
+    The memory is the peak of memory traced by `tracemalloc` during the block minus the memory at its start,
+    so it is approximate when other threads allocate at the same time.
+    """
+    trace = os.environ.get(TRACEMALLOC_ENV, "") == "1"
+    if trace:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = getattr(_peaks, "stack", None)
+        if stack is None:
+            stack = _peaks.stack = []
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        stack.append(0)
+        tracemalloc.reset_peak()
+    info = {"rows_out": None}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        wall = time.perf_counter() - start
+        memory = None
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, stack.pop())
+            memory = max(peak - current, 0)
+            if stack:
+                stack[-1] = max(stack[-1], peak)
+        write_record({
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "name": name,
+            "wall": wall,
+            "rows_in": rows_in,
+            "rows_out": info["rows_out"],
+            "memory": memory
+        })
+
+
+def instrument(func):
+    """
+    Decorator to record the wall time, the rows of the DataFrames given and returned, and the allocated memory of each call.\\
+    Put it below `@st.cache_data` so that only the calls actually computed are recorded.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        counts = [count_rows(x) for x in list(args) + list(kwargs.values())]
+        counts = [c for c in counts if c is not None]
+        with measure(func.__name__, sum(counts) if counts else None) as info:
+            result = func(*args, **kwargs)
+            info["rows_out"] = count_rows(result)
+        return result
+    return wrapper
+
+
+def get_records() -> pd.DataFrame:
+    """
+    Return the recent records as a DataFrame, the newest first.
+    """
+    with _lock:
+        records = list(RECORDS)
+    return pd.DataFrame(records, columns=["time", "name", "wall", "rows_in", "rows_out", "memory"]).iloc[::-1]
+
+
+def clear_records() -> None:
+    """
+    Remove the records kept in memory.
+    """
+    with _lock:
+        RECORDS.clear()
@@ -0,0 +1,129 @@
+"""
+Background jobs run by thread pools shared by all sessions of the process.\\
+A job is identified by an ID, reports its progress through the `progress` argument given to the function,
+and keeps its result after it finishes until a session collects it, so the session can pick it up after reruns or a reload of the browser.
+"""
+import uuid
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of jobs run at the same time in each pool; the others wait in the queue of their pool.
+# The jobs of the watched folder have their own pool, so a burst of dropped zip files does not hold up the uploads of the sessions
+POOLS = {"default": 2, "watcher": 1}
+# Number of finished jobs kept in memory, including the results not collected yet
+MAX_FINISHED = 8
+
+JOBS: dict[str, dict] = {}
+
+_lock = threading.Lock()
+_executors = {
+    pool: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"poscope-{pool}")
+    for pool, workers in POOLS.items()
+}
+_logger = logging.getLogger(__name__)
+
+
+def update_job(job_id: str, **fields) -> None:
+    """
+    Update the fields of the job.
+    """
+    with _lock:
+        JOBS[job_id].update(fields)
+
+
+def evict_finished() -> None:
+    """
+    Remove the oldest finished jobs beyond `MAX_FINISHED`. Must be called with the lock held.
+    """
+    finished = [job for job in JOBS.values() if job["status"] in ("done", "failed")]
+    finished.sort(key=lambda job: job["finished"])
+    for job in finished[:max(len(finished) - MAX_FINISHED, 0)]:
+        del JOBS[job["id"]]
+
+
+def run_job(job_id: str, func, args: tuple, kwargs: dict) -> None:
+    """
+    Run the function of the job and keep its result or error.
+    """
+    def progress(fraction: float, message: str = "") -> None:
+        update_job(job_id, progress=min(max(fraction, 0.0), 1.0), message=message)
+
+    update_job(job_id, status="running", started=datetime.datetime.now())
+    try:
+        result = func(*args, progress=progress, **kwargs)
+    except Exception as e:
+        _logger.exception("Job %s failed", job_id)
+        update_job(job_id, status="failed", error=f"{type(e).__name__}: {e}", finished=datetime.datetime.now())
+    else:
+        update_job(job_id, status="done", progress=1.0, result=result, finished=datetime.datetime.now())
+    with _lock:
+        evict_finished()
+
+
+def submit(name: str, func, *args, pool: str = "default", **kwargs) -> str:
+    """
+    Run `func(*args, progress=..., **kwargs)` in the background in the pool of `POOLS` and return the ID of the job.\\
+    `func` reports its progress by calling `progress(fraction, message)` with a fraction between 0 and 1.
+    It must not call Streamlit, since it runs outside the script of any session.
+    """
+    job_id = uuid.uuid4().hex
+    with _lock:
+        JOBS[job_id] = {
+            "id": job_id, "name": name, "status": "queued", "progress": 0.0, "message": "",
+            "pool": pool, "result": None, "error": None, "collected": False,
+            "submitted": datetime.datetime.now(), "started": None, "finished": None
+        }
+    _executors[pool].submit(run_job, job_id, func, args, kwargs)
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    """
+    Return a copy of the job, or `None` if it is unknown (ex. removed or submitted before a restart).
+    """
+    with _lock:
+        job = JOBS.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def collect_job(job_id: str) -> dict | None:
+    """
+    Return a copy of the finished job with its result, and release the result from memory.\\
+    The job itself is kept with its status and error only, since a result (ex. the POS data) may be large
+    and must not stay reachable through the ID of the job left in a URL.
+    Return `None` if the job is unknown, has not finished, or has been collected already (ex. by another tab).
+    """
+    with _lock:
+        job = JOBS.get(job_id)
+        if job is None or job["status"] not in ("done", "failed") or job["collected"]:
+            return None
+        collected = dict(job)
+        job.update(result=None, collected=True)
+        return collected
+
+
+def list_jobs() -> list[dict]:
+    """
+    Return copies of all jobs kept in memory, the newest first.
+    """
+    with _lock:
+        jobs = [dict(job) for job in JOBS.values()]
+    return sorted(jobs, key=lambda job: job["submitted"], reverse=True)
+
+
+def no_progress(fraction: float, message: str = "") -> None:
+    """
+    Default `progress` of the job functions called directly (ex. from batch jobs), which ignores the progress.
+    """
+
+
+def sub_progress(progress, start: float, end: float):
+    """
+    Return a `progress` that maps the fraction of a step onto the range from `start` to `end` of the whole job.
+    """
+    def scaled(fraction: float, message: str = "") -> None:
+        progress(start + (end - start) * fraction, message)
+    return scaled
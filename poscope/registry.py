@@ -0,0 +1,116 @@
+"""
+Registry of the stores.\\
+Each store has the name shown in the app, the account name in the exports of Ubiregi,
+the color of its graphs, and the campus whose syllabus data is used for it ("west", "east", or `None`).
+The stores are given by the JSON file of `POSCOPE_STORES` (a list of such objects), or `DEFAULT_STORES` otherwise.
+Accounts not in the registry keep their account names and are handled as stores of their own.
+"""
+import os
+import json
+import zlib
+import functools
+
+
+# The registry is read from this JSON file when the environment variable is set
+STORES_FILE_ENV = "POSCOPE_STORES"
+
+# Stores in the order shown in the app
+DEFAULT_STORES = [
+    # tab:orange
+    {"name": "西食堂", "account": "ub396203", "color": "rgba(255, 127, 14, 0.7)", "campus": "west"},
+    # tab:blue
+    {"name": "東カフェテリア", "account": "ub396207", "color": "rgba(0, 104, 201, 0.7)", "campus": "east"}
+]
+
+# Option of the pages selecting all stores at once
+ALL_STORES = "全店舗"
+
+# Color of the graphs of all stores added up
+ALL_STORES_COLOR = "rgba(61, 58, 42, 0.7)"
+
+# Colors of the stores without one: the rest of the palette of tab10
+PALETTE = [
+    "rgba(44, 160, 44, 0.7)", "rgba(214, 39, 40, 0.7)", "rgba(148, 103, 189, 0.7)", "rgba(140, 86, 75, 0.7)",
+    "rgba(227, 119, 194, 0.7)", "rgba(127, 127, 127, 0.7)", "rgba(188, 189, 34, 0.7)", "rgba(23, 190, 207, 0.7)"
+]
+
+# Campuses of the syllabus data, in the order of the sheets of the syllabus file
+CAMPUSES = {"west": "西キャンパス", "east": "東キャンパス"}
+
+
+@functools.cache
+def get_stores() -> tuple[dict, ...]:
+    """
+    Return the stores of the registry, read once per process.
+    """
+    path = os.environ.get(STORES_FILE_ENV, "")
+    if not path:
+        return tuple(DEFAULT_STORES)
+    with open(path, encoding="utf-8") as f:
+        stores = json.load(f)
+    for store in stores:
+        if "name" not in store or "account" not in store:
+            raise ValueError(f"Each store in {path} needs \"name\" and \"account\": {store}")
+        if store.get("campus") is not None and store["campus"] not in CAMPUSES:
+            raise ValueError(f"\"campus\" must be one of {list(CAMPUSES)} or null: {store}")
+    return tuple(stores)
+
+
+def store_names() -> list[str]:
+    """
+    Return the names of the stores in the registry.
+    """
+    return [store["name"] for store in get_stores()]
+
+
+def account_names() -> dict[str, str]:
+    """
+    Return the names of the stores by account name, used to rename the accounts of the exports.
+    """
+    return {store["account"]: store["name"] for store in get_stores()}
+
+
+def sort_stores(names) -> list[str]:
+    """
+    Return the names in the order of the registry, followed by the stores not in the registry in alphabetical order.
+    """
+    names = set(names)
+    registered = store_names()
+    return [name for name in registered if name in names] + sorted(names - set(registered))
+
+
+def store_color(name: str) -> str:
+    """
+    Return the color of the graphs of the store.\\
+    Stores not in the registry get a color of `PALETTE` fixed by their names.
+    """
+    if name == ALL_STORES:
+        return ALL_STORES_COLOR
+    for store in get_stores():
+        if store["name"] == name and store.get("color"):
+            return store["color"]
+    return PALETTE[zlib.crc32(name.encode("utf-8")) % len(PALETTE)]
+
+
+def store_campus(name: str) -> str | None:
+    """
+    Return the campus ("west" or "east") of the store, or `None` if no syllabus data is used for it.
+    """
+    for store in get_stores():
+        if store["name"] == name:
+            return store.get("campus")
+    return None
+
+
+def campus_stores(campus: str) -> list[str]:
+    """
+    Return the names of the stores on the campus.
+    """
+    return [store["name"] for store in get_stores() if store.get("campus") == campus]
+
+
+def select_stores(store: str) -> list[str] | None:
+    """
+    Return the list of the store selected by an option of the pages, or `None` when all stores are selected.
+    """
+    return None if store == ALL_STORES else [store]
@@ -0,0 +1,98 @@
+import streamlit as st
+import uuid
+import pandas as pd
+
+from poscope import database, dataset, ingest, registry
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_query(name: str, path: str, db_version: str, *args):
+    """
+    Run the query function `name` of `poscope.database`.\\
+    `db_version` is not used in the function but included in the arguments,
+    so the cached results are discarded when the database is written.
+    """
+    return getattr(database, name)(path, *args)
+
+
+def query_database(name: str, *args):
+    """
+    Run the query function `name` of `poscope.database` on the local database with the arguments `args`.\\
+    Must be called only when the local database is enabled (`database.get_db_path()` is not `None`).
+    """
+    path = database.get_db_path()
+    return cached_query(name, path, database.get_version(path), *args)
+
+
+def set_session_state_pos(tables: dict) -> None:
+    """
+    Set the session states related with POS data from the tables prepared by `build_pos_tables()`.
+    """
+    df_cus = tables["df_customers"]
+    # main DataFrames, and the precomputed tables
+    st.session_state.update(tables)
+    # When the Arrow dataset is enabled, the items are read from the files on disk instead of session state
+    if dataset.get_dataset_dir() is not None:
+        st.session_state["df_items"] = None
+    # Identifies the uploaded POS data in the keys of `@st.cache_data` instead of hashing the DataFrames
+    st.session_state["pos_version"] = uuid.uuid4().hex
+
+    # These session states are used to show information about the uploaded POS data
+    ranges = df_cus.groupby("アカウント名")["開始日時"].agg(["min", "max"])
+    st.session_state["store_date_ranges"] = {store: (lo, hi) for store, (lo, hi) in ranges.iterrows()}
+    # Stores in the options of the pages: those of the registry and the others found in the data
+    st.session_state["store_options"] = registry.sort_stores(registry.store_names() + ranges.index.tolist())
+    st.session_state["min_date"] = ranges["min"].min()
+    st.session_state["max_date"] = ranges["max"].max()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def load_store_tables(directory: str, store: str, stamp: str) -> dict:
+    """
+    Read the POS data of the store in the Arrow dataset and return it with the derived tables of the store.\\
+    `stamp` is not used in the function but included in the arguments,
+    so the tables of a store are built again only when its partitions are written.\\
+    Only the columns of the items used by the sales cube are read, since the pages read the items on demand.
+    """
+    df_cus = dataset.read_all(directory, "customers", store)
+    if df_cus.empty:
+        return {}
+    df_itm = dataset.read_all(directory, "items", store, columns=ingest.SALES_CUBE_ITEM_COLUMNS)
+    return {"df_customers": df_cus, **ingest.build_store_tables(df_cus, df_itm)}
+
+
+def load_dataset_tables(directory: str) -> dict:
+    """
+    Read the POS data in the Arrow dataset and return it with the derived tables, or an empty dict if there is none.\\
+    The tables are cached for each store and shared by the sessions,
+    so a write into the partitions of a store (ex. a new store) builds the tables of that store only.
+    """
+    stamps = dataset.get_store_stamps(directory)
+    tables = [load_store_tables(directory, store, stamps[store]) for store in sorted(stamps)]
+    tables = [t for t in tables if t]
+    if not tables:
+        return {}
+    df_cus = pd.concat([t.pop("df_customers") for t in tables], axis="index", ignore_index=True)
+    # The columns of payment methods differ between the stores
+    dataset.fill_payments(df_cus)
+    # Items are read from the dataset by the pages
+    return {"df_customers": df_cus, "df_items": None, **ingest.concat_store_tables(tables)}
+
+
+def sync_pos_dataset() -> None:
+    """
+    Load the POS data of the Arrow dataset into session state when the dataset has been written
+    since the session loaded it, ex. by the watched folder or by an upload in another session.\\
+    Does nothing when the dataset is disabled.
+    """
+    directory = dataset.get_dataset_dir()
+    if directory is None:
+        return
+    version = dataset.get_version(directory)
+    if not version or version == st.session_state.get("dataset_version"):
+        return
+    with st.spinner("最新のPOSデータを読み込んでいます...", show_time=True):
+        tables = load_dataset_tables(directory)
+    if tables:
+        set_session_state_pos(tables)
+    st.session_state["dataset_version"] = version
@@ -0,0 +1,56 @@
+"""
+Helpers of the app shell that are cheap to import.\\
+Heavy libraries (pandas, scipy, sklearn, ...) are imported by the modules and functions that actually use them,
+so the home page of a cold container renders without loading them.
+plotly is not deferred, since Streamlit itself imports it for the theme of the charts.
+"""
+import os
+import logging
+import streamlit as st
+from PIL import Image
+
+from poscope import watcher
+
+
+# Static assets, independent of the working directory
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+# Set to "1" to show the diagnostics panel in every session
+DIAGNOSTICS_ENV = "POSCOPE_DIAGNOSTICS"
+
+
+@st.cache_resource(show_spinner=False)
+def load_image(name: str) -> Image.Image:
+    """
+    Return the image `name` in "static/", decoded once per process and shared by all sessions and reruns.\\
+    The returned image must not be modified.
+    """
+    image = Image.open(os.path.join(STATIC_DIR, name))
+    # Decode now, since `Image.open()` only reads the header and decodes on first use
+    image.load()
+    return image
+
+
+def diagnostics_enabled() -> bool:
+    """
+    Return whether the diagnostics panel is shown.\\
+    It is hidden unless the environment variable `POSCOPE_DIAGNOSTICS` is "1" or the URL has `?diagnostics=1`.
+    """
+    return os.environ.get(DIAGNOSTICS_ENV, "") == "1" or st.query_params.get("diagnostics") == "1"
+
+
+@st.cache_resource(show_spinner=False)
+def start_watcher():
+    """
+    Start watching the folder of `POSCOPE_WATCH_DIR` for new POS exports, once per process.\\
+    Return the observer, or `None` if the folder is not watched.
+    The ingestion libraries are imported only when the folder is watched.
+    """
+    if watcher.get_watch_dir() is None:
+        return None
+    from poscope import dataset
+    if dataset.get_dataset_dir() is None:
+        logging.getLogger(__name__).warning(
+            "%s is ignored since the Arrow dataset is disabled (%s)", watcher.WATCH_DIR_ENV, dataset.DATASET_DIR_ENV
+        )
+        return None
+    return watcher.start(watcher.get_watch_dir(), dataset.get_dataset_dir())
@@ -0,0 +1,315 @@
+"""
+Synthetic POS exports of Ubiregi, and matching calendar and syllabus workbooks, for load testing.
+
+Usage:
+    python -m poscope.synthetic --out data/synthetic --start 2024-04-01 --days 365 --stores 2
+"""
+import os
+import io
+import argparse
+import zipfile
+import numpy as np
+import pandas as pd
+
+from poscope.export import to_csv_shift_jis
+
+
+# Account names of the stores; the first two are those of the default registry (`poscope.registry.DEFAULT_STORES`),
+# and the others are left as they are by `cleanup_pos()` unless they are added to the registry
+ACCOUNTS = ["ub396203", "ub396207"]
+# Mean number of checkouts on a class day of each store, before `scale`
+BASE_CUSTOMERS = [260, 170]
+
+# Name, department, price, SKU, and barcode of the items
+CATALOG = [
+    ("日替わり定食", "定食", 500, "A001", "4900000000011"),
+    ("唐揚げ定食", "定食", 480, "A002", "4900000000028"),
+    ("焼き魚定食", "定食", 520, "A003", "4900000000035"),
+    ("カレーライス", "丼・カレー", 380, "B001", "4900000000042"),
+    ("カツカレー", "丼・カレー", 480, "B002", "4900000000059"),
+    ("親子丼", "丼・カレー", 420, "B003", "4900000000066"),
+    ("かけうどん", "麺", 250, "C001", "4900000000073"),
+    ("きつねうどん", "麺", 320, "C002", "4900000000080"),
+    ("醤油ラーメン", "麺", 400, "C003", "4900000000097"),
+    ("ライス", "サイド", 100, "D001", "4900000000103"),
+    ("味噌汁", "サイド", 50, "D002", "4900000000110"),
+    ("サラダ", "サイド", 120, "D003", "4900000000127"),
+    ("コーヒー", "ドリンク", 150, "E001", "4900000000134"),
+    ("お茶", "ドリンク", 100, "E002", "4900000000141"),
+    ("プリン", "デザート", 150, "F001", "4900000000158"),
+    ("ケーキ", "デザート", 280, "F002", "4900000000165")
+]
+# Relative popularity of the items
+WEIGHTS = np.array([10, 8, 5, 9, 6, 5, 6, 5, 6, 7, 8, 6, 4, 4, 3, 2], dtype="float")
+
+PAYMENT_METHODS = ["現金", "交通系IC", "QRコード決済", "クレジットカード"]
+PAYMENT_WEIGHTS = [0.45, 0.3, 0.2, 0.05]
+
+# Terms of an academic year starting on April 1: (term, first day as "MM-DD")
+TERMS = [
+    ("SPRVAC", "04-01"), ("SPR", "04-11"), ("SMR", "06-01"), ("SMRVAC", "07-24"), ("SMRINT", "07-25"),
+    ("SMRVAC", "08-03"), ("AUT", "09-16"), ("WTR", "11-02"), ("WTRVAC", "12-29"), ("WTRINT1to3", "01-08"),
+    ("SPRVAC", "02-06"), ("WTRINT4", "03-03"), ("SPRVAC", "03-22")
+]
+MAIN_TERMS = ["SPR", "SMR", "AUT", "WTR"]
+INTENSIVE_TERMS = ["SMRINT", "WTRINT1to3", "WTRINT4"]
+# National holidays on fixed dates ("MM-DD")
+HOLIDAYS = ["01-01", "02-11", "02-23", "04-29", "05-03", "05-04", "05-05", "08-11", "11-03", "11-23"]
+
+EN_DAYNAMES = ["MON", "TUE", "WED", "THU", "FRI"]
+JP_DAYNAMES = ["月", "火", "水", "木", "金"]
+
+
+#-----------------------------------------Calendar and syllabus-----------------------------------------
+
+def make_calendar(start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """
+    Return calendar data (date, academic_year, term, class, info) covering the academic years from `start` to `end`.\\
+    Weekdays of the main terms have classes of their day names, weekdays of the intensive terms have "IntCourse",
+    and holidays, weekends, and vacations have "NoClass".
+    The last weekend of each main term is marked "OnlineExam".
+    """
+    first_year = start.year if start.month >= 4 else start.year - 1
+    last_year = end.year if end.month >= 4 else end.year - 1
+    dates = pd.date_range(f"{first_year}-04-01", f"{last_year + 1}-03-31", freq="D")
+    academic_year = np.where(dates.month >= 4, dates.year, dates.year - 1)
+    # Term of each date: the last term which has started
+    term = np.empty(len(dates), dtype="object")
+    for year in range(first_year, last_year + 1):
+        in_year = academic_year == year
+        for name, first_day in TERMS:
+            first = pd.Timestamp(f"{year if int(first_day[:2]) >= 4 else year + 1}-{first_day}")
+            term[in_year & (dates >= first)] = name
+    holiday = dates.strftime("%m-%d").isin(HOLIDAYS)
+    weekday = dates.weekday < 5
+    day_names = np.array(EN_DAYNAMES + ["", ""])[dates.weekday]
+    cls = np.where(
+        np.isin(term, MAIN_TERMS) & weekday & ~holiday, day_names,
+        np.where(np.isin(term, INTENSIVE_TERMS) & weekday & ~holiday, "IntCourse", "NoClass")
+    )
+    info = np.where(holiday, "Holiday", None).astype("object")
+    df_cal = pd.DataFrame({"date": dates, "academic_year": academic_year, "term": term, "class": cls, "info": info})
+    # Online exams on the last weekend of each main term
+    last_day = df_cal["term"] != df_cal["term"].shift(-1)
+    for i in df_cal.index[last_day & df_cal["term"].isin(MAIN_TERMS)]:
+        for j in range(max(i - 6, 0), i + 1):
+            if df_cal.loc[j, "date"].weekday() >= 5 and df_cal.loc[j, "info"] is None:
+                df_cal.loc[j, "info"] = "OnlineExam"
+    return df_cal
+
+
+def make_syllabus(rng: np.random.Generator, academic_years: list[int], n_stores: int) -> list[pd.DataFrame]:
+    """
+    Return syllabus data of each store: the number of students enrolled
+    per day of the week ("曜日") and period ("時限") in the rows, and "{academic year}{term}" in the columns.
+    """
+    index = pd.MultiIndex.from_product([JP_DAYNAMES, [1, 2, 3, 4, 5]], names=["曜日", "時限"])
+    columns = [f"{year}{term}" for year in academic_years for term in MAIN_TERMS]
+    # Fewer students in later periods
+    scale = np.tile([900, 700, 500, 400, 450], len(JP_DAYNAMES))[:, None]
+    return [
+        pd.DataFrame(
+            (scale * rng.uniform(0.3, 1.4, size=(len(index), len(columns)))).astype("int"),
+            index=index, columns=columns
+        )
+        for _ in range(n_stores)
+    ]
+
+
+#-----------------------------------------POS data-----------------------------------------
+
+def get_daily_means(df_cal: pd.DataFrame, syllabuses: list[pd.DataFrame], scale: float) -> np.ndarray:
+    """
+    Return the mean number of checkouts of each date (rows of `df_cal`) and store (columns).\\
+    On class days the mean follows the enrolment of the 1st to 3rd periods of the day relative to the term,
+    so that the forecast page finds a relation between syllabus data and customers.
+    Stores are closed on weekends and holidays.
+    """
+    n_stores = len(syllabuses)
+    base = np.array([BASE_CUSTOMERS[i] if i < len(BASE_CUSTOMERS) else 150 for i in range(n_stores)], dtype="float")
+    means = np.zeros((len(df_cal), n_stores))
+    weekday = df_cal["date"].dt.weekday.to_numpy()
+    closed = (weekday >= 5) | (df_cal["info"] == "Holiday").to_numpy()
+    cls = df_cal["class"].to_numpy()
+    for s, df_syl in enumerate(syllabuses):
+        lunch = df_syl.loc[(slice(None), [1, 2, 3]), :].groupby(level="曜日", sort=False).sum()
+        relative = lunch / lunch.mean(axis="index")
+        factor = np.full(len(df_cal), 0.25)
+        factor[cls == "IntCourse"] = 0.45
+        for i in np.flatnonzero(np.isin(cls, EN_DAYNAMES)):
+            column = f"{df_cal['academic_year'].iat[i]}{df_cal['term'].iat[i]}"
+            factor[i] = relative.loc[JP_DAYNAMES[weekday[i]], column]
+        means[:, s] = np.where(closed, 0, base[s] * factor * scale)
+    return means
+
+
+def format_datetime(seconds: np.ndarray) -> np.ndarray:
+    """
+    Format seconds from 1970-01-01 in the style of Ubiregi ("2024-04-01 12:00:00 +0900").
+    """
+    return (pd.to_datetime(seconds, unit="s").strftime("%Y-%m-%d %H:%M:%S") + " +0900").to_numpy()
+
+
+def generate_pos(rng: np.random.Generator, dates: pd.DatetimeIndex, means: np.ndarray, first_id: int) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Return checkouts, items, and payments of the dates in the format exported by Ubiregi.\\
+    `means` has the mean number of checkouts of each date and store, and checkout IDs start from `first_id`.
+    The data include what `cleanup_pos()` removes:
+    cancelled checkouts (about 1%), items with negative quantities (about 0.2%),
+    and rows of payments without a method (changes of payment, about 1%).
+    About 3% of checkouts are paid by two methods.
+    Some items have blank cells, as in the real exports:
+    items entered by hand at the register have no SKU or barcode (about 1%), and a few have no department (about 0.5%).
+    """
+    counts = rng.poisson(means)
+    n = int(counts.sum())
+    day_index = np.repeat(np.repeat(np.arange(len(dates)), means.shape[1]), counts.ravel())
+    store_index = np.repeat(np.tile(np.arange(means.shape[1]), len(dates)), counts.ravel())
+    accounts = np.array(ACCOUNTS + [f"ub3962{10 + i}" for i in range(max(means.shape[1] - len(ACCOUNTS), 0))])
+    # Arrivals around lunch and dinner
+    lunch = rng.random(n) < 0.85
+    minutes = np.where(
+        lunch,
+        np.clip(rng.normal(12.5 * 60, 35, n), 10 * 60 + 50, 14 * 60 + 10),
+        np.clip(rng.normal(18.5 * 60, 25, n), 17 * 60 + 20, 19 * 60 + 40)
+    )
+    day_seconds = dates.to_numpy(dtype="datetime64[s]").astype("int64")
+    start = day_seconds[day_index] + (minutes * 60).astype("int64") + rng.integers(0, 60, n)
+    # Durations of checkouts, with a few left open
+    duration = rng.gamma(3, 15, n).astype("int64") + np.where(rng.random(n) < 0.005, 1200, 0)
+    end = start + duration
+    ids = np.arange(first_id, first_id + n)
+    # Items of each checkout
+    n_items = 1 + rng.binomial(2, 0.35, n)
+    item_ids = np.repeat(ids, n_items)
+    picks = rng.choice(len(CATALOG), size=len(item_ids), p=WEIGHTS / WEIGHTS.sum())
+    quantity = 1 + (rng.random(len(item_ids)) < 0.1)
+    quantity = np.where(rng.random(len(item_ids)) < 0.002, -quantity, quantity)
+    prices = np.array([c[2] for c in CATALOG])[picks]
+    amount_items = prices * quantity
+    amount = np.bincount(np.repeat(np.arange(n), n_items), weights=amount_items, minlength=n).astype("int64")
+    deleted = np.where(rng.random(n) < 0.01, format_datetime(end + rng.integers(60, 600, n)), None)
+    df_checkouts = pd.DataFrame({
+        "アカウント名": accounts[store_index],
+        "会計ID": ids,
+        "開始日時": format_datetime(start),
+        "会計日時": format_datetime(end),
+        "削除日時": deleted,
+        "金額": amount,
+        "客数": 1 + (rng.random(n) < 0.05)
+    })
+    catalog = np.array(CATALOG, dtype="object")[picks]
+    by_hand = rng.random(len(item_ids)) < 0.01
+    no_department = rng.random(len(item_ids)) < 0.005
+    df_items = pd.DataFrame({
+        "会計ID": item_ids,
+        "SKU": np.where(by_hand, None, catalog[:, 3]),
+        "バーコード": np.where(by_hand, None, catalog[:, 4]),
+        "名前": catalog[:, 0],
+        "数量": quantity,
+        "金額": amount_items,
+        "部門": np.where(no_department, None, catalog[:, 1])
+    })
+    # Payments: one method per checkout, a second method for split payments, and changes of payment without a method
+    method = rng.choice(len(PAYMENT_METHODS), size=n, p=PAYMENT_WEIGHTS)
+    split = rng.random(n) < 0.03
+    second = (method + rng.integers(1, len(PAYMENT_METHODS), n)) % len(PAYMENT_METHODS)
+    paid_first = np.where(split, amount // 2, amount)
+    change = rng.random(n) < 0.01
+    methods = np.array(PAYMENT_METHODS, dtype="object")
+    df_payments = pd.concat([
+        pd.DataFrame({"会計ID": ids, "支払い方法": methods[method], "金額": paid_first}),
+        pd.DataFrame({"会計ID": ids[split], "支払い方法": methods[second[split]], "金額": (amount - paid_first)[split]}),
+        pd.DataFrame({"会計ID": ids[change], "支払い方法": None, "金額": 0})
+    ], axis="index", ignore_index=True).sort_values("会計ID", kind="stable")
+    return df_checkouts, df_items, df_payments
+
+
+def write_zip(path, df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> None:
+    """
+    Write the DataFrames into a ZIP file of Shift-JIS CSVs, in the same layout as the exports of Ubiregi.\\
+    `path` may also be a file object (ex. `io.BytesIO`).
+    """
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("checkouts.csv", to_csv_shift_jis(df_checkouts, index_flag=False))
+        zf.writestr("items.csv", to_csv_shift_jis(df_items, index_flag=False))
+        zf.writestr("payments.csv", to_csv_shift_jis(df_payments, index_flag=False))
+
+
+def generate_months(start: str, days: int, stores: int = 2, scale: float = 1.0, seed: int = 0) -> tuple:
+    """
+    Return the calendar data, the syllabus data of each store,
+    and an iterator of the months with their checkouts, items, and payments (see `generate_pos()`).\\
+    The POS data of a month is generated only when the iterator reaches it.
+    """
+    rng = np.random.default_rng(seed)
+    first = pd.Timestamp(start)
+    last = first + pd.Timedelta(days=days - 1)
+    df_cal = make_calendar(first, last)
+    syllabuses = make_syllabus(rng, sorted(df_cal["academic_year"].unique().tolist()), stores)
+    means = get_daily_means(df_cal, syllabuses, scale)
+    in_range = ((first <= df_cal["date"]) & (df_cal["date"] <= last)).to_numpy()
+    months = df_cal.loc[in_range, "date"].dt.to_period("M")
+
+    def iterate():
+        next_id = 10_000_000
+        for month in months.unique():
+            rows = months.index[months == month]
+            frames = generate_pos(rng, pd.DatetimeIndex(df_cal.loc[rows, "date"]), means[rows], next_id)
+            next_id += len(frames[0])
+            yield month, frames
+
+    return df_cal, syllabuses, iterate()
+
+
+def generate_zips(start: str, days: int, stores: int = 2, scale: float = 1.0, seed: int = 0) -> list[io.BytesIO]:
+    """
+    Return the POS data of `generate()` as ZIP files per month in memory, ex. for the sample data of the upload page.
+    """
+    zips = []
+    for _, frames in generate_months(start, days, stores, scale, seed)[2]:
+        buffer = io.BytesIO()
+        write_zip(buffer, *frames)
+        buffer.seek(0)
+        zips.append(buffer)
+    return zips
+
+
+def generate(out: str, start: str, days: int, stores: int = 2, scale: float = 1.0, seed: int = 0) -> list[str]:
+    """
+    Write synthetic data of `stores` stores for `days` days from `start` into the directory `out`:
+    a ZIP file of POS data per month ("pos-YYYY-MM.zip"), "calendar.xlsx", and "syllabus.xlsx"
+    (sheets "west" and "east" for the first two stores, and "store3", ... for the others).\\
+    Months are generated one at a time, so the memory used does not grow with `days`.
+    Return the paths of the written files.
+    """
+    os.makedirs(out, exist_ok=True)
+    df_cal, syllabuses, months = generate_months(start, days, stores, scale, seed)
+    paths = []
+    for month, frames in months:
+        path = os.path.join(out, f"pos-{month}.zip")
+        write_zip(path, *frames)
+        paths.append(path)
+    path = os.path.join(out, "calendar.xlsx")
+    df_cal.to_excel(path, index=False)
+    paths.append(path)
+    path = os.path.join(out, "syllabus.xlsx")
+    with pd.ExcelWriter(path) as writer:
+        for s, df_syl in enumerate(syllabuses):
+            sheet = ["west", "east"][s] if s < 2 else f"store{s + 1}"
+            df_syl.to_excel(writer, sheet_name=sheet)
+    paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Ubiregi exports with calendar and syllabus data.")
+    parser.add_argument("--out", default="data/synthetic", help="output directory")
+    parser.add_argument("--start", default="2024-04-01", help="first date (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=365, help="number of days")
+    parser.add_argument("--stores", type=int, default=2, help="number of stores")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of the number of checkouts per day")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random numbers")
+    args = parser.parse_args()
+    for path in generate(args.out, args.start, args.days, args.stores, args.scale, args.seed):
+        print(path)
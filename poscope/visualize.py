@@ -0,0 +1,372 @@
+"""
+Data processing of the visualize page: filtering by the options and shaping the data for the charts.\\
+The functions take the data and the options as arguments instead of reading session state,
+so this module does not depend on Streamlit and can be imported quickly and driven from batch jobs.
+"""
+import datetime
+import numpy as np
+import pandas as pd
+
+from poscope import bands, registry
+from poscope.instrument import instrument
+
+
+#-----------------------------------------Universal-----------------------------------------
+
+def between_business_hours(df: pd.DataFrame | pd.Series, business_hours: str) -> pd.DataFrame | pd.Series:
+    """
+    Keep the rows of the DataFrame or Series indexed by datetime within the business hours.\\
+    Used for the bins of resampled data, which have no column of "時間帯".
+    "昼・夜" covers 11:00-19:30 including the time between lunch and dinner.
+    """
+    return df.between_time(*bands.get_time_range(business_hours))
+
+
+def filter_pos(df: pd.DataFrame, date: tuple[datetime.date], business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Filter the DataFrame of customers or items by date, business hours, and store.\\
+    When `store` is `registry.ALL_STORES`, the data of all stores is kept.
+    Business hours are compared with the codes of "時間帯" derived at cleanup, so the DataFrame is not indexed again.
+    """
+    left_date = pd.Timestamp(date[0])
+    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
+    df = df[(left_date <= df["開始日時"]) & (df["開始日時"] < right_date)]
+    if store != registry.ALL_STORES:
+        df = df[df["アカウント名"] == store]
+    # A fresh index as before, since `groupby().resample(on=...)` fails on the positions of the unfiltered DataFrame
+    return bands.filter_business_hours(df, business_hours).reset_index(drop=True)
+
+
+def sum_per_day(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """
+    Return the daily sums of `column` with a column per store ("アカウント名").\\
+    `df` may be the filtered records or the totals per store and day aggregated in the local database.
+    """
+    df = df.groupby("アカウント名").resample("1D", on="開始日時")[column].sum()
+    df = df.to_frame().unstack(level=0)
+    df.columns = df.columns.droplevel(0)
+    return df
+
+
+def calendar_hover(dates: pd.Index, df_dim: pd.DataFrame | None) -> list[str]:
+    """
+    Return the hover text of the calendar data of each date, looked up by reindexing the calendar dimension
+    built by `ingest.build_calendar_dim()`.\\
+    The text is empty for the dates out of the calendar, and for all dates when `df_dim` is `None`.
+    """
+    if df_dim is None:
+        return [""] * len(dates)
+    return df_dim["hover"].reindex(dates).fillna("").tolist()
+
+
+#---Number of customers by time of day---
+
+def resample_customers(df_cus: pd.DataFrame, span: str) -> pd.Series:
+    """
+    Return the number of customers per `span` (ex. "10min") indexed by the start of each bin.
+    """
+    return df_cus.resample(span, on="開始日時")["客数"].sum()
+
+
+def customers_by_time(counts: pd.Series, business_hours: str) -> pd.DataFrame:
+    """
+    Shape the number of customers per span into a DataFrame of time of day ("HH:MM") × date.\\
+    Business hours are applied here, after resampling, to keep the bins of the last span.
+    Return an empty DataFrame if there is no customer.
+    """
+    counts = between_business_hours(counts, business_hours)
+    # If the sum of customers is zero, there is nothing to visualize, so return an empty DataFrame
+    if counts.sum() == 0:
+        return pd.DataFrame()
+    df_cus = counts.to_frame()
+    df_cus["日付"] = df_cus.index.date
+    df_cus["時間"] = df_cus.index.time
+    df_cus = df_cus.set_index(["日付", "時間"])
+    df_cus = df_cus.unstack(level=0)
+    df_cus.index = list(map(lambda x: x.strftime("%H:%M"), df_cus.index))
+    df_cus.columns = df_cus.columns.droplevel(0)
+    return df_cus
+
+
+#---------Ratio of payment methods---------
+
+def payment_methods(df_cus: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the total number of customers of each payment method.\\
+    It does not exclude records with multiple payment methods,
+    so the sum of the total counts is not necessarily equal to the total number of customers.
+    """
+    pms = list(set(df_cus.columns) - set(["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数"] + bands.TIME_COLUMNS))
+    df_pm = df_cus[pms] * df_cus["客数"].values.reshape(-1, 1)
+    df_pm = df_pm.sum(axis="index").to_frame(name="合計利用者数").reset_index(names=["支払い方法"])
+    return df_pm
+
+
+#--------------Sales by item---------------
+
+def select_items(df_itm: pd.DataFrame, column: str, value: str) -> pd.DataFrame:
+    """
+    Return the items whose `column` ("名前", "SKU", "部門", ...) is `value`.
+    """
+    # `resample(on=...)` after `groupby()` requires a default index
+    return df_itm[df_itm[column] == value].reset_index(drop=True)
+
+
+def item_candidates(df_itm: pd.DataFrame, column: str) -> list[str]:
+    """
+    Return the distinct values of `column` in the items, except the missing ones.
+    """
+    return df_itm[column].dropna().unique().tolist()
+
+
+#------------Co-purchase analysis------------
+
+def basket(df_itm: pd.DataFrame, method: str) -> tuple[pd.DataFrame, pd.Series, int]:
+    """
+    Return the co-purchase statistics of item pairs, the number of checkouts containing each item,
+    and the total number of checkouts.\\
+    Each checkout ("会計ID") is a row and each item (or department) is a column of a sparse binary matrix,
+    so the co-occurrence counts are obtained by a sparse product without materializing a dense matrix.
+    """
+    # scipy is imported only when the co-purchase analysis is shown
+    from scipy import sparse
+    if df_itm.empty:
+        return pd.DataFrame(), pd.Series(dtype="int"), 0
+    # Transaction x item binary matrix (duplicates are summed by `tocsr()`, then binarized)
+    tx_codes, _ = pd.factorize(df_itm["会計ID"])
+    item_codes, items = pd.factorize(df_itm[method])
+    n_tx, n_items = tx_codes.max() + 1, len(items)
+    # Items without the value (ex. no "部門", code -1) are left out of the pairs, while their checkouts are still counted
+    known = item_codes >= 0
+    matrix = sparse.coo_matrix(
+        (np.ones(known.sum(), dtype="int32"), (tx_codes[known], item_codes[known])),
+        shape=(n_tx, n_items)
+    ).tocsr()
+    matrix.data[:] = 1
+    # Number of checkouts containing each item, and co-occurrence counts of each pair of items
+    support = np.asarray(matrix.sum(axis=0)).ravel()
+    cooc = sparse.triu(matrix.T @ matrix, k=1).tocoo()
+    if cooc.nnz == 0:
+        return pd.DataFrame(), pd.Series(support, index=items).sort_values(ascending=False), n_tx
+    count_a = support[cooc.row]
+    count_b = support[cooc.col]
+    df_pairs = pd.DataFrame({
+        "商品A": items[cooc.row],
+        "商品B": items[cooc.col],
+        "同時購入数": cooc.data,
+        "支持度": cooc.data / n_tx,
+        "信頼度（A→B）": cooc.data / count_a,
+        "信頼度（B→A）": cooc.data / count_b,
+        "リフト": cooc.data * n_tx / (count_a * count_b)
+    })
+    df_pairs = df_pairs.sort_values(["同時購入数", "リフト"], ascending=False, ignore_index=True)
+    return df_pairs, pd.Series(support, index=items).sort_values(ascending=False), n_tx
+
+
+@instrument
+def process_basket_anchor(df_pairs: pd.DataFrame, anchor: str, min_count: int) -> pd.DataFrame:
+    """
+    Return items purchased together with `anchor`, oriented so that the confidence is P(item | anchor).\\
+    Pairs with fewer co-purchases than `min_count` are excluded.
+    """
+    if df_pairs.empty:
+        return pd.DataFrame()
+    df_pairs = df_pairs[df_pairs["同時購入数"] >= min_count]
+    left = df_pairs[df_pairs["商品A"] == anchor]
+    right = df_pairs[df_pairs["商品B"] == anchor]
+    df_anchor = pd.concat([
+        pd.DataFrame({
+            "商品": left["商品B"],
+            "同時購入数": left["同時購入数"],
+            "信頼度": left["信頼度（A→B）"],
+            "リフト": left["リフト"]
+        }),
+        pd.DataFrame({
+            "商品": right["商品A"],
+            "同時購入数": right["同時購入数"],
+            "信頼度": right["信頼度（B→A）"],
+            "リフト": right["リフト"]
+        })
+    ], axis="index")
+    return df_anchor.sort_values("信頼度", ascending=False, ignore_index=True)
+
+
+#--------Checkout load and duration--------
+
+def checkout_queue(df_load: pd.DataFrame, df_dur: pd.DataFrame, date: tuple[datetime.date],
+                   business_hours: str, store: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Slice the checkout load and duration precomputed at upload by date, business hours, and store.\\
+    Return a DataFrame of the average and maximum number of concurrent checkouts by time of day,
+    and a DataFrame of the ratio of checkout durations by 10-minute slot.\\
+    When all stores are selected, the load of all stores is added up.
+    Days without any checkout in the selected business hours (ex. holidays) are excluded.
+    If no valid data is found, return empty DataFrames.
+    """
+    left_date = pd.Timestamp(date[0])
+    right_date = pd.Timestamp(date[1])
+    # Business hours as minutes of the day
+    left_min, right_min = (seconds // 60 for seconds in bands.get_seconds_range(business_hours))
+    if store != registry.ALL_STORES:
+        df_load = df_load[df_load["アカウント名"] == store]
+        df_dur = df_dur[df_dur["アカウント名"] == store]
+    df_load = df_load[
+        (left_date <= df_load["日付"]) & (df_load["日付"] <= right_date) &
+        (left_min <= df_load["時刻"]) & (df_load["時刻"] <= right_min)
+    ]
+    df_dur = df_dur[
+        (left_date <= df_dur["日付"]) & (df_dur["日付"] <= right_date) &
+        (left_min <= df_dur["スロット"]) & (df_dur["スロット"] <= right_min)
+    ]
+    if df_load.empty or df_dur.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    # Add up the stores, then exclude days without any checkout
+    df_load = df_load.groupby(["日付", "時刻"])[["到着数", "平均同時会計数"]].sum().reset_index()
+    arrivals = df_load.groupby("日付")["到着数"].sum()
+    df_load = df_load[df_load["日付"].isin(arrivals[arrivals > 0].index)]
+    df_load = df_load.groupby("時刻")["平均同時会計数"].agg(["mean", "max"])
+    df_load.columns = ["平均", "最大"]
+    df_load.index = [f"{m // 60:02d}:{m % 60:02d}" for m in df_load.index]
+    df_dur = df_dur.pivot_table(index="スロット", columns="所要時間", values="会計数", aggfunc="sum", fill_value=0, observed=False)
+    df_dur = df_dur.div(df_dur.sum(axis="columns"), axis="index")
+    df_dur.index = [f"{m // 60:02d}:{m % 60:02d}" for m in df_dur.index]
+    return df_load, df_dur
+
+
+#-------------Revenue analysis-------------
+
+def slice_sales_cube(df_cube: pd.DataFrame, date: tuple[datetime.date], business_hours: str, store: str) -> pd.DataFrame:
+    """
+    Slice the sales cube precomputed at upload by date, business hours, and store.
+    """
+    left_date = pd.Timestamp(date[0])
+    right_date = pd.Timestamp(date[1])
+    # "昼・夜" covers 11:00-19:30 including the time between lunch and dinner
+    first, last = bands.get_code_range(business_hours)
+    codes = df_cube["時間帯"].cat.codes
+    mask = (left_date <= df_cube["日付"]) & (df_cube["日付"] <= right_date) & (first <= codes) & (codes <= last)
+    if store != registry.ALL_STORES:
+        mask &= df_cube["アカウント名"] == store
+    return df_cube[mask]
+
+
+def revenue(df_cube: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return a DataFrame of daily sales, average sales per checkout, and sales per customer of each store,
+    and a DataFrame of sales by department, both from the (sliced) sales cube.\\
+    If no valid data is found, return empty DataFrames.
+    """
+    if df_cube.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    # Daily totals of checkouts
+    df_day = df_cube[df_cube["部門"] == "（全体）"].groupby(["日付", "アカウント名"], observed=True)[["金額", "会計数", "客数"]].sum()
+    df_day = df_day.unstack(level=1)
+    df_rev = pd.concat(
+        {
+            "売上": df_day["金額"],
+            "客単価": df_day["金額"] / df_day["会計数"],
+            "客1人当たり売上": df_day["金額"] / df_day["客数"]
+        },
+        axis="columns"
+    )
+    df_rev.columns = [f"{metric}_{store}" for metric, store in df_rev.columns]
+    # Sales by department
+    df_dep = df_cube[df_cube["部門"] != "（全体）"].groupby("部門", observed=True)[["金額", "数量", "会計数"]].sum()
+    df_dep = df_dep[df_dep["金額"] != 0].sort_values("金額", ascending=False)
+    df_dep["構成比"] = df_dep["金額"] / df_dep["金額"].sum()
+    return df_rev, df_dep
+
+
+#---------------Syllabus data---------------
+
+def syllabus_years(terms: list[str]) -> list[str]:
+    """
+    Return the academic years ("2024年度", ...) of the terms of the syllabus data.
+    """
+    years = sorted(set(int(term[:4]) for term in terms))
+    return [str(year) + "年度" for year in years]
+
+
+def syllabus_by_weekday(cube: np.ndarray, terms: list[str], class_period: list[str], year: list[str]) -> list[pd.DataFrame]:
+    """
+    Slice the syllabus array (campus × weekday × period × term) by the periods ("1限", ...) and the academic years ("2024年度", ...)
+    and return a list of west and east DataFrames of weekday × term.\\
+    Terms without data on each campus are not included in the columns.
+    If no valid data is found, return a list of empty DataFrames.
+    """
+    if class_period == [] or year == []:
+        return [pd.DataFrame()] * 2
+    period_idx = [int(cp[0]) - 1 for cp in class_period]
+    year_num = [y[:4] for y in year]
+    term_idx = [i for i, term in enumerate(terms) if term[:4] in year_num]
+    # Sum over the selected periods: campus × weekday × term
+    week = np.nansum(cube[:, :, period_idx, :][:, :, :, term_idx], axis=2)
+    # All-NaN terms are missing on each campus: campus × term
+    availables = ~np.isnan(cube[:, :, :, term_idx]).all(axis=(1, 2))
+    dfs = []
+    for n_campus in range(2):
+        available = availables[n_campus]
+        dfs.append(pd.DataFrame(
+            week[n_campus][:, available],
+            index=pd.Index(["月", "火", "水", "木", "金"], name="曜日"),
+            columns=[terms[i] for i, flag in zip(term_idx, available) if flag]
+        ))
+    return dfs
+
+
+def syllabus_traffic(cube: np.ndarray, terms: list[str], df_dim: pd.DataFrame, df_cube: pd.DataFrame,
+                     class_period: list[str], year: list[str]) -> dict[str, pd.DataFrame]:
+    """
+    Join the syllabus data with the number of customers at lunch (11:00-14:00) for each term,
+    and return a DataFrame for each store with a campus in the registry, matched with the syllabus data of the campus.\\
+    `df_dim` is the calendar dimension built by `ingest.build_calendar_dim()`, indexed by date.\\
+    Each class day is matched with the number of students of the selected periods on its weekday ("class" in the calendar data),
+    so the number of customers per student is the sum of customers divided by the sum of students over the class days of the term.\\
+    Days without POS data are excluded. If no valid data is found for a store, its DataFrame is empty.
+    """
+    campus_stores = [store for store in registry.store_names() if registry.store_campus(store) is not None]
+    if class_period == [] or year == []:
+        return {store: pd.DataFrame() for store in campus_stores}
+    period_idx = [int(cp[0]) - 1 for cp in class_period]
+    year_num = [y[:4] for y in year]
+    en_daynames = ["MON", "TUE", "WED", "THU", "FRI"]
+    # Class days of the selected years
+    df_cal = df_dim[
+        df_dim["term"].isin(["SPR", "SMR", "AUT", "WTR"]) &
+        df_dim["class"].isin(en_daynames) &
+        df_dim["academic_year"].astype(str).isin(year_num)
+    ]
+    term_labels = df_cal["academic_year"].astype(str) + df_cal["term"]
+    term_idx = pd.Index(terms).get_indexer(term_labels)
+    day_idx = pd.Index(en_daynames).get_indexer(df_cal["class"])
+    # Number of students of each class day: campus × day
+    students = np.nansum(cube[:, :, period_idx, :], axis=2)[:, day_idx, term_idx]
+    missing = np.isnan(cube).all(axis=(1, 2))[:, term_idx]
+    students[missing | (term_idx == -1)] = np.nan
+    # Number of customers at lunch of each class day
+    lunch, _ = bands.get_code_range(bands.lunch_hours())
+    df_lunch = df_cube[(df_cube["部門"] == "（全体）") & (df_cube["時間帯"].cat.codes == lunch)]
+    df_lunch = df_lunch.groupby(["日付", "アカウント名"], observed=True)["客数"].sum().unstack(level=1)
+    dfs = {}
+    for store in campus_stores:
+        if store not in df_lunch.columns:
+            dfs[store] = pd.DataFrame()
+            continue
+        n_campus = list(registry.CAMPUSES).index(registry.store_campus(store))
+        df = pd.DataFrame({
+            "学期": term_labels.to_numpy(),
+            "履修者数": students[n_campus],
+            "客数": df_lunch[store].reindex(df_cal.index).to_numpy()
+        }).dropna()
+        df = df[df["客数"] > 0]
+        if df.empty:
+            dfs[store] = pd.DataFrame()
+            continue
+        df = df.groupby("学期", sort=False).agg(
+            授業日数=("客数", "size"), 履修者数=("履修者数", "sum"), 客数=("客数", "sum")
+        )
+        df["履修者1人当たり客数"] = df["客数"] / df["履修者数"]
+        df["1日平均履修者数"] = df["履修者数"] / df["授業日数"]
+        df["1日平均客数"] = df["客数"] / df["授業日数"]
+        dfs[store] = df.reindex(index=[term for term in terms if term in df.index])
+    return dfs
@@ -0,0 +1,202 @@
+"""
+Ingestion of the zip files exported from Ubiregi into a watched folder.\\
+Each new zip file is parsed and cleaned up by a background job and appended to the Arrow dataset
+(and to the local database when it is enabled). The version of the dataset changes at every write,
+so the pages pick up the fresh data without uploading the whole history again.\\
+The folder is watched by the app when `POSCOPE_WATCH_DIR` is set, or in the foreground by `python -m poscope.watcher`.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+from poscope import jobs
+
+
+# The folder is watched only when this environment variable is set to its path
+WATCH_DIR_ENV = "POSCOPE_WATCH_DIR"
+# File in the directory of the dataset recording the size and modification time of the zip files already ingested
+LEDGER_FILE = "watched.json"
+# A zip file may still be being copied when it is detected,
+# so it is read once its size and modification time have not changed for this many seconds
+SETTLE_SECONDS = 2.0
+# A zip file still changing after this many seconds is given up
+SETTLE_TIMEOUT = 600.0
+
+# Paths of the zip files whose jobs are queued or running
+_pending: set[str] = set()
+_lock = threading.Lock()
+_logger = logging.getLogger(__name__)
+
+
+def get_watch_dir() -> str | None:
+    """
+    Return the watched folder, or `None` if the folder is not watched.
+    """
+    directory = os.environ.get(WATCH_DIR_ENV, "")
+    return directory if directory else None
+
+
+def get_stamp(path: str) -> list[int]:
+    """
+    Return the size and the modification time of the file, which identify its contents in the ledger.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_ledger(dataset_dir: str) -> dict[str, list[int]]:
+    """
+    Return the stamps of the zip files already ingested into the dataset, by file name.
+    """
+    try:
+        with open(os.path.join(dataset_dir, LEDGER_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_ingested(dataset_dir: str, name: str, stamp: list[int]) -> None:
+    """
+    Record the zip file in the ledger. The file is replaced atomically.
+    """
+    with _lock:
+        ledger = load_ledger(dataset_dir)
+        ledger[name] = stamp
+        os.makedirs(dataset_dir, exist_ok=True)
+        path = os.path.join(dataset_dir, LEDGER_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(ledger, f, ensure_ascii=False, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+def wait_until_settled(path: str) -> list[int]:
+    """
+    Wait until the file has not changed for `SETTLE_SECONDS` and return its stamp.
+    """
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    stamp = get_stamp(path)
+    while True:
+        time.sleep(SETTLE_SECONDS)
+        current = get_stamp(path)
+        if current == stamp:
+            return stamp
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{path} is still being written after {SETTLE_TIMEOUT:.0f} seconds")
+        stamp = current
+
+
+def ingest_zip_job(path: str, dataset_dir: str, progress=jobs.no_progress) -> dict | None:
+    """
+    Background job to append the zip file to the dataset.\\
+    Return the file name and the number of checkouts ingested, or `None` if the file has already been ingested.
+    """
+    # pandas and pyarrow are loaded by the first job instead of by the app shell
+    from poscope import database, dataset, ingest
+    name = os.path.basename(path)
+    try:
+        progress(0.0, f"{name}の書き込みが終わるのを待っています...")
+        stamp = wait_until_settled(path)
+        if load_ledger(dataset_dir).get(name) == stamp:
+            return None
+        with open(path, "rb") as f:
+            df_checkouts, df_items, df_payments = ingest.read_pos_zips([f], jobs.sub_progress(progress, 0.1, 0.5))
+        n_checkouts = 0
+        if df_checkouts.shape[0] > 0:
+            progress(0.5, f"{len(df_checkouts):,}件の会計データをクリーニングしています...")
+            df_cus, df_itm = ingest.cleanup_pos(df_checkouts, df_items, df_payments)
+            n_checkouts = len(df_cus)
+            if n_checkouts > 0:
+                progress(0.7, "Arrowデータセットに追加しています...")
+                dataset.write_pos(dataset_dir, df_cus, df_itm)
+                if database.get_db_path() is not None:
+                    progress(0.9, "ローカルデータベースに書き込んでいます...")
+                    database.write_pos(database.get_db_path(), df_cus, df_itm)
+        record_ingested(dataset_dir, name, stamp)
+        _logger.info("Ingested %d checkouts from %s", n_checkouts, path)
+        return {"file": name, "checkouts": n_checkouts}
+    finally:
+        with _lock:
+            _pending.discard(path)
+
+
+def schedule(path: str, dataset_dir: str) -> None:
+    """
+    Submit the job to ingest the zip file unless one is already queued or running for it.\\
+    The jobs run one at a time in the pool of the watcher, since the writes to the dataset are serialized anyway.
+    """
+    if not path.lower().endswith(".zip"):
+        return
+    path = os.path.abspath(path)
+    with _lock:
+        if path in _pending:
+            return
+        _pending.add(path)
+    jobs.submit(f"フォルダからの取り込み（{os.path.basename(path)}）", ingest_zip_job, path, dataset_dir, pool="watcher")
+
+
+class ZipHandler(FileSystemEventHandler):
+    """
+    Handler of the events of the watched folder, which schedules the zip files created, written, or moved into it.
+    """
+    def __init__(self, dataset_dir: str):
+        super().__init__()
+        self.dataset_dir = dataset_dir
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            schedule(event.src_path, self.dataset_dir)
+
+    def on_modified(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            schedule(event.src_path, self.dataset_dir)
+
+    def on_moved(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            schedule(event.dest_path, self.dataset_dir)
+
+
+def start(watch_dir: str, dataset_dir: str) -> Observer:
+    """
+    Start watching the folder in a daemon thread and return the observer.\\
+    The zip files already in the folder but not in the ledger (ex. dropped while the app was stopped) are scheduled as well.
+    """
+    observer = Observer()
+    observer.schedule(ZipHandler(dataset_dir), watch_dir, recursive=False)
+    observer.daemon = True
+    observer.start()
+    # Scanned after the observer has started, so that no file dropped in between is missed
+    ledger = load_ledger(dataset_dir)
+    for name in sorted(os.listdir(watch_dir)):
+        path = os.path.join(watch_dir, name)
+        if os.path.isfile(path) and ledger.get(name) != get_stamp(path):
+            schedule(path, dataset_dir)
+    _logger.info("Watching %s for zip files", watch_dir)
+    return observer
+
+
+def main() -> None:
+    """
+    Watch the folder of `POSCOPE_WATCH_DIR` in the foreground until interrupted.\\
+    The Arrow dataset must be enabled by `POSCOPE_DATASET_DIR`.
+    Uploads in the app should not write the dataset at the same time, since writes are serialized only within a process.
+    """
+    from poscope import dataset
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    watch_dir, dataset_dir = get_watch_dir(), dataset.get_dataset_dir()
+    if watch_dir is None or dataset_dir is None:
+        raise SystemExit(f"Set {WATCH_DIR_ENV} and {dataset.DATASET_DIR_ENV} to watch the folder.")
+    observer = start(watch_dir, dataset_dir)
+    try:
+        while observer.is_alive():
+            observer.join(1.0)
+    except KeyboardInterrupt:
+        observer.stop()
+    observer.join()
+
+
+if __name__ == "__main__":
+    main()
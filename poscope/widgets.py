@@ -0,0 +1,139 @@
+import streamlit as st
+import pandas as pd
+
+from poscope import instrument, jobs
+from poscope.export import FORMATS, export_dataframe
+
+
+def download_dataframe(df: pd.DataFrame, index_flag: bool, file_name: str, key: str) -> None:
+    """
+    Show a selector of the file format and a button to create the file for download.\\
+    The file is created only when the button is clicked, and the download button is shown in that run only.
+    Since the download button does not rerun the script (`on_click="ignore"`),
+    the created file is released at the next rerun instead of being kept in memory.\\
+    `file_name` is given without the extension.
+    """
+    col1, col2 = st.columns(2, vertical_alignment="bottom")
+    with col1:
+        fmt = st.selectbox(
+            label=":material/description: 形式", 
+            options=list(FORMATS.keys()), 
+            format_func=lambda x: FORMATS[x][0], 
+            index=0, 
+            key=f"{key}_format", 
+            help="CSVはShift-JISで出力されます。"
+        )
+    with col2:
+        prepare = st.button(
+            label=":material/build: ダウンロード用のファイルを作成", 
+            key=f"{key}_prepare", 
+            disabled=df.empty
+        )
+    if prepare:
+        label, extension, mime = FORMATS[fmt]
+        try:
+            with st.spinner("ファイルを作成しています...", show_time=True):
+                data = export_dataframe(df, fmt, index_flag)
+        except UnicodeEncodeError:
+            st.error(
+                """
+                Shift-JISで表せない文字が含まれているため、CSVファイルを作成できませんでした。\\
+                ParquetまたはExcel形式をお試しください。
+                """
+            )
+            return
+        st.download_button(
+            label=f":material/download: `{extension}`でダウンロード", 
+            data=data, 
+            file_name=file_name + extension, 
+            mime=mime, 
+            key=f"{key}_download", 
+            on_click="ignore"
+        )
+
+
+def start_job(key: str, name: str, func, *args) -> None:
+    """
+    Submit `func` as a background job and track it in the session under `key`.\\
+    The ID is also kept in the query parameters of the URL, so the job is picked up again after a reload of the browser.
+    """
+    job_id = jobs.submit(name, func, *args)
+    st.session_state[f"job_{key}"] = job_id
+    st.query_params[f"job_{key}"] = job_id
+
+
+def stop_tracking_job(key: str) -> None:
+    """
+    Stop tracking the job `key` in the session.
+    """
+    st.session_state.pop(f"job_{key}", None)
+    if f"job_{key}" in st.query_params:
+        del st.query_params[f"job_{key}"]
+
+
+@st.fragment(run_every=0.5)
+def job_progress(job_id: str) -> None:
+    """
+    Show the progress of the job, refreshed every 0.5 seconds without rerunning the page.\\
+    When the job has finished, rerun the whole app so that the page picks up the result.
+    """
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        st.rerun()
+    text = job["message"] or ("順番を待っています..." if job["status"] == "queued" else "処理しています...")
+    st.progress(job["progress"], text=f"{job['name']}：{text}")
+
+
+def finished_job(key: str) -> dict | None:
+    """
+    Return the job `key` of the session with its result if it has finished, and stop tracking it.\\
+    While it is queued or running, show its progress and return `None`.
+    Return `None` as well if no job is tracked, the job is unknown (ex. the server has been restarted),
+    or its result has been collected already.
+    """
+    job_id = st.session_state.get(f"job_{key}", st.query_params.get(f"job_{key}"))
+    if job_id is None:
+        return None
+    job = jobs.get_job(job_id)
+    if job is None:
+        stop_tracking_job(key)
+        return None
+    if job["status"] in ("queued", "running"):
+        job_progress(job_id)
+        return None
+    stop_tracking_job(key)
+    # The result is handed over to the session and released from the jobs of the process
+    return jobs.collect_job(job_id)
+
+
+def diagnostics_panel() -> None:
+    """
+    Show the records of the instrumented functions in the sidebar.
+    """
+    df = instrument.get_records().rename(columns={
+        "time": "時刻", "name": "関数", "wall": "時間（秒）", "rows_in": "入力行数", "rows_out": "出力行数", "memory": "メモリ（MB）"
+    })
+    df["メモリ（MB）"] = df["メモリ（MB）"] / 2**20
+    with st.sidebar.expander(":material/monitoring: 診断", expanded=False):
+        st.dataframe(
+            df, 
+            hide_index=True, 
+            column_config={
+                "時間（秒）": st.column_config.NumberColumn(format="%.3f"), 
+                "メモリ（MB）": st.column_config.NumberColumn(format="%.1f")
+            }
+        )
+        # Total time per function
+        st.dataframe(
+            df.groupby("関数")["時間（秒）"].agg(["count", "sum", "max"]).sort_values("sum", ascending=False), 
+            column_config={
+                "count": "回数", 
+                "sum": st.column_config.NumberColumn("合計（秒）", format="%.3f"), 
+                "max": st.column_config.NumberColumn("最大（秒）", format="%.3f")
+            }
+        )
+        st.button(
+            label=":material/delete: 記録を消去", 
+            key="clear_diagnostics", 
+            on_click=instrument.clear_records
+        )
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from poscope import forecast, ingest, synthetic
+
+
+def make_calendar(info) -> pd.DataFrame:
+    """
+    Return calendar data of two weeks of spring classes with `info` on every day.
+    """
+    dates = pd.date_range("2024-04-15", "2024-04-28")
+    return pd.DataFrame({
+        "date": dates,
+        "academic_year": 2024,
+        "term": "SPR",
+        "class": np.where(dates.weekday < 5, dates.strftime("%a").str.upper(), "NoClass"),
+        "info": info
+    })
+
+
+def test_tokenize_calendar():
+    df_cal = make_calendar(None)
+    df_cal.loc[0, "info"] = "OnlineExam, TOEFL"
+    df_cal.loc[1, "info"] = "Holiday"
+    events = forecast.tokenize_calendar(df_cal)
+    assert events.loc[0, ["info=OnlineExam", "info=TOEFL"]].tolist() == [1, 1]
+    assert events["info=Holiday"].sum() == 1
+    assert events["term=SPR"].sum() == len(df_cal)
+
+
+def test_empty_info():
+    # `read_excel()` returns a float column of NaN when the calendar has no "info"
+    df_cal = make_calendar(np.nan)
+    df_dim = ingest.build_calendar_dim(df_cal)
+    assert not any(c.startswith("info=") for c in forecast.get_event_columns(df_dim))
+    assert (df_dim["holiday"] == 0).all() and (df_dim["replaced"] == 0).all()
+    assert df_dim.index.is_monotonic_increasing
+
+
+def test_batch_and_online_models_agree():
+    # Both learning modes solve the same ridge regression on the same days
+    rng = np.random.default_rng(0)
+    df_cal = synthetic.make_calendar(pd.Timestamp("2024-04-01"), pd.Timestamp("2024-12-31"))
+    df_syl = synthetic.make_syllabus(rng, [2024], 1)[0]
+    df_dim = ingest.build_calendar_dim(df_cal).reset_index()
+    dates = pd.date_range("2024-04-01", "2024-10-31")
+    df_pos = pd.Series(rng.poisson(200, len(dates)), index=dates, name="客数")
+    yX_tr, X_pred = forecast.split_data(forecast.concatenate_data(df_pos, df_dim, df_syl))
+    yX = yX_tr.dropna(subset=forecast.FEATURES)
+    model = forecast.train_model(np.log(yX["客数"]), forecast.design_matrix(yX))
+    _, result = forecast.fit_online(None, yX_tr, X_pred)
+    np.testing.assert_allclose(result["coef"], model.coef_, atol=1e-6)
+    assert abs(result["intercept"] - model.intercept_) < 1e-6
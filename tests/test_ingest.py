@@ -0,0 +1,24 @@
+import pandas as pd
+
+from poscope import dataset, ingest, registry, synthetic, visualize
+
+
+def test_missing_values_round_trip(tmp_path):
+    # Blank cells of the exports stay missing through the cleanup and the dataset, instead of becoming "nan" items
+    df_checkouts, df_items, df_payments = ingest.read_pos_zips(synthetic.generate_zips("2024-05-01", 31, scale=0.5))
+    df_cus, df_itm = ingest.cleanup_pos(df_checkouts, df_items, df_payments)
+    assert df_itm[["SKU", "バーコード", "部門"]].isna().any(axis="index").all()
+    dataset.write_pos(str(tmp_path), df_cus, df_itm)
+    date = (pd.Timestamp("2024-05-01").date(), pd.Timestamp("2024-05-31").date())
+    df_read = dataset.read_pos(str(tmp_path), "items", date, registry.ALL_STORES)
+    assert len(df_read) == len(df_itm)
+    for column in ingest.TEXT_COLUMNS:
+        assert df_read[column].isna().sum() == df_itm[column].isna().sum()
+        assert not df_read[column].isin(["nan", "None", ""]).any()
+    # The co-purchase statistics do not depend on where the items were read from
+    df_pairs, support, n_tx = visualize.basket(df_read, "部門")
+    df_pairs_mem, support_mem, n_tx_mem = visualize.basket(df_itm, "部門")
+    assert n_tx == n_tx_mem == df_itm["会計ID"].nunique()
+    assert support.sort_index().equals(support_mem.sort_index())
+    assert not support.index.isna().any()
+    assert not df_pairs[["商品A", "商品B"]].isna().any(axis=None)